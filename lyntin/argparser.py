@@ -52,13 +52,19 @@ Supported options::
 
   nodefaults:bool (default=off): turn off default lookups through variables.
 
+  cache:int (default=0): remember the results of parsing this many
+            distinct argument strings.  Commands that get called
+            over and over again with the same arguments (from
+            actions and aliases, for example) can turn this on
+            to skip the tokenizing and type checking.
+
 Refer to the modules.lyntincmds and modules.tintincmds for examples
 on arg specs and commands and how it all intertwines.
 """
-import re, time
+import re, time, threading
 import utils
 
-defaultOptions={ "stripBraces": 1, "noparsing": 0, "limitparsing": -1, "nodefaults":0 }
+defaultOptions={ "stripBraces": 1, "noparsing": 0, "limitparsing": -1, "nodefaults":0, "cache": 0 }
 optionParser = None
 
 class ParserException(Exception):
@@ -95,6 +101,19 @@ class ArgumentParser:
     else:
       self.options = defaultOptions.copy()
     self.buildParsers(argspec)
+
+    # parse results keyed on the input string--see parse.  this is
+    # None unless the "cache" option was set and all our typecheckers
+    # produce the same thing for the same input.
+    self._cache = None
+    self._cacheorder = []
+    # commands can be parsed on several session workers at once (see
+    # the sessionworkers config item), so the cache goes through this.
+    self._cachelock = threading.Lock()
+    self._cachehits = 0
+    self._cachemisses = 0
+    if self.options["cache"] > 0 and self.isCacheable():
+      self._cache = {}
     return
 
   def getOption(self, optionname):
@@ -113,6 +132,18 @@ class ArgumentParser:
     else:
       return None
 
+  def getCacheStats(self):
+    """
+    Returns statistics for the parse result cache.
+
+    @return: (hits, misses, number of entries) or None if this
+        ArgumentParser isn't caching
+    @rtype: tuple of ints or None
+    """
+    if self._cache == None:
+      return None
+    return (self._cachehits, self._cachemisses, len(self._cache))
+
   def buildOptions(self, argoptions):
     """
     Set the options for this ArgumentParser
@@ -157,6 +188,7 @@ class ArgumentParser:
 
     # set types for certain options
     self.options["limitparsing"] = int(self.options["limitparsing"])
+    self.options["cache"] = int(self.options["cache"])
 
   def buildParsers(self, argspec):
     """
@@ -189,6 +221,7 @@ class ArgumentParser:
     self.indexparsers = []
     self.extraindexparser = None
     self.extranamedparser = None
+    self._cacheable = 1
 
     self.argspec = self.split(argspec, buildsyntaxline=1)
 
@@ -231,6 +264,8 @@ class ArgumentParser:
         raise ParserException, "Unknown type specifier: %s" % (typespec)
 
       parser.setTypeChecker(typechecker)
+      if not typechecker.cacheable:
+        self._cacheable = 0
 
       if argdef != None:
         parser.setDefault(parser.parse(argdef))
@@ -272,6 +307,93 @@ class ArgumentParser:
         appropriate collection arguments specified, or if required arguments
         are missing, or if arguments passed in aren't valid
     """    
+    if self._cache == None:
+      return self._parse(input, defaultresolver)
+
+    # the cache entry holds the argument names we asked the resolver
+    # about along with what it told us.  if it tells us the same
+    # thing now, then the results are the same.
+    # no resolver is the same as a resolver that has no defaults.
+    entry = self._cache.get(input)
+    if entry != None:
+      resolved, argdict = entry
+      for key, val in resolved:
+        if defaultresolver == None:
+          current = None
+        else:
+          current = defaultresolver(key)
+        if current != val:
+          break
+      else:
+        self._cachelock.acquire()
+        self._cachehits += 1
+        self._cachelock.release()
+        return _copy_argdict(argdict)
+
+    argdict, resolved = self.parseRecorded(input, defaultresolver)
+
+    self._cachelock.acquire()
+    try:
+      self._cachemisses += 1
+      if not self._cache.has_key(input):
+        if len(self._cacheorder) >= self.options["cache"]:
+          self._cache.pop(self._cacheorder.pop(0), None)
+        self._cacheorder.append(input)
+      self._cache[input] = (resolved, argdict)
+    finally:
+      self._cachelock.release()
+
+    return _copy_argdict(argdict)
+
+  def parseRecorded(self, input, defaultresolver=None):
+    """
+    Parses the input like parse does, but also returns what the
+    defaultresolver told us.  If the defaultresolver returns the same
+    values for those argument names later on, then parsing the input 
+    again gives the same results.  The argdict doesn't go through the
+    cache.
+
+    @param input: the user input string
+    @type  input: string
+
+    @param defaultresolver: see parse
+    @type  defaultresolver: function
+
+    @return: the populated dictionary and a list of (argument name, 
+        value the defaultresolver returned) tuples
+    @rtype: (dict, list of tuples)
+
+    @raise ParserException: see parse
+    """
+    # we record the argument names even without a resolver so a
+    # later parse with a resolver checks them.
+    resolved = []
+    def recordingresolver(key, resolved=resolved, 
+                          defaultresolver=defaultresolver):
+      if defaultresolver == None:
+        val = None
+      else:
+        val = defaultresolver(key)
+      resolved.append((key, val))
+      return val
+
+    return self._parse(input, recordingresolver), resolved
+
+  def isCacheable(self):
+    """
+    Returns whether parsing the same input always gives the same
+    results.  This is false if we have typecheckers that depend on
+    the time or evaluate python code.
+
+    @return: 1 if it's cacheable, 0 if not
+    @rtype:  boolean
+    """
+    return self._cacheable
+
+  def _parse(self, input, defaultresolver):
+    """
+    Does the actual work for parse.  See parse for details.
+    """
     argdict = {}
 
     arguments = self.split(input, self.getOption("limitparsing"))
@@ -470,6 +592,26 @@ class ArgumentParser:
     
     return arguments
 
+def _copy_argdict(argdict):
+  """
+  Copies an argument dict so that the caller can do what it likes with
+  it without touching the cached version.  Collection arguments are
+  lists and dicts so those get copied too.
+
+  @param argdict: the argument dict to copy
+  @type  argdict: dict
+
+  @return: the copy
+  @rtype:  dict
+  """
+  newdict = argdict.copy()
+  for key, val in newdict.items():
+    if type(val) == type([]):
+      newdict[key] = list(val)
+    elif type(val) == type({}):
+      newdict[key] = val.copy()
+  return newdict
+
 class Parser:
   """
   This is the base class for the parsers that argumentparser uses to
@@ -679,6 +821,10 @@ class TypeChecker:
   """
   Trivial base class for argument checkers
   """
+  # whether check always returns the same thing for the same argument.
+  # ArgumentParsers with checkers that don't won't cache parse results.
+  cacheable = 1
+
   def __init__(self, typename, typeargs):
     """
     Initializes the TypeChecker.  Over-ridden by all the TypeChecker 
@@ -832,6 +978,8 @@ class EvalChecker(TypeChecker):
   """
   Evaluate its input argument as python code and return the resulting object.
   """
+  cacheable = 0
+
   def __init__(self, typename, typeargs):
     if typeargs:
       raise ParserException, "TypeArgs (%s) specified for non-configurable type (%s)" % (typeargs, typename)
@@ -891,6 +1039,8 @@ class TimeChecker(TypeChecker):
   Will also accept a time specification and apply it as a delta from
   _now_.  converts to the standard seconds-from_epoch. 
   """
+  cacheable = 0
+
   def __init__(self, typename, typeargs):
     if typeargs:
       raise ParserException, "TypeArgs (%s) specified for non-configurable type (%s)" % (typeargs, typename)
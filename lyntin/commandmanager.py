@@ -54,9 +54,43 @@ X{default_resolver_hook}::
    commandname - the name of the command that was executed
 
 """
-import inspect, re
+import inspect, re, types
 from lyntin import manager, exported, argparser, utils
 
+# a % that the variable expansion might eat--%1 style placement 
+# variables are fine
+_UNCOMPILABLE_PERCENT = re.compile(r"%(?!\d)")
+
+# the user_filter_hook functions whose effects _isPlainCommand checks
+# for.  compiled commands skip the user_filter_hook, so if anything
+# else is registered with it, we don't compile or run them.
+_PLAIN_FILTERS = ["lyntin.modules.variable.VariableManager.userfilter",
+                  "lyntin.modules.variable.VariableManager.denestVars",
+                  "lyntin.modules.alias.AliasManager.userfilter",
+                  "lyntin.modules.speedwalk.SpeedwalkManager.userfilter",
+                  "lyntin.commandmanager.CommandManager.filter"]
+
+def _is_plain_data(data):
+  """
+  Returns whether data is made up of strings, numbers, None, lists,
+  tuples, and dicts--the stuff marshal can write out and read back.
+  """
+  if data == None or type(data) in (types.StringType, types.UnicodeType,
+                                    types.IntType, types.LongType,
+                                    types.FloatType, types.BooleanType):
+    return 1
+  if type(data) in (types.ListType, types.TupleType):
+    for mem in data:
+      if not _is_plain_data(mem):
+        return 0
+    return 1
+  if type(data) == types.DictType:
+    for key, val in data.items():
+      if not _is_plain_data(key) or not _is_plain_data(val):
+        return 0
+    return 1
+  return 0
+
 class _CommandData:
   """
   Holds data relating to a command.  It's a helper class.
@@ -81,6 +115,84 @@ class _CommandData:
   def setFQN(self, fqn): self._fqn = fqn
   def getFQN(self): return self._fqn
 
+class _CommandTrie:
+  """
+  Prefix tree over the command names.  It's a helper class for the
+  CommandManager which uses it to figure out which command the user
+  meant when they typed an abbreviation (i.e. "#al" -> "#alias")
+  without walking the whole command list.
+
+  Each node is a list of [first name, children] where "first name"
+  is the name that sorts lowest of all the names that pass through
+  that node.  Walking the sorted command list and taking the first
+  name that starts with the word gives you that same name, so we get
+  the same answer by walking len(word) nodes.
+
+  Names that start with a ^ are regular expressions and must be
+  typed in full--those are precompiled and kept in a separate
+  sorted list.
+  """
+  def __init__(self, names):
+    """
+    Builds the trie.
+
+    @param names: the command names to build the trie from
+    @type  names: list of strings
+    """
+    names = list(names)
+    names.sort()
+
+    self._root = [None, {}]
+    self._regexps = []
+
+    for name in names:
+      if name.startswith("^"):
+        self._regexps.append((name, re.compile(name)))
+        continue
+
+      # since the names are sorted, the first name to pass through
+      # a node is the lowest one.
+      node = self._root
+      if node[0] == None:
+        node[0] = name
+      for c in name:
+        children = node[1]
+        if not children.has_key(c):
+          children[c] = [name, {}]
+        node = children[c]
+
+  def lookup(self, word):
+    """
+    Returns the name of the command that the word refers to.  This
+    is the lowest sorting name that either starts with the word or
+    is a ^ name whose regexp matches the word.
+
+    @param word: the command word the user typed (without the
+        command character)
+    @type  word: string
+
+    @return: the command name or None
+    @rtype:  string
+    """
+    node = self._root
+    for c in word:
+      node = node[1].get(c)
+      if node == None:
+        break
+
+    if node != None:
+      best = node[0]
+    else:
+      best = None
+
+    for name, regexp in self._regexps:
+      if best != None and name > best:
+        break
+      if regexp.search(word):
+        return name
+
+    return best
+
 class CommandManager(manager.Manager):
   """ 
   The CommandManager holds a series of _CommandData objects
@@ -95,6 +207,10 @@ class CommandManager(manager.Manager):
     self._commands = {}
     self._engine = e
 
+    # the _CommandTrie we dispatch with--this gets rebuilt when
+    # someone adds or removes a command
+    self._trie = None
+
   def getCommands(self):
     """
     Returns a list of the commands we have registered.
@@ -150,6 +266,7 @@ class CommandManager(manager.Manager):
 
     # toss the command thing in the dict
     self._commands[name] = cd
+    self._trie = None
 
     # deal with the help text
     if not helptext:
@@ -185,6 +302,7 @@ class CommandManager(manager.Manager):
     if self._commands.has_key(name):
       cd = self._commands[name]
       del self._commands[name]
+      self._trie = None
       try:
         exported.remove_help(cd.getFQN())
       except:
@@ -232,6 +350,208 @@ class CommandManager(manager.Manager):
 
     return None
 
+  def getParserCacheStats(self):
+    """
+    Returns the parse result cache statistics for all the commands
+    whose ArgumentParsers are caching (see the "cache" argoption
+    in argparser).
+
+    @return: list of (command name, hits, misses, entries) tuples
+        sorted by command name
+    @rtype:  list of tuples
+    """
+    data = []
+    for name, cd in self._commands.items():
+      ap = cd.getArgParser()
+      if ap == None:
+        continue
+      stats = ap.getCacheStats()
+      if stats != None:
+        data.append((name,) + stats)
+    data.sort()
+    return data
+
+  def findCommand(self, word):
+    """
+    Figures out which command the user meant by the word they typed.
+    The word can be an abbreviation of a command name ("al" for
+    "alias") or must match the full name for commands whose names
+    start with a ^.  If several commands match, the one whose name
+    sorts first wins.
+
+    @param word: the first word of the command line without the
+        command character
+    @type  word: string
+
+    @return: the name of the command or None
+    @rtype:  string
+    """
+    if self._trie == None:
+      self._trie = _CommandTrie(self._commands.keys())
+    return self._trie.lookup(word)
+
+  def compileCommand(self, ses, text):
+    """
+    Parses a command line ahead of time so that it can be run later 
+    with runCompiledCommand without going back through the user input
+    pipeline.  We only do this for lines that the user_filter_hook
+    would leave alone: ones without variables, escapes, or split
+    characters that aren't aliases, speedwalks, loops, or session 
+    commands.  If a function we don't know about is registered with
+    the user_filter_hook, we don't compile anything.
+
+    The result only holds strings, numbers, lists, and dicts so it
+    can be marshalled.
+
+    @param ses: the session the command will be executed in
+    @type  ses: session.Session
+
+    @param text: the command line including the command character
+    @type  text: string
+
+    @return: the compiled command or None if this line has to go
+        through the user input pipeline
+    @rtype:  tuple
+    """
+    configmanager = self._engine.getConfigManager()
+    commandchar = configmanager.get("commandchar")
+    splitchar = configmanager.get("splitchar")
+
+    if len(text) < 2 or not text.startswith(commandchar):
+      return None
+
+    if "$" in text or "\\" in text or splitchar in text or \
+        _UNCOMPILABLE_PERCENT.search(text):
+      return None
+
+    if not self._isPlainCommand(ses, text):
+      return None
+
+    words = text[1:].split(" ", 1)
+    if len(words) < 2: words.append("")
+
+    # config can change the command character and such out from
+    # under us, so it always goes the long way
+    name = self.findCommand(words[0])
+    if name == None or name == "config":
+      return None
+
+    ap = self.getArgParser(name)
+    if ap == None or not ap.isCacheable():
+      return None
+
+    resolver = exported.hook_spam("default_resolver_hook", 
+                        {"session": ses, "commandname": name}, 
+                        mappingfunc=exported.query_mapper, 
+                        donefunc=exported.query_done)
+    if resolver == None:
+      resolver = lambda x: None
+
+    try:
+      argdict, resolved = ap.parseRecorded(words[1], resolver)
+    except (ValueError, argparser.ParserException):
+      # let the regular path report the error
+      return None
+
+    if not _is_plain_data(argdict) or not _is_plain_data(resolved):
+      return None
+
+    return (text, words[0], name, ap.syntaxline, argdict, resolved, commandchar)
+
+  def runCompiledCommand(self, ses, compiled):
+    """
+    Runs a command compiled by compileCommand.  If things have changed
+    such that the command would be parsed differently now (the command
+    character changed, an alias or session shadows the command, the
+    defaults for the arguments changed...) then this doesn't run it.
+
+    @param ses: the session to execute the command in
+    @type  ses: session.Session
+
+    @param compiled: the result of compileCommand
+    @type  compiled: tuple
+
+    @return: 1 if the command was run, 0 if the caller needs to run
+        the text through exported.lyntin_command instead
+    @rtype:  boolean
+    """
+    text, word, name, syntaxline, argdict, resolved, commandchar = compiled
+
+    if self._engine.getConfigManager().get("commandchar") != commandchar:
+      return 0
+
+    if not self._isPlainCommand(ses, text):
+      return 0
+
+    if self.findCommand(word) != name:
+      return 0
+
+    argumentparser = self.getArgParser(name)
+    if argumentparser == None or argumentparser.syntaxline != syntaxline:
+      return 0
+
+    if resolved:
+      resolver = exported.hook_spam("default_resolver_hook", 
+                          {"session": ses, "commandname": name}, 
+                          mappingfunc=exported.query_mapper, 
+                          donefunc=exported.query_done)
+      for key, val in resolved:
+        if resolver:
+          newval = resolver(key)
+        else:
+          newval = None
+        if newval != val:
+          return 0
+
+    fixedmem = name
+    if fixedmem.startswith("^"):
+      fixedmem = fixedmem[1:]
+
+    argdict = argdict.copy()
+    argdict["command"] = name
+    try:
+      self.getCommand(name)(ses, argdict, text[1:])
+    except ValueError, e:
+      exported.write_error("%s: %s\nsyntax: %s%s %s" % 
+                           (fixedmem, e, commandchar, fixedmem,
+                            argumentparser.syntaxline))
+    except argparser.ParserException, e:
+      exported.write_error("%s: %s\nsyntax: %s%s %s" % 
+                           (fixedmem, e, commandchar, fixedmem,
+                            argumentparser.syntaxline))
+    return 1
+
+  def _isPlainCommand(self, ses, text):
+    """
+    Checks that the engine and the user_filter_hook won't do anything
+    with this command line before it gets to filter.
+    """
+    for func in self._engine.getHook("user_filter_hook").getList():
+      # hook profiling wraps the functions
+      func = getattr(func, "_func", func)
+      try:
+        name = "%s.%s.%s" % (func.__module__, func.im_class.__name__, 
+                             func.__name__)
+      except AttributeError:
+        return 0
+      if name not in _PLAIN_FILTERS:
+        return 0
+
+    word = text[1:].split(" ", 1)[0]
+    if word.isdigit() or word == "all" or word.startswith("@"):
+      return 0
+    if self._engine.getSession(word) != None:
+      return 0
+
+    am = exported.get_manager("alias")
+    if am and am.getAlias(ses, text) != None:
+      return 0
+
+    sm = exported.get_manager("speedwalk")
+    if sm and sm.isSpeedwalk(ses, text):
+      return 0
+    return 1
+
   def filter(self, args):
     """
     Takes in user command lines and handles commands that start
@@ -266,48 +586,38 @@ class CommandManager(manager.Manager):
         return
 
       # this finds the first matching command and ends there.
-      commands = self.getCommands()
-      commands.sort()
-      for mem in commands:
-        command = None
-        if mem.startswith("^"):
-          if re.compile(mem).search(words[0]):
-            command = self.getCommand(mem)
+      mem = self.findCommand(words[0])
+      if mem:
+        command = self.getCommand(mem)
+        argumentparser = self.getArgParser(mem)
+        if argumentparser == None:
+          command(ses, input.split(" "), input)
         else:
-          if mem.startswith(words[0]):
-            command = self.getCommand(mem)
-
-        if command:
-          argumentparser = self.getArgParser(mem)
-          if argumentparser == None:
-            command(ses, input.split(" "), input)
-          else:
-            # for printing out the error message, we remove the ^
-            # from the command name if it's there.
-            fixedmem = mem
-            if len(fixedmem) > 0 and fixedmem.startswith("^"):
-              fixedmem = fixedmem[1:]
-
-            resolver = exported.hook_spam("default_resolver_hook", 
-                                {"session": ses, "commandname": mem}, 
-                                mappingfunc=exported.query_mapper, 
-                                donefunc=exported.query_done)
-
-            try:
-              argdict = argumentparser.parse(words[1], resolver)
-              argdict["command"]=mem
-              command(ses, argdict, input)
-            except ValueError, e:
-              exported.write_error("%s: %s\nsyntax: %s%s %s" % 
-                                   (fixedmem, e, commandchar, fixedmem,
-                                    argumentparser.syntaxline))
-            except argparser.ParserException, e:
-              exported.write_error("%s: %s\nsyntax: %s%s %s" % 
-                                   (fixedmem, e, commandchar, fixedmem,
-                                    argumentparser.syntaxline))
-          if internal == 0:
-            ses.prompt()
-          break
+          # for printing out the error message, we remove the ^
+          # from the command name if it's there.
+          fixedmem = mem
+          if len(fixedmem) > 0 and fixedmem.startswith("^"):
+            fixedmem = fixedmem[1:]
+
+          resolver = exported.hook_spam("default_resolver_hook", 
+                              {"session": ses, "commandname": mem}, 
+                              mappingfunc=exported.query_mapper, 
+                              donefunc=exported.query_done)
+
+          try:
+            argdict = argumentparser.parse(words[1], resolver)
+            argdict["command"]=mem
+            command(ses, argdict, input)
+          except ValueError, e:
+            exported.write_error("%s: %s\nsyntax: %s%s %s" % 
+                                 (fixedmem, e, commandchar, fixedmem,
+                                  argumentparser.syntaxline))
+          except argparser.ParserException, e:
+            exported.write_error("%s: %s\nsyntax: %s%s %s" % 
+                                 (fixedmem, e, commandchar, fixedmem,
+                                  argumentparser.syntaxline))
+        if internal == 0:
+          ses.prompt()
 
       else:
         if internal == 0:
@@ -39,8 +39,12 @@ X{config_change_hook}::
              no previous value.
 
    newvalue - the new value of the config item
+
+Code that reads config items for every line (filters, the net
+layer, uis) should use a ConfigSnapshot from getSnapshot rather than
+calling get.
 """
-import types, copy
+import types, copy, threading
 from lyntin import exported, utils, manager, constants
 
 # this holds a list of all the modules Lyntin has dynamically imported
@@ -217,6 +221,49 @@ class BoolConfig(ConfigBase):
     return bv(self._value) + " (bool)"
 
 
+class ChoiceConfig(ConfigBase):
+  """
+  Holds a string that has to be one of a list of choices.
+  """
+  def __init__(self, name, originalvalue, persist, description, choices):
+    """
+    Sets the name, original value, and choices.  Arguments are the
+    same as ConfigBase except for:
+
+    @param choices: the values the config item can have
+    @type  choices: list of strings
+    """
+    ConfigBase.__init__(self, name, originalvalue, persist, description)
+    self._choices = choices
+
+  def check(self, value):
+    if not isinstance(value, basestring):
+      raise TypeError("Value is not of type string.")
+
+    if value not in self._choices:
+      raise ValueError("Value must be one of: %s." % ", ".join(self._choices))
+
+    return value
+
+  def toString(self):
+    return repr(self._value) + " (%s)" % "|".join(self._choices)
+
+
+class ConfigSnapshot:
+  """
+  The values of a session's config items as of one version of the
+  config.  The values are attributes named after the items 
+  (snapshot.ansicolor) so reading one is a plain attribute lookup.
+
+  A snapshot doesn't change when the config does--get a new one
+  from the ConfigManager for each line or command rather than 
+  holding onto it.
+  """
+  def __init__(self, version, values):
+    self.__dict__.update(values)
+    self._version = version
+
+
 class ConfigManager(manager.Manager):
   """
   Holds all the configuration pieces for Lyntin.
@@ -227,6 +274,15 @@ class ConfigManager(manager.Manager):
     self._engine = e
     e.hookRegister("write_hook", self.persist)
 
+    # sessions can run in their own threads (see the sessionworkers
+    # config item) so changes to the config go through this lock.
+    self._lock = threading.RLock()
+
+    # session -> ConfigSnapshot.  every change to the config bumps
+    # the version which makes all the snapshots stale.
+    self._snapshots = {}
+    self._version = 0
+
   def add(self, name, configitem, ses=None):
     """
     Adds a new configuration item.
@@ -244,14 +300,18 @@ class ConfigManager(manager.Manager):
     @raises ValueError: if we already have an item in that session with
         that name.
     """
-    if not self._config.has_key(ses):
-      self._config[ses] = {}
+    self._lock.acquire()
+    try:
+      if not self._config.has_key(ses):
+        self._config[ses] = {}
 
-    if self._config[ses].has_key(name):
-      raise ValueError("Already have a config item of that name.")
+      if self._config[ses].has_key(name):
+        raise ValueError("Already have a config item of that name.")
 
-    self._config[ses][name] = configitem
-    self._configChangeHook(ses, name, None, configitem.get())
+      self._config[ses][name] = configitem
+      self._configChangeHook(ses, name, None, configitem.get())
+    finally:
+      self._lock.release()
 
   def remove(self, name, ses=None):
     """
@@ -266,13 +326,18 @@ class ConfigManager(manager.Manager):
 
     @raises ValueError: if the item does not exist
     """
-    if not self._config.has_key(ses):
-      raise ValueError("That session does not exist.")
-
-    if not self._config[ses].has_key(name):
-      raise ValueError("That item does not exist.")
-
-    del self._config[ses][name]
+    self._lock.acquire()
+    try:
+      if not self._config.has_key(ses):
+        raise ValueError("That session does not exist.")
+
+      if not self._config[ses].has_key(name):
+        raise ValueError("That item does not exist.")
+
+      del self._config[ses][name]
+      self._version += 1
+    finally:
+      self._lock.release()
     
   def change(self, name, newvalue, ses=None):
     """
@@ -290,14 +355,18 @@ class ConfigManager(manager.Manager):
     @param ses: the session (or None if this is not session-scoped)
     @type  ses: Session
     """
-    if not self._config.has_key(ses):
-      raise ValueError("Session '%s' does not exist." % repr(ses))
+    self._lock.acquire()
+    try:
+      if not self._config.has_key(ses):
+        raise ValueError("Session '%s' does not exist." % repr(ses))
 
-    if not self._config[ses].has_key(name):
-      raise ValueError("No config item of that name.")
+      if not self._config[ses].has_key(name):
+        raise ValueError("No config item of that name.")
 
-    oldvalue = self._config[ses][name].set(newvalue)
-    self._configChangeHook(ses, name, oldvalue, self._config[ses][name].get())
+      oldvalue = self._config[ses][name].set(newvalue)
+      self._configChangeHook(ses, name, oldvalue, self._config[ses][name].get())
+    finally:
+      self._lock.release()
 
   def get(self, name, ses=None, defaultvalue=constants.NODEFAULTVALUE):
     """
@@ -329,7 +398,48 @@ class ConfigManager(manager.Manager):
 
     return self._config[ses][name].get()
 
+  def getSnapshot(self, ses=None):
+    """
+    Gets the values of all the config items for a session as a 
+    ConfigSnapshot.  This is for code that reads config items for 
+    every line--the snapshot is cached until the config changes, so 
+    this is a lot cheaper than calling get for each item.
+
+    @param ses: the session (or None for the general Lyntin items)
+    @type  ses: Session
+
+    @return: the snapshot
+    @rtype:  ConfigSnapshot
+
+    @raises ValueError: if the session does not exist
+    """
+    snapshot = self._snapshots.get(ses)
+    if snapshot is None or snapshot._version != self._version:
+      snapshot = self._takeSnapshot(ses)
+    return snapshot
+
+  def _takeSnapshot(self, ses):
+    self._lock.acquire()
+    try:
+      if not self._config.has_key(ses):
+        if ses == None:
+          self._config[None] = {}
+        else:
+          raise ValueError(u"Session '%s' does not exist." % ses.getName())
+
+      values = {}
+      for name, item in self._config[ses].items():
+        values[name] = item.get()
+      snapshot = ConfigSnapshot(self._version, values)
+      self._snapshots[ses] = snapshot
+      return snapshot
+    finally:
+      self._lock.release()
+
   def _configChangeHook(self, ses, name, value, newvalue):
+    # the snapshots have to be stale before the hook functions run
+    # in case they look at the config
+    self._version += 1
     exported.hook_spam("config_change_hook", 
         {"session": ses, "name": name, "oldvalue": value, "newvalue": newvalue })
 
@@ -380,16 +490,28 @@ class ConfigManager(manager.Manager):
     if not basesession or not self._config.has_key(basesession):
       return
 
-    x = {}
+    self._lock.acquire()
+    try:
+      x = {}
 
-    for mem in self._config[basesession].values():
-      x[mem._name] = copy.deepcopy(mem)
+      for mem in self._config[basesession].values():
+        x[mem._name] = copy.deepcopy(mem)
 
-    self._config[newsession] = x
+      self._config[newsession] = x
+      self._version += 1
+    finally:
+      self._lock.release()
 
   def removeSession(self, ses):
-    if self._config.has_key(ses):
-      del self._config[ses]
+    self._lock.acquire()
+    try:
+      if self._config.has_key(ses):
+        del self._config[ses]
+      if self._snapshots.has_key(ses):
+        del self._snapshots[ses]
+      self._version += 1
+    finally:
+      self._lock.release()
 
   def persist(self, args):
     """
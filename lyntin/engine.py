@@ -56,8 +56,7 @@ X{shutdown_hook}::
 
 X{timer_hook}::
 
-   The timer hook spams all registered functions every second.  This
-   is how the scheduler works.
+   The timer hook spams all registered functions every second.
 
    Arg mapping: { "tick": int }
 
@@ -121,12 +120,24 @@ X{session_change_hook}::
    new - the session that is being changed to
 
    previous - the session that was previously the current session
+
+
+X{diagnostics_hook}::
+
+   Gets spammed when the user runs #diagnostics.  Registered functions
+   return a list of strings to add to the output which lets modules 
+   report on caches, timings, and other such things.
+
+   Arg mapping: {}
 """
-import Queue, thread, sys, traceback, os.path
+import thread, threading, sys, traceback, os.path, time
 from threading import Thread
 
 from lyntin import config, session, utils, event, exported, helpmanager, history, commandmanager, constants
 
+# the bucket bounds (in seconds) for the event timing histograms
+EVENT_TIMING_BUCKETS = [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 
+                        0.5, 1.0, 5.0]
 
 class Engine:
   """
@@ -138,11 +149,53 @@ class Engine:
     """ Initializes the engine."""
 
     # this is the event queue that holds all the events in
-    # the system.
-    self._event_queue = Queue.Queue()
+    # the system.  it has a lane for each kind of event so that
+    # user input doesn't wait behind a flood of mud data.  the 
+    # weights get set from the config in _setupConfiguration.
+    self._event_queue = utils.LaneQueue([("input", 8), ("timer", 2), ("mud", 1)])
 
-    # counts the total number of events processed--for diagnostics
+    # counts the total number of events processed--for diagnostics.
+    # the session workers add to it too, so it goes through the lock.
     self._num_events_processed = 0
+    self._num_events_lock = thread.allocate_lock()
+
+    # runengine handles events in batches--these are for diagnostics.
+    # only the runengine thread touches them.
+    self._num_batches = 0
+    self._num_batch_events = 0
+    self._max_batch = 0
+    self._batch_time = 0.0
+    self._max_batch_time = 0.0
+
+    # event class name -> (queue wait, execute time) utils.Histogram
+    # tuples.  this is None unless the eventtiming config item is on.
+    self._eventtimings = None
+    self._eventtimings_lock = thread.allocate_lock()
+
+    # whether or not the current thread is in the middle of handling
+    # a batch of events (see inBatch)
+    self._batchstate = threading.local()
+
+    # session -> _SessionWorker for sessions that handle their events
+    # in their own thread (see the sessionworkers config item).  changes
+    # to it and putting events in a worker's queue go through the lock
+    # so that a worker can't retire with events still headed its way.
+    self._workers = {}
+    self._workers_lock = threading.Lock()
+
+    # the thread that's running runengine
+    self._enginethread = None
+
+    # flood control for mud events (see _floodControl).  these get set
+    # from the queuelimit and floodpolicy config items.
+    self._queuelimit = 0
+    self._floodpolicy = "block"
+    self._floodstats = {"blocked": 0, "blocktime": 0.0, "coalesced": 0,
+                        "displayonly": 0}
+
+    # sessions we've told the user are flooded under the "display"
+    # floodpolicy -> 1
+    self._flooded = {}
 
     # holds all the sessions
     self._sessions = {}
@@ -153,6 +206,10 @@ class Engine:
     # map of hook name -> utils.PriorityQueue objects
     self._hooks = {}
 
+    # whether we're profiling the functions registered with hooks
+    # (see setHookProfiling)
+    self._hookprofiling = 0
+
     # this is a lock for writing stuff to the ui--makes sure
     # we're not hosing things by having multiple things write
     # to the ui simultaneously....  ick.
@@ -231,6 +288,27 @@ class Engine:
           "\"north\" again, if repeathistory is on, we record both.  " +
           "Otherwise we would only record the first one."))
 
+    c.add("historysize", config.IntConfig("historysize", 
+          int(cops.get("historysize", 1000)), 0, 
+          "How many lines of user input we keep in the history buffer."))
+
+    c.add("savehistory", config.BoolConfig("savehistory", 
+          utils.convert_boolean(cops.get("savehistory", 0)), 0, 
+          "Whether (1) or not (0) we save the history buffer in the " +
+          "historyfile so it's still there the next time you start " +
+          "Lyntin.  Input that isn't echoed (like passwords) never gets " +
+          "recorded."))
+
+    historyfile = cops.get("historyfile", ".lyntinhistory")
+    if type(historyfile) is list:
+      historyfile = historyfile[0]
+    c.add("historyfile", config.StringConfig("historyfile", historyfile, 0,
+          "The file we save the history buffer in when savehistory is " +
+          "on.  It's relative to your datadir unless it's an absolute " +
+          "path."))
+    self._managers["history"].setSize(c.get("historysize"))
+    self._managers["history"].setHistoryFile(self._getHistoryFile())
+
     c.add("commandchar", config.CharConfig("commandchar", 
           config.options.get("commandchar", "#"), 0, 
           "The character used to denote a command."))
@@ -262,8 +340,114 @@ class Engine:
           config.options.get("splitchar", ";"), 0,
           "The character used to split commands in a single input."))
 
+    for lane, weight in (("input", 8), ("timer", 2), ("mud", 1)):
+      c.add(lane + "weight", config.IntConfig(lane + "weight",
+            int(cops.get(lane + "weight", weight)), 0,
+            "How big a share of event handling %s events get " % lane +
+            "compared to the other kinds when the event queue is " +
+            "backed up."))
+      self._event_queue.setWeight(lane, c.get(lane + "weight"))
+
+    c.add("lanemaxwait", config.IntConfig("lanemaxwait",
+          int(cops.get("lanemaxwait", 500)), 0,
+          "How long (in milliseconds) an event can wait in the event " +
+          "queue before it gets handled regardless of the lane weights."))
+    self._event_queue.setMaxWait(c.get("lanemaxwait") / 1000.0)
+
+    c.add("eventbatchsize", config.IntConfig("eventbatchsize",
+          int(cops.get("eventbatchsize", 100)), 0,
+          "The most events the engine will pull off the event queue " +
+          "and handle before flushing the ui.  User input that comes " +
+          "in while a batch is being handled goes ahead of the rest " +
+          "of the batch."))
+
+    c.add("queuelimit", config.IntConfig("queuelimit",
+          int(cops.get("queuelimit", 10000)), 0,
+          "How many events can be in an event queue lane before flood " +
+          "control kicks in for mud data.  0 means there's no limit.  " +
+          "See floodpolicy."))
+    self._queuelimit = c.get("queuelimit")
+
+    c.add("floodpolicy", config.ChoiceConfig("floodpolicy",
+          cops.get("floodpolicy", "block"), 0,
+          "What we do with mud data when the event queue has more than " +
+          "queuelimit events: block stops reading from the mud until " +
+          "we catch up, coalesce merges mud data into the event that's " +
+          "already waiting, and display does the same but also skips " +
+          "actions, gags, and other mud filters for that data and just " +
+          "shows it.",
+          ["block", "coalesce", "display"]))
+    self._floodpolicy = c.get("floodpolicy")
+
+    c.add("sessionworkers", config.BoolConfig("sessionworkers",
+          utils.convert_boolean(cops.get("sessionworkers", 0)), 0,
+          "Whether (1) or not (0) each session handles its events in " +
+          "its own thread so that a session getting flooded doesn't " +
+          "hold up the others."))
+
+    c.add("eventtiming", config.BoolConfig("eventtiming",
+          utils.convert_boolean(cops.get("eventtiming", 0)), 0,
+          "Whether (1) or not (0) we keep track of how long events " +
+          "wait in the event queue and how long they take to handle.  " +
+          "The timings show up in #diagnostics."))
+    if c.get("eventtiming") == 1:
+      self._eventtimings = {}
+
+    self.hookRegister("config_change_hook", self._configChangeHandler)
+
     self._sessions["common"].setupCommonSession()
 
+  def _getHistoryFile(self):
+    """
+    Returns the file the history should be saved in or None if the
+    savehistory config item is off.
+    """
+    c = self._managers["config"]
+    historyfile = c.get("historyfile")
+    if not c.get("savehistory") or not historyfile:
+      return None
+    return os.path.join(config.options["datadir"], 
+                        os.path.expanduser(historyfile))
+
+  def _configChangeHandler(self, args):
+    """
+    Passes changes to the event lane config items on to the 
+    event queue.
+    """
+    name = args["name"]
+    newvalue = args["newvalue"]
+
+    if name in ("inputweight", "timerweight", "mudweight"):
+      self._event_queue.setWeight(name[:-len("weight")], newvalue)
+      for mem in self._workers.values():
+        mem.getQueue().setWeight(name[:-len("weight")], newvalue)
+    elif name == "lanemaxwait":
+      self._event_queue.setMaxWait(newvalue / 1000.0)
+      for mem in self._workers.values():
+        mem.getQueue().setMaxWait(newvalue / 1000.0)
+    elif name == "queuelimit":
+      self._queuelimit = newvalue
+    elif name == "floodpolicy":
+      self._floodpolicy = newvalue
+    elif name == "eventtiming":
+      if newvalue:
+        if self._eventtimings == None:
+          self._eventtimings = {}
+      else:
+        self._eventtimings = None
+    elif name == "historysize":
+      self._managers["history"].setSize(newvalue)
+    elif name in ("savehistory", "historyfile"):
+      self._managers["history"].setHistoryFile(self._getHistoryFile())
+    elif name == "scrollbackarchive" and args["session"] != None:
+      args["session"].setScrollbackArchive(newvalue)
+    elif name == "sessionworkers" and args["session"] == None:
+      for mem in self._sessions.values():
+        if newvalue:
+          self._startWorker(mem)
+        else:
+          self._stopWorker(mem)
+
   ### ------------------------------------------
   ### hook stuff
   ### ------------------------------------------
@@ -298,10 +482,49 @@ class Engine:
 
     if newhook==1:
       self._hooks[hookname] = utils.PriorityQueue()
+      if self._hookprofiling:
+        self._hooks[hookname].setProfiling(1)
       return self._hooks[hookname]
 
     return None
 
+  def setHookProfiling(self, profile):
+    """
+    Turns profiling of the functions registered with hooks on or
+    off.  Turning it off throws away the data we've collected.
+
+    @param profile: 1 to turn profiling on, 0 to turn it off
+    @type  profile: boolean
+    """
+    self._hookprofiling = profile
+    for mem in self._hooks.values():
+      mem.setProfiling(profile)
+
+  def isHookProfiling(self):
+    """
+    Returns whether we're profiling hooks.
+
+    @return: 1 if we are, 0 if not
+    @rtype:  boolean
+    """
+    return self._hookprofiling
+
+  def getHookProfile(self):
+    """
+    Returns the hook profiling data.
+
+    @return: dict of hook name -> list of (function, number of calls,
+        total time, max time) tuples most expensive first.  hooks that
+        haven't had any calls are left out.
+    @rtype:  dict
+    """
+    data = {}
+    for name, hook in self._hooks.items():
+      profile = [mem for mem in hook.getProfile() if mem[1] > 0]
+      if profile:
+        data[name] = profile
+    return data
+
   def hookRegister(self, hookname, func, place=constants.LAST):
     """
     Registers a function with a hook.
@@ -452,16 +675,16 @@ class Engine:
         exactly what the user typed--this is for the history manager)
     @rtype: string
     """ 
-    if self._managers["config"].get("debugmode") == 1:
+    snapshot = self._managers["config"].getSnapshot()
+    if snapshot.debugmode == 1:
       exported.write_message("evaluating: %s" % input)
 
-    inputlist = utils.split_commands(self._managers["config"].get("splitchar"), 
-                                     input)
+    inputlist = utils.split_commands(snapshot.splitchar, input)
     if session == None:
       session = self._current_session
 
     historyitems = []
-    commandchar = self._managers["config"].get("commandchar")
+    commandchar = snapshot.commandchar
     for mem in inputlist:
       # mem = mem.strip()
 
@@ -502,6 +725,11 @@ class Engine:
           input = mem.split(" ", 1)
           if len(input) < 2:
             self.set_current_session(self._sessions[ses])
+          elif self._isOtherThread(self._sessions[ses]):
+            # the session is handled in another thread, so we send it
+            # the command rather than running it here
+            event.InputEvent(input[1], internal=1, 
+                             ses=self._sessions[ses]).enqueue()
           else:
             self.handleUserData(input[1], internal=1, session=self._sessions[ses])
           historyitems.append(mem)
@@ -517,7 +745,8 @@ class Engine:
 
           for sessionname in self._sessions.keys():
             if sessionname != "common":
-              self._sessions[sessionname].handleUserData(newinput, internal)
+              self._sessionInput(self._sessions[sessionname], newinput, 
+                                 internal)
           historyitems.append(mem)
           continue
 
@@ -527,17 +756,19 @@ class Engine:
 
       # no command char, so we pass it on to the session.handleUserData
       # to do session oriented things
-      session.handleUserData(mem, internal)
+      self._sessionInput(session, mem, internal)
 
     # we don't record internal stuff or input that isn't supposed
     # to be echo'd
     executed = ";".join(historyitems)
-    if internal == 0 and self.getConfigManager().get("mudecho") == 1:
+    # the commands might have changed mudecho, so this needs a fresh
+    # snapshot
+    if internal == 0 and self._managers["config"].getSnapshot().mudecho == 1:
       self.getManager("history").recordHistory(executed)
 
     return executed
 
-  def handleMudData(self, session, text):
+  def handleMudData(self, session, text, filter=1):
     """
     Handle input coming from the mud.  We toss this to the 
     current session to deal with.
@@ -547,12 +778,59 @@ class Engine:
 
     @param text: the text coming from the mud
     @type  text: string
+
+    @param filter: whether (1) or not (0) to pass the data through the
+        mud_filter_hook
+    @type  filter: boolean
     """
     if session:
-      session.handleMudData(text)
+      session.handleMudData(text, filter)
     else:
       exported.write_message("Unhandled data:\n%s" % text)
 
+  def _sessionInput(self, ses, input, internal):
+    """
+    Passes user input on to the session.  If the session is handled
+    in another thread, we send it a SessionInputEvent instead.
+
+    @param ses: the session to hand the input to
+    @type  ses: session.Session instance
+
+    @param input: the user input
+    @type  input: string
+
+    @param internal: 1 if it's internally generated input, 0 if not
+    @type  internal: boolean
+    """
+    if self._isOtherThread(ses):
+      event.SessionInputEvent(ses, input, internal).enqueue()
+    else:
+      ses.handleUserData(input, internal)
+
+  def _isOtherThread(self, ses):
+    """
+    Returns whether the session's events are handled in a different
+    thread than the one we're in.  This is always 0 unless the
+    sessionworkers config item is on.  Sessions without workers (the
+    common session) are handled by the runengine thread.
+
+    @param ses: the session
+    @type  ses: session.Session instance
+
+    @return: 1 if it's another thread, 0 if not
+    @rtype:  boolean
+    """
+    if not self._workers:
+      return 0
+
+    worker = self._workers.get(ses)
+    if worker != None:
+      return not worker.isCurrentThread()
+
+    if self._enginethread == None:
+      return 0
+    return threading.currentThread() is not self._enginethread
+
 
   ### ------------------------------------------
   ### session stuff
@@ -595,6 +873,12 @@ class Engine:
 
     self._sessions[name] = session
 
+    if self._managers["config"].get("scrollbackarchive", session) == 1:
+      session.setScrollbackArchive(1)
+
+    if self._managers["config"].get("sessionworkers") == 1:
+      self._startWorker(session)
+
   def unregisterSession(self, ses):
     """
     Unregisters a session from the engine.
@@ -616,6 +900,9 @@ class Engine:
 
     del self._sessions[ses.getName()]
 
+    self._stopWorker(ses)
+    ses.setScrollbackArchive(0)
+
   def getSessions(self):
     """
     Returns a list of session names.
@@ -720,33 +1007,353 @@ class Engine:
   ### event-handling/engine stuff
   ### ------------------------------------------
 
-  def _enqueue(self, event):
+  def _enqueue(self, event, lane="mud"):
     """
     Adds an event to the queue.
 
     @param event: the new event to enqueue
     @type  event: event.Event
+
+    @param lane: the event queue lane to put it in: "input", "timer",
+        or "mud"
+    @type  lane: string
+    """
+    if self._eventtimings != None:
+      event._queued = time.time()
+
+    q = self._event_queue
+    if self._workers:
+      worker = self._workers.get(event.getSession())
+      if worker != None:
+        q = worker.getQueue()
+
+    merge = None
+    if self._queuelimit > 0 and q.depth(lane) >= self._queuelimit:
+      merge = self._floodControl(q, event, lane)
+    elif self._flooded and lane == "mud" and \
+        self._flooded.has_key(event.getSession()):
+      del self._flooded[event.getSession()]
+      exported.write_message("flood control: caught up--mud filters are "
+                             "back on.", event.getSession())
+
+    if q is not self._event_queue:
+      # the worker might have retired while we were doing flood control
+      self._workers_lock.acquire()
+      try:
+        worker = self._workers.get(event.getSession())
+        if worker != None:
+          self._put(worker.getQueue(), event, lane, merge)
+          return
+      finally:
+        self._workers_lock.release()
+
+    self._put(self._event_queue, event, lane, merge)
+
+  def _put(self, q, e, lane, merge):
+    """
+    Puts an event in a queue, merging it into the event at the end
+    of the lane if merge says so.
+    """
+    if merge == None:
+      q.put(e, lane)
+    elif q.putMerged(e, lane, merge) and e._filter:
+      self._floodstats["coalesced"] += 1
+
+  def _floodControl(self, q, e, lane):
+    """
+    Applies the floodpolicy to a MudEvent headed for a lane that's
+    over the queuelimit.  Other events are left alone.
+
+    @param q: the queue the event is going in
+    @type  q: utils.LaneQueue
+
+    @param e: the event
+    @type  e: event.Event
+
+    @param lane: the lane it's going in
+    @type  lane: string
+
+    @return: the function to merge the event into the one at the end
+        of the lane with (see LaneQueue.putMerged) or None if it 
+        should just get added
+    @rtype:  function
+    """
+    if not isinstance(e, event.MudEvent):
+      return None
+
+    policy = self._floodpolicy
+    stats = self._floodstats
+
+    if policy == "block":
+      # threads that are handling events never block--they'd be 
+      # waiting on themselves.
+      if self.inBatch():
+        return None
+      start = time.time()
+      while not q.waitForRoom(lane, self._queuelimit, 0.5):
+        if self._shutdownflag or self._queuelimit <= 0:
+          break
+      stats["blocked"] += 1
+      stats["blocktime"] += time.time() - start
+      return None
+
+    if policy == "coalesce":
+      return _merge_mud_events
+
+    # display: the data skips the mud filters and gets merged into
+    # the display only event at the end of the lane so the lane 
+    # doesn't keep growing
+    stats["displayonly"] += 1
+    ses = e.getSession()
+    if not self._flooded.has_key(ses):
+      self._flooded[ses] = 1
+      exported.write_message("flood control: more than %d events waiting--"
+                             "showing mud data without actions, gags, and "
+                             "substitutes until we catch up." % 
+                             self._queuelimit, ses)
+    e._filter = 0
+    return _merge_mud_events
+
+  def _startWorker(self, ses):
+    """
+    Starts a worker thread for a session if it doesn't already
+    have one.  The common session never gets a worker.
+
+    Events for the session that are already in the engine's queue
+    get handled by the engine thread first--the worker waits until
+    a _HandoffEvent in each lane tells it they're done.
+
+    @param ses: the session
+    @type  ses: session.Session instance
     """
-    self._event_queue.put(event)
+    if ses.getName() == "common":
+      return
+
+    self._workers_lock.acquire()
+    try:
+      worker = self._workers.get(ses)
+      if worker != None:
+        # it might be on its way out--if so, it stays
+        worker.resume()
+        return
+
+      c = self._managers["config"]
+      lanes = [("input", c.get("inputweight")),
+               ("timer", c.get("timerweight")),
+               ("mud", c.get("mudweight"))]
+      q = utils.LaneQueue(lanes, c.get("lanemaxwait") / 1000.0)
+
+      if self._enginethread == None:
+        worker = _SessionWorker(self, ses, q, 0)
+      else:
+        worker = _SessionWorker(self, ses, q, len(lanes))
+        for name, weight in lanes:
+          self._event_queue.put(_HandoffEvent(worker, name), name)
+      self._workers[ses] = worker
+    finally:
+      self._workers_lock.release()
+    worker.start()
+
+  def _stopWorker(self, ses):
+    """
+    Tells a session's worker thread to stop.  It handles everything
+    in its queue and then retires (see _retireWorker), so the 
+    session's events stay in order and never run in two threads at 
+    once.  This doesn't wait for it.
+
+    @param ses: the session
+    @type  ses: session.Session instance
+    """
+    self._workers_lock.acquire()
+    try:
+      worker = self._workers.get(ses)
+      if worker != None:
+        worker.stop()
+    finally:
+      self._workers_lock.release()
+
+  def _retireWorker(self, worker):
+    """
+    Removes a stopped worker if its queue is empty.  After this, the
+    session's events go to the engine's event queue.  Only the worker
+    thread calls this.
+
+    @param worker: the worker
+    @type  worker: _SessionWorker
+
+    @return: 1 if it's retired, 0 if it has to keep going
+    @rtype:  boolean
+    """
+    self._workers_lock.acquire()
+    try:
+      if not worker.isStopped() or worker.getQueue().qsize() > 0:
+        return 0
+      if self._workers.get(worker.getSession()) is worker:
+        del self._workers[worker.getSession()]
+      return 1
+    finally:
+      self._workers_lock.release()
 
   def runengine(self):
     """
     This gets kicked off in a thread and just keep going through
     events until it detects a shutdown.
+
+    We pull all the events that are waiting (up to eventbatchsize)
+    off the queue at once, handle them, and then flush the ui.  Runs
+    of OutputEvents get merged so they go to the ui in one write.
     """
+    from time import time
+
+    self._enginethread = threading.currentThread()
+
     while not self._shutdownflag:
       try:
         # blocks on the event queue
-        e = self._event_queue.get()
-        e.execute()
+        batch = self._event_queue.getBatch(
+                    max(1, self._managers["config"].get("eventbatchsize")))
       except KeyboardInterrupt:
         return
       except SystemExit:
         return
-      except:
-        self.tallyError()
-        exported.write_traceback("engine: unhandled error in engine.")
-      self._num_events_processed += 1
+
+      start = time()
+      if not self._runBatch(batch, self._event_queue):
+        return
+
+      elapsed = time() - start
+      self._num_batches += 1
+      self._num_batch_events += len(batch)
+      self._batch_time += elapsed
+      if elapsed > self._max_batch_time:
+        self._max_batch_time = elapsed
+      if len(batch) > self._max_batch:
+        self._max_batch = len(batch)
+
+  def _runBatch(self, batch, queue=None):
+    """
+    Handles a batch of events and then flushes the ui.  This is used
+    by runengine and by the session workers.
+
+    User input that shows up in the queue while we're handling the
+    batch goes ahead of the rest of the batch--otherwise it'd wait 
+    behind up to eventbatchsize mud events.
+
+    @param batch: the events to handle
+    @type  batch: list of event.Event
+
+    @param queue: the queue the batch came from or None
+    @type  queue: utils.LaneQueue
+
+    @return: 0 if we got a KeyboardInterrupt or SystemExit and the
+        thread should stop, 1 otherwise
+    @rtype:  boolean
+    """
+    self._batchstate.inbatch = 1
+    processed = 0
+    try:
+      i = 0
+      while i < len(batch):
+        if queue != None and queue.depth("input") and batch[i].lane != "input":
+          batch[i:i] = queue.getLane("input", queue.depth("input"))
+        e = batch[i]
+        i += 1
+        timings = self._eventtimings
+        if timings != None:
+          start = time.time()
+        try:
+          if isinstance(e, event.OutputEvent):
+            while i < len(batch) and e.merge(batch[i]):
+              i += 1
+              processed += 1
+          e.execute()
+        except KeyboardInterrupt:
+          return 0
+        except SystemExit:
+          return 0
+        except:
+          self.tallyError()
+          exported.write_traceback("engine: unhandled error in engine.")
+        processed += 1
+        if timings != None:
+          self._recordTiming(e, start, time.time())
+    finally:
+      self._batchstate.inbatch = 0
+      self._num_events_lock.acquire()
+      self._num_events_processed += processed
+      self._num_events_lock.release()
+
+    try:
+      self.flushUI()
+    except:
+      pass
+    return 1
+
+  def _recordTiming(self, e, start, end):
+    """
+    Adds an event's queue wait and execute time to the histograms
+    for its class.
+
+    @param e: the event
+    @type  e: event.Event
+
+    @param start: when we started handling it
+    @type  start: float
+
+    @param end: when we finished handling it
+    @type  end: float
+    """
+    self._eventtimings_lock.acquire(1)
+    try:
+      timings = self._eventtimings
+      if timings == None:
+        return
+      name = e.__class__.__name__
+      if not timings.has_key(name):
+        timings[name] = (utils.Histogram(EVENT_TIMING_BUCKETS),
+                         utils.Histogram(EVENT_TIMING_BUCKETS))
+      wait, run = timings[name]
+      # events queued before eventtiming got turned on don't have 
+      # a queued time
+      if e._queued != None:
+        wait.add(start - e._queued)
+      run.add(end - start)
+    finally:
+      self._eventtimings_lock.release()
+
+  def getEventTimings(self):
+    """
+    Returns the event timings.  Times are in seconds.
+
+    @return: None if the eventtiming config item is off.  otherwise a
+        dict of event class name -> { "wait": histogram data, 
+        "execute": histogram data } where the histogram data comes
+        from utils.Histogram.getData.
+    @rtype:  dict or None
+    """
+    self._eventtimings_lock.acquire(1)
+    try:
+      timings = self._eventtimings
+      if timings == None:
+        return None
+      data = {}
+      for name, (wait, run) in timings.items():
+        data[name] = { "wait": wait.getData(), "execute": run.getData() }
+      return data
+    finally:
+      self._eventtimings_lock.release()
+
+  def inBatch(self):
+    """
+    Returns whether the current thread is in the middle of handling
+    a batch of events.  UIs can hold off on flushing their output 
+    while this is true since flushUI gets called at the end of the 
+    batch.
+
+    @return: 1 if we're handling a batch, 0 if not
+    @rtype:  boolean
+    """
+    return getattr(self._batchstate, "inbatch", 0)
 
         
   def tallyError(self):
@@ -780,12 +1387,73 @@ class Engine:
     """
     data = []
     data.append("   events processed: %d" % self._num_events_processed)
+    if self._num_batches > 0:
+      data.append("   event batches: %d, avg size %.1f, max size %d" % 
+                  (self._num_batches, 
+                   float(self._num_batch_events) / self._num_batches,
+                   self._max_batch))
+      data.append("   batch time: avg %.1fms, max %.1fms" % 
+                  (self._batch_time * 1000 / self._num_batches,
+                   self._max_batch_time * 1000))
     data.append("   queue size: %d" % self._event_queue.qsize())
+    for name, weight, depth, served, avgwait, maxwait, headwait in \
+        self._event_queue.getStats():
+      data.append("   %s lane: weight %d, depth %d, served %d, " % 
+                  (name, weight, depth, served) + 
+                  "wait avg %.1fms max %.1fms current %.1fms" % 
+                  (avgwait * 1000, maxwait * 1000, headwait * 1000))
+    for mem in self._workers.values():
+      data.append("   %s" % mem.getDiagnostics())
+    stats = self._floodstats
+    data.append("   flood control: policy %s, limit %d, " % 
+                (self._floodpolicy, self._queuelimit) + 
+                "blocked %d times (%.1fs), coalesced %d, display only %d" %
+                (stats["blocked"], stats["blocktime"], stats["coalesced"],
+                 stats["displayonly"]))
     data.append("   ui: %s" % repr(self._ui))
     data.append("   ansicolor: %d" % self.getConfigManager().get("ansicolor"))
     data.append("   ticks: %d" % self._current_tick)
     data.append("   errors: %d" % self._errorcount)
 
+    # print how long events are taking
+    timings = self._eventtimings
+    if timings != None:
+      data.append("Event timings (wait in queue / execute):")
+      names = timings.keys()
+      names.sort()
+      for name in names:
+        wait, run = timings[name]
+        data.append("   %s: %d events" % (name, run.getCount()))
+        for label, hist in (("wait", wait), ("execute", run)):
+          data.append("      %s: avg %.2fms, p50 %.2fms, p95 %.2fms, " % 
+                      (label, hist.getAverage() * 1000, 
+                       hist.getPercentile(50) * 1000, 
+                       hist.getPercentile(95) * 1000) + 
+                      "max %.2fms" % (hist.getMax() * 1000))
+
+    # print info on the argument parser caches
+    stats = self.getManager("command").getParserCacheStats()
+    if stats:
+      data.append("Argument parser caches:")
+      for name, hits, misses, size in stats:
+        total = hits + misses
+        if total > 0:
+          rate = 100.0 * hits / total
+        else:
+          rate = 0.0
+        data.append("   %s: %d hits, %d misses (%.1f%%), %d entries" % 
+                    (name, hits, misses, rate, size))
+
+    # print whatever the modules want to tell us
+    moddata = []
+    def diagnostics_mapper(x, y, moddata=moddata):
+      if y:
+        moddata.extend(y)
+      return x
+
+    exported.hook_spam("diagnostics_hook", {}, mappingfunc=diagnostics_mapper)
+    data.extend(moddata)
+
     # print info from each session
     data.append("Sessions:")
     data.append("   total sessions: %d" % len(self._sessions))
@@ -847,7 +1515,12 @@ class Engine:
 
   def flushUI(self):
     """ Tells the ui to flush its output."""
-    self._ui.flush()
+    if self._ui:
+      self._ui_lock.acquire(1)
+      try:
+        self._ui.flush()
+      finally:
+        self._ui_lock.release()
 
   
   ### ------------------------------------------------
@@ -933,6 +1606,179 @@ class Engine:
     return data
 
 
+def _merge_mud_events(old, new):
+  """
+  Merges a MudEvent into the one at the end of an event queue lane
+  for the coalesce floodpolicy.
+  """
+  return isinstance(old, event.MudEvent) and old.merge(new)
+
+
+class _HandoffEvent(event.Event):
+  """
+  Goes in each lane of the engine's event queue when a session gets
+  a worker.  When the engine thread gets to it, the session's events
+  that were ahead of it in that lane have been handled.
+  """
+  def __init__(self, worker, lane):
+    self._worker = worker
+    self.lane = lane
+
+  def execute(self):
+    self._worker.handedOff()
+
+
+class _SessionWorker:
+  """
+  Handles the events for one session in its own thread.  The engine
+  creates these when the sessionworkers config item is on.  The 
+  worker has its own event queue with the same lanes as the engine's
+  so a session that's getting flooded only holds up itself.
+  """
+  def __init__(self, engine, ses, queue, handoffs):
+    """
+    @param engine: the engine
+    @type  engine: Engine
+
+    @param ses: the session we're handling events for
+    @type  ses: session.Session
+
+    @param queue: the event queue for the session
+    @type  queue: utils.LaneQueue
+
+    @param handoffs: the number of _HandoffEvents the engine thread
+        has to get to before we start
+    @type  handoffs: int
+    """
+    self._engine = engine
+    self._session = ses
+    self._queue = queue
+    self._thread = None
+    self._stopped = 0
+
+    self._handoffs = handoffs
+    self._handoff_lock = thread.allocate_lock()
+    self._handedoff = threading.Event()
+    if handoffs == 0:
+      self._handedoff.set()
+
+    # for diagnostics
+    self._num_events = 0
+    self._num_batches = 0
+    self._batch_time = 0.0
+    self._max_batch_time = 0.0
+
+  def start(self):
+    """ Starts the worker thread."""
+    self._thread = self._engine.startthread(
+                       "worker: %s" % self._session.getName(), self.run)
+
+  def stop(self):
+    """
+    Tells the worker thread to stop once its queue is empty.  Call
+    this with the engine's workers lock held.
+    """
+    self._stopped = 1
+    # wakes the thread up if it's waiting on the queue
+    self._queue.interrupt()
+
+  def resume(self):
+    """
+    Takes back a stop that the worker hasn't acted on yet.  Call this
+    with the engine's workers lock held.
+    """
+    self._stopped = 0
+
+  def isStopped(self):
+    return self._stopped
+
+  def handedOff(self):
+    """
+    Called by the _HandoffEvents in the engine thread.
+    """
+    self._handoff_lock.acquire()
+    try:
+      self._handoffs -= 1
+      if self._handoffs <= 0:
+        self._handedoff.set()
+    finally:
+      self._handoff_lock.release()
+
+  def getSession(self):
+    return self._session
+
+  def getQueue(self):
+    """
+    Returns the worker's event queue.
+
+    @return: the queue
+    @rtype:  utils.LaneQueue
+    """
+    return self._queue
+
+  def isCurrentThread(self):
+    """
+    Returns whether we're running in the worker's thread.
+
+    @return: 1 if we are, 0 if not
+    @rtype:  boolean
+    """
+    return threading.currentThread() is self._thread
+
+  def run(self):
+    """
+    Handles events from the worker's queue until we're stopped or
+    the engine shuts down.
+    """
+    from time import time
+
+    engine = self._engine
+
+    # wait for the engine thread to finish with this session's events
+    # that were in its queue before we started
+    while not self._handedoff.isSet():
+      if engine._shutdownflag:
+        return
+      self._handedoff.wait(0.5)
+
+    while not engine._shutdownflag:
+      if self._stopped and engine._retireWorker(self):
+        return
+
+      batch = self._queue.getBatch(
+                  max(1, engine.getConfigManager().get("eventbatchsize")))
+      if not batch:
+        continue
+
+      start = time()
+      if not engine._runBatch(batch, self._queue):
+        return
+
+      elapsed = time() - start
+      self._num_events += len(batch)
+      self._num_batches += 1
+      self._batch_time += elapsed
+      if elapsed > self._max_batch_time:
+        self._max_batch_time = elapsed
+
+  def getDiagnostics(self):
+    """
+    Returns a line of diagnostics about the worker.
+
+    @return: the diagnostics
+    @rtype:  string
+    """
+    if self._num_batches > 0:
+      avg = self._batch_time * 1000 / self._num_batches
+    else:
+      avg = 0.0
+    return ("worker %s: queue size %d, events %d, batches %d, " % 
+            (self._session.getName(), self._queue.qsize(), 
+             self._num_events, self._num_batches) + 
+            "batch time avg %.1fms max %.1fms" % 
+            (avg, self._max_batch_time * 1000))
+
+
 def main(defaultoptions={}):
   """
   This parses the command line arguments and makes sure they're all valid,
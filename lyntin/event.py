@@ -37,8 +37,9 @@ X{from_mud_hook}::
 
    data - the raw data that was sent from the mud
 """
-import sys
+import sys, types
 from lyntin import config, exported, constants
+from lyntin.ui import message
 
 class Event:
   """
@@ -47,7 +48,18 @@ class Event:
   module).  It also has an execute method which is executed
   when the event is dequeued and handled.  Override the
   'execute' function for your functionality to get executed.
+
+  The lane says which of the engine's event queue lanes the event
+  goes in: "input" for user input, "timer" for timer and other 
+  spam events, and "mud" for mud data and things that have to stay
+  in order with it.
   """
+  lane = "mud"
+
+  # when the event went in the event queue.  the engine sets this
+  # if the eventtiming config item is on.
+  _queued = None
+
   def __init__(self):
     """
     Override this to do your event initialization here.
@@ -67,7 +79,7 @@ class Event:
     This enqueues this event into the event queue.
     Don't overload this unless you have to.
     """
-    exported.myengine._enqueue(self)
+    exported.myengine._enqueue(self, self.lane)
 
   def execute(self):
     """
@@ -76,11 +88,25 @@ class Event:
     """
     pass
 
+  def getSession(self):
+    """
+    Returns the session this event belongs to.  When the sessionworkers
+    config item is on, events that belong to a session get handled in
+    that session's worker thread.  Override this if your event belongs
+    to a session.
+
+    @return: the session or None if it doesn't belong to one
+    @rtype:  session.Session
+    """
+    return None
+
 import sys
 class ShutdownEvent(Event):
   """
   This calls sys.exit(0) which will trigger the Python atexit stuff.
   """
+  lane = "input"
+
   def __init__(self):
     """ Initialize."""
     pass
@@ -109,10 +135,36 @@ class MudEvent(Event):
     self._session = session
     self._input = input
 
+    # whether the data goes through the mud_filter_hook.  the engine
+    # turns this off when the event queue is flooded and the 
+    # floodpolicy is "display".
+    self._filter = 1
+
   def execute(self):
     """ Execute."""
     exported.hook_spam("from_mud_hook", {"session": self._session, "data": self._input})
-    exported.myengine.handleMudData(self._session, self._input)
+    exported.myengine.handleMudData(self._session, self._input, self._filter)
+
+  def merge(self, other):
+    """
+    Folds the data of another MudEvent for the same session into this
+    one.  The engine uses this when the event queue is flooded and
+    the floodpolicy is "coalesce".
+
+    @param other: the event that comes after this one
+    @type  other: event.Event
+
+    @return: 1 if we merged the other event, 0 if not
+    @rtype:  boolean
+    """
+    if isinstance(other, MudEvent) and other._session is self._session \
+        and other._filter == self._filter:
+      self._input = self._input + other._input
+      return 1
+    return 0
+
+  def getSession(self):
+    return self._session
 
 
 class InputEvent(Event):
@@ -120,6 +172,8 @@ class InputEvent(Event):
   A user input event is created whenever the user types something
   into their ui and it creates a user event from it.
   """
+  lane = "input"
+
   def __init__(self, input, internal=0, ses=None):
     """
     Initializes the InputEvent.
@@ -146,6 +200,42 @@ class InputEvent(Event):
 
     exported.lyntin_command(self._input, internal=self._internal, session=self._ses)
 
+  def getSession(self):
+    return self._ses
+
+
+class SessionInputEvent(Event):
+  """
+  Hands user input to a session's handleUserData.  The engine uses
+  this to pass input to sessions that are handled in their own
+  worker threads.
+  """
+  lane = "input"
+
+  def __init__(self, ses, input, internal=0):
+    """
+    Initializes the SessionInputEvent.
+
+    @param ses: the session to hand the input to
+    @type  ses: session.Session
+
+    @param input: the data from the user
+    @type  input: string
+
+    @param internal: 1 if it's internally generated input, 0 if not
+    @type  internal: int
+    """
+    self._ses = ses
+    self._input = input
+    self._internal = internal
+
+  def execute(self):
+    """ Execute."""
+    self._ses.handleUserData(self._input, self._internal)
+
+  def getSession(self):
+    return self._ses
+
 
 class OutputEvent(Event):
   """
@@ -166,6 +256,43 @@ class OutputEvent(Event):
     """ Execute."""
     exported.write_ui(self._message)
 
+  def merge(self, other):
+    """
+    Folds the message of another OutputEvent into this one so that
+    they go to the ui in one write.  The engine uses this when it 
+    has a bunch of OutputEvents in a row.  Messages only get merged
+    if they're of the same type and for the same session.
+
+    @param other: the event that comes after this one
+    @type  other: event.Event
+
+    @return: 1 if we merged the other event, 0 if not
+    @rtype:  boolean
+    """
+    if not isinstance(other, OutputEvent):
+      return 0
+
+    mine = self._message
+    theirs = other._message
+
+    if type(mine) in types.StringTypes and type(theirs) in types.StringTypes:
+      self._message = mine + theirs
+      return 1
+
+    if isinstance(mine, message.Message) and isinstance(theirs, message.Message) \
+        and mine.type == theirs.type and mine.session == theirs.session \
+        and not mine.hints and not theirs.hints:
+      self._message = message.Message(mine.data + theirs.data, mine.type, 
+                                      mine.session)
+      return 1
+
+    return 0
+
+  def getSession(self):
+    if isinstance(self._message, message.Message):
+      return self._message.session
+    return None
+
 
 class SpamEvent(Event):
   """
@@ -173,11 +300,19 @@ class SpamEvent(Event):
   than doing it "inline" so to speak, it's sometimes nice to kick
   it off in its own event.  The timer uses this to handle kicking
   anything that's listening to the timer_hook.
+
+  Pass in lane="mud" for hooks that have to be spammed in order with
+  the mud data (prompts and such).
   """
+  lane = "timer"
+
   def __init__(self, *vargs, **nargs):
     """
     Initializes the SpamEvent.
     """
+    if nargs.has_key("lane"):
+      self.lane = nargs["lane"]
+      del nargs["lane"]
     self._vargs = vargs
     self._nargs = nargs
 
@@ -185,6 +320,21 @@ class SpamEvent(Event):
     """ Execute."""
     exported.hook_spam(*(self._vargs), **(self._nargs))
 
+  def getSession(self):
+    # only spam events that stay in order with the mud data belong
+    # to a session
+    if self.lane != "mud":
+      return None
+    if self._nargs.has_key("argmap"):
+      argmap = self._nargs["argmap"]
+    elif len(self._vargs) > 1:
+      argmap = self._vargs[1]
+    else:
+      return None
+    if type(argmap) is types.DictType:
+      return argmap.get("session")
+    return None
+
 # Local variables:
 # mode:python
 # py-indent-offset:2
@@ -281,6 +281,29 @@ def get_config(name, ses=None, defaultvalue=constants.NODEFAULTVALUE):
   """
   return myengine.getConfigManager().get(name, ses, defaultvalue)
 
+def get_config_snapshot(ses=None):
+  """
+  Gets the values of all the config items for a session.  Use this
+  instead of get_config in code that runs for every line from the 
+  mud--the snapshot is cached until the config changes.  Items are
+  attributes of the snapshot::
+
+     from lyntin.exported import get_config_snapshot
+
+     if get_config_snapshot(ses).ignoreactions == 0:
+       ...
+
+  Get a new snapshot every time rather than holding onto one--it
+  won't see changes.
+
+  @param ses: the session (or None for the general Lyntin items)
+  @type  ses: Session
+
+  @return: the snapshot
+  @rtype:  config.ConfigSnapshot
+  """
+  return myengine.getConfigManager().getSnapshot(ses)
+
 def add_config(name, configitem, ses=None):
   """
   Adds a new configuration item.  Configuration items allow you to
@@ -629,11 +652,75 @@ def hook_unregister(hookname, func):
   if myengine._hooks.has_key(hookname):
     myengine._hooks[hookname].remove(func)
 
-def hook_spam(hookname, argmap={}, mappingfunc=lambda x,y:x, 
-      emptyfunc=lambda x:x, donefunc=lambda x:x):
+def _identity(x):
+  return x
+
+def _first(x, y):
+  return x
+
+# what the query dispatcher returns when nothing answered the query
+_NO_ANSWER = []
+
+def _build_dispatcher(kind, funcs):
+  """
+  Builds a function that calls all the functions registered with a
+  hook in one straight run.  The PriorityQueue for the hook holds on
+  to it until the functions registered with the hook change.
+
+  The kinds are:
+
+    - broadcast - calls every function and returns the argmap
+    - filter - works like filter_mapper: each function's output goes
+      in argmap["dataadj"] and if a function returns None, we stop
+      and return None
+    - query - works like query_mapper: returns the first output that 
+      isn't None or _NO_ANSWER if there wasn't one
+
+  StopSpammingException and DoneSpammingException go up to the caller.
+
+  @param kind: "broadcast", "filter", or "query"
+  @type  kind: string
+
+  @param funcs: the functions registered with the hook in order
+  @type  funcs: list of functions
+
+  @return: the dispatcher or None if there are no functions
+  @rtype:  function
+  """
+  if not funcs:
+    return None
+
+  namespace = {"_NO_ANSWER": _NO_ANSWER}
+  lines = ["def dispatch(argmap):"]
+  for i in range(len(funcs)):
+    namespace["f%d" % i] = funcs[i]
+    if kind == "broadcast":
+      lines.append("  f%d(argmap)" % i)
+    elif kind == "filter":
+      lines.append("  output = f%d(argmap)" % i)
+      lines.append("  if output is None: return None")
+      lines.append("  argmap['dataadj'] = output")
+    else:
+      lines.append("  output = f%d(argmap)" % i)
+      lines.append("  if output is not None: return output")
+
+  if kind == "query":
+    lines.append("  return _NO_ANSWER")
+  else:
+    lines.append("  return argmap")
+
+  exec "\n".join(lines) + "\n" in namespace
+  return namespace["dispatch"]
+
+def hook_spam(hookname, argmap={}, mappingfunc=_first, 
+      emptyfunc=_identity, donefunc=_identity):
   """
   Sends out input to all the registrants of a hook.
 
+  If the mappingfunc is the default, filter_mapper, or query_mapper,
+  we don't call the mappingfunc--we use a dispatcher for the hook 
+  that does the same thing (see _build_dispatcher).
+
   @param hookname: the name of the hook to spam
   @type  hookname: string
 
@@ -659,7 +746,37 @@ def hook_spam(hookname, argmap={}, mappingfunc=lambda x,y:x,
   @return: argmap
   @rtype:  map of output arguments
   """
-  hooklist = get_hook(hookname).getList()
+  hook = get_hook(hookname)
+  if mappingfunc is _first:
+    kind = "broadcast"
+  elif mappingfunc is filter_mapper:
+    kind = "filter"
+  elif mappingfunc is query_mapper:
+    kind = "query"
+  else:
+    kind = None
+
+  if kind != None:
+    dispatch = hook.getDispatcher(kind, _build_dispatcher)
+    if dispatch == None:
+      return donefunc(emptyfunc(argmap))
+
+    try:
+      output = dispatch(argmap)
+    except StopSpammingException, e:
+      return None
+    except DoneSpammingException, d:
+      return d.output
+
+    if kind == "query":
+      if output is _NO_ANSWER:
+        return donefunc(argmap)
+      return output
+    if kind == "filter" and output == None:
+      return None
+    return donefunc(output)
+
+  hooklist = hook.getList()
   try:
     if hooklist:
       for mem in hooklist:
@@ -674,8 +791,8 @@ def hook_spam(hookname, argmap={}, mappingfunc=lambda x,y:x,
 
   return donefunc(argmap)
 
-def filter_mapper_hook_spam(hookname, argmap={}, emptyfunc=lambda x:x, 
-    donefunc=lambda x:x):
+def filter_mapper_hook_spam(hookname, argmap={}, emptyfunc=_identity, 
+    donefunc=_identity):
   """
   This is a slightly optimized filter_mapper hook because it's used so
   often in the system.  It incorproates the filter_mapper, but skips
@@ -683,17 +800,13 @@ def filter_mapper_hook_spam(hookname, argmap={}, emptyfunc=lambda x:x,
 
   Arguments correspond to hook_spam.
   """
-  hooklist = get_hook(hookname).getList()
-  if hooklist:
-    for mem in hooklist:
-      output = mem(argmap)
-      if output == None:
-        return None
-
-      argmap["dataadj"] = output
-  else:
-    argmap = emptyfunc(argmap)
+  dispatch = get_hook(hookname).getDispatcher("filter", _build_dispatcher)
+  if dispatch == None:
+    return donefunc(emptyfunc(argmap))
 
+  argmap = dispatch(argmap)
+  if argmap == None:
+    return None
   return donefunc(argmap)
 
 def filter_mapper(x, y):
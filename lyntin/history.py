@@ -19,12 +19,27 @@
 # $Id: history.py,v 1.4 2007/07/24 00:39:03 willhelm Exp $
 #########################################################################
 """
-The HistoryManager keeps track of the last 1000 lines of user input 
-X{history}. The HistoryManager is a singleton and it's on an engine 
-scoping thus we don't keep track of history per session.
+The HistoryManager keeps track of the last so many lines of user 
+input X{history} (see the historysize config item).  The 
+HistoryManager is a singleton and it's on an engine scoping thus we 
+don't keep track of history per session.
+
+If the historyfile config item is set, every line of history also
+gets appended to that file and the end of the file gets loaded back
+in the first time the history is used, so history survives restarts.
 """
+import os, bisect, threading, itertools
+from collections import deque
 import manager
 
+# how much of the history file we read at a time when we're looking
+# for the lines at the end of it
+READSIZE = 8192
+
+# when the history file gets bigger than this, we rewrite it with just
+# the lines we loaded
+MAXFILESIZE = 1024 * 1024
+
 class HistoryManager(manager.Manager):
   """
   Manages user data history.
@@ -33,12 +48,199 @@ class HistoryManager(manager.Manager):
   user entered.  This module also handles manipulating that history
   letting the user to recall and edit those commands to fix mistakes
   they may have typed.
+
+  The history is a deque with the most recent line on the left.  For
+  !prefix and completion, we also keep a sorted list of the distinct
+  lines in the history along with how many times each one is in
+  there and when it was last added.
   """
   def __init__(self, e):
-    self._history = [""]
+    self._history = deque([""])
+    self._size = 1000
     self._config = e.getManager("config")
     self._engine = e
 
+    # the distinct lines in the history in sorted order and line ->
+    # [count, sequence number of the last time it was added]
+    self._sorted = []
+    self._entries = {}
+    self._seq = 0
+
+    # the history file, the file object we append to, and whether
+    # we've loaded the end of the file yet
+    self._filename = None
+    self._file = None
+    self._loaded = 1
+
+    # the ui thread reads the history while the engine thread adds 
+    # to it
+    self._lock = threading.RLock()
+
+    e.hookRegister("completer_hook", self.complete)
+
+  def setSize(self, size):
+    """
+    Changes how many lines of history we keep.
+
+    @param size: the number of lines
+    @type  size: int
+    """
+    self._lock.acquire()
+    try:
+      self._size = max(1, size)
+      while len(self._history) > self._size:
+        self._unindex(self._history.pop())
+    finally:
+      self._lock.release()
+
+  def setHistoryFile(self, filename):
+    """
+    Starts keeping the history in a file.  The file gets loaded the
+    first time the history is used.
+
+    @param filename: the file or None to stop using a file
+    @type  filename: string
+    """
+    self._lock.acquire()
+    try:
+      if self._file != None:
+        self._file.close()
+        self._file = None
+      self._filename = filename
+      self._loaded = (filename == None)
+    finally:
+      self._lock.release()
+
+  def getHistoryFile(self):
+    """
+    @return: the history file or None if we're not using one
+    @rtype:  string
+    """
+    return self._filename
+
+  def _load(self):
+    """
+    Loads the last lines of the history file into the history and
+    opens it for appending.  We read the file from the end, so how
+    long this takes depends on the history size and not on how big
+    the file is.
+
+    The loaded lines go in as older than anything already in the
+    history.
+    """
+    if self._loaded:
+      return
+    self._loaded = 1
+
+    lines = []
+    filesize = 0
+    try:
+      if os.path.exists(self._filename):
+        f = open(self._filename, "rb")
+        f.seek(0, 2)
+        filesize = f.tell()
+
+        # read blocks off the end until we've got enough lines.  the
+        # first line in what we've read might be partial, so we want 
+        # one more than we need.
+        data = ""
+        pos = filesize
+        while pos > 0 and data.count("\n") <= self._size:
+          readsize = min(READSIZE, pos)
+          pos -= readsize
+          f.seek(pos)
+          data = f.read(readsize) + data
+        f.close()
+
+        lines = data.split("\n")
+        if pos > 0:
+          del lines[0]
+        lines = [mem for mem in lines if mem][-self._size:]
+
+      if filesize > MAXFILESIZE:
+        self._rewrite(lines)
+
+      self._file = open(self._filename, "ab")
+    except (IOError, OSError), e:
+      from lyntin import exported
+      exported.write_error("history: can't use history file %s: %s" % 
+                           (self._filename, e))
+      self._filename = None
+      return
+
+    current = list(self._history)
+    current.reverse()
+    for mem in current:
+      self._unindex(mem)
+    self._history = deque([""])
+
+    # everything in the prefix index has to be unicode--a byte string
+    # that isn't ascii can't be compared with the rest
+    for mem in lines:
+      self._add(mem.decode("utf-8", "replace"))
+    for mem in current:
+      if mem:
+        self._add(mem)
+
+  def _rewrite(self, lines):
+    """
+    Replaces the history file with just these lines.
+    """
+    tempname = self._filename + ".tmp"
+    f = open(tempname, "wb")
+    for mem in lines:
+      f.write(mem + "\n")
+    f.close()
+    if os.name == "nt":
+      os.remove(self._filename)
+    os.rename(tempname, self._filename)
+
+  def _add(self, input):
+    """
+    Adds a line to the history, dropping the oldest line if we're
+    full.
+    """
+    if len(self._history) >= self._size:
+      self._unindex(self._history.pop())
+    self._history.appendleft(input)
+
+    self._seq += 1
+    entry = self._entries.get(input)
+    if entry == None:
+      self._entries[input] = [1, self._seq]
+      bisect.insort(self._sorted, input)
+    else:
+      entry[0] += 1
+      entry[1] = self._seq
+
+  def _unindex(self, input):
+    """
+    Updates the index for a line that's left the history.
+    """
+    entry = self._entries.get(input)
+    if entry == None:
+      return
+    entry[0] -= 1
+    if entry[0] == 0:
+      del self._entries[input]
+      del self._sorted[bisect.bisect_left(self._sorted, input)]
+
+  def _findPrefix(self, prefix):
+    """
+    Returns the lines in the history that start with prefix, most 
+    recent first.
+    """
+    matches = []
+    for i in xrange(bisect.bisect_left(self._sorted, prefix), 
+                    len(self._sorted)):
+      mem = self._sorted[i]
+      if not mem.startswith(prefix):
+        break
+      matches.append((self._entries[mem][1], mem))
+    matches.sort()
+    matches.reverse()
+    return [mem[1] for mem in matches]
+
   def getHistoryItem(self, userinput):
     """
     This retrieves the item (if it exists) and performs the 
@@ -52,23 +254,29 @@ class HistoryManager(manager.Manager):
     @returns: None if we didn't discover anything or the command 
         string at the history index
     """
-    tokens = userinput.split(" ", 1)
+    self._lock.acquire()
+    try:
+      self._load()
+      tokens = userinput.split(" ", 1)
 
-    # grab the first (and possibly only) token and remove the !
-    index = tokens[0][1:]
+      # grab the first (and possibly only) token and remove the !
+      index = tokens[0][1:]
 
-    # if it's very short, we're looking at the last thing typed
-    # (prior to this thing they typed)
-    if len(index) == 0:
-      returninput = self._history[0]
-    else:
-      try:
-        returninput = self._history[int(index)]
-      except:
-        for h in self._history:
-          if h[0:len(index)] == index:
-            return h
-        return None
+      # if it's very short, we're looking at the last thing typed
+      # (prior to this thing they typed)
+      if len(index) == 0:
+        returninput = self._history[0]
+      else:
+        try:
+          returninput = self._history[int(index)]
+        except:
+          if index:
+            matches = self._findPrefix(index)
+            if matches:
+              return matches[0]
+          return None
+    finally:
+      self._lock.release()
 
     # check to see if they want to do a substitution
     if len(tokens) > 1:
@@ -78,6 +286,34 @@ class HistoryManager(manager.Manager):
 
     return returninput
 
+  def getCompletions(self, prefix):
+    """
+    Returns the lines in the history that start with prefix.
+
+    @param prefix: the text the lines have to start with
+    @type  prefix: string
+
+    @return: the lines, most recent first
+    @rtype:  list of strings
+    """
+    self._lock.acquire()
+    try:
+      self._load()
+      return self._findPrefix(prefix)
+    finally:
+      self._lock.release()
+
+  def complete(self, args):
+    """
+    Offers lines from the history that start with what the user has
+    typed so far as completions.  Registered with the completer_hook.
+    """
+    prefix = args["text"][:args["position"]]
+    if not prefix:
+      return []
+    return [(mem, len(mem)) for mem in self.getCompletions(prefix) 
+            if mem != prefix]
+
   def getHistory(self, count):
     """
     Returns everything in the history buffer as a list of strings
@@ -85,7 +321,12 @@ class HistoryManager(manager.Manager):
     @return: everything in the history buffer
     @rtype: list of strings
     """
-    return self._history[:count]
+    self._lock.acquire()
+    try:
+      self._load()
+      return list(itertools.islice(self._history, max(count, 0)))
+    finally:
+      self._lock.release()
 
   def recordHistory(self, input):
     """
@@ -97,12 +338,29 @@ class HistoryManager(manager.Manager):
     if not input:
       return
 
-    if input == self._history[0] and not self._config.get("repeathistory"):
-      return
+    # we get this before we lock--config changes can call us with the
+    # config manager's lock held
+    repeathistory = self._config.get("repeathistory")
+
+    self._lock.acquire()
+    try:
+      self._load()
+      if input == self._history[0] and not repeathistory:
+        return
+
+      self._add(input)
 
-    self._history.insert(0, input)
-    if len(self._history) > 1000:
-      del self._history[-1]
+      if self._file != None:
+        data = input
+        if isinstance(data, unicode):
+          data = data.encode("utf-8")
+        try:
+          self._file.write(data.replace("\n", " ") + "\n")
+          self._file.flush()
+        except IOError:
+          pass
+    finally:
+      self._lock.release()
 
 # Local variables:
 # mode:python
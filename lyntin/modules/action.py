@@ -428,7 +428,7 @@ class ActionManager(manager.Manager):
     ses = args["session"]
     text = args.get("dataadj") or args.get("prompt") or ''
 
-    if exported.get_config("ignoreactions", ses, 0) == 0:
+    if getattr(exported.get_config_snapshot(ses), "ignoreactions", 0) == 0:
       if self._actions.has_key(ses):
         self._actions[ses].checkActions(text)
 
@@ -25,10 +25,10 @@ module exists, it executes it in this module.
 
 It also holds load_cmd which does a lot of other magic stuff.
 """
-import sys
+import sys, threading
 import StringIO
 from code import compile_command
-from lyntin import exported, config
+from lyntin import exported, config, argparser
 
 usermodule = None
 execdictglobals = None
@@ -58,6 +58,143 @@ def _get_user_module():
   return None
 
 
+# compiled #@ code objects keyed on the source.  _code_cache_order
+# holds the sources with the most recently used one at the end.
+CODE_CACHE_SIZE = 128
+_code_cache = {}
+_code_cache_order = []
+_code_cache_hits = 0
+_code_cache_misses = 0
+# session workers can run #@ at the same time
+_code_cache_lock = threading.Lock()
+
+# for splitting up #@@ lines
+_call_parser = None
+
+def _compile_source(source):
+  """
+  Compiles a one-liner of python code or pulls the code object out
+  of the cache if we've seen that line before.
+
+  @param source: the python code
+  @type  source: string
+
+  @returns: the code object or None if the source is incomplete
+  @rtype: code
+
+  @raises SyntaxError: if the source isn't valid python
+  """
+  global _code_cache_hits, _code_cache_misses
+
+  _code_cache_lock.acquire()
+  try:
+    if _code_cache.has_key(source):
+      _code_cache_hits += 1
+      if _code_cache_order[-1] != source:
+        _code_cache_order.remove(source)
+        _code_cache_order.append(source)
+      return _code_cache[source]
+    _code_cache_misses += 1
+  finally:
+    _code_cache_lock.release()
+
+  compiled = compile_command(source)
+
+  #
+  # XXX for one-liners only:
+  #
+  if not compiled:
+    compiled = compile_command(source+"\n")
+
+  if compiled:
+    _code_cache_lock.acquire()
+    try:
+      if not _code_cache.has_key(source):
+        if len(_code_cache_order) >= CODE_CACHE_SIZE:
+          del _code_cache[_code_cache_order.pop(0)]
+        _code_cache_order.append(source)
+        _code_cache[source] = compiled
+    finally:
+      _code_cache_lock.release()
+
+  return compiled
+
+def _run_captured(func, *args):
+  """
+  Calls func with args with stdout and stderr redirected and writes
+  whatever got printed out to the user.
+
+  @param func: the function to call
+  @type  func: function
+  """
+  old_stdout = sys.stdout
+  old_stderr = sys.stderr
+  old_stdin = sys.stdin
+  sys_stdout = StringIO.StringIO()
+  sys_stderr = StringIO.StringIO()
+  sys_stdin = StringIO.StringIO()
+  try:
+    sys.stdout = sys_stdout
+    sys.stderr = sys_stderr
+    sys.stdin = sys_stdin
+    
+    func(*args)
+
+  finally:
+    sys.stdout = old_stdout
+    sys.stderr = old_stderr
+    sys.stdin = old_stdin
+    
+  error = sys_stderr.getvalue()
+  if error:
+    exported.write_error(error)
+
+  text = sys_stdout.getvalue()
+  if text.endswith("\n"):
+    text = text[:-1]
+  if text:  
+    exported.write_message(text)  
+
+def _exec_code(compiled, dictglobals, dictlocals):
+  exec compiled in dictglobals, dictlocals
+
+def _call_user_function(ses, line):
+  """
+  Handles "#@@ funcname arg1 arg2 ...".  Looks up funcname in the
+  lyntinuser module and calls it with the arguments as strings.
+  Arguments are split the same way command arguments are, so 
+  {}s group words together.
+
+  @param ses: the session this was executed in
+  @type  ses: session.Session
+
+  @param line: everything after the #@@
+  @type  line: string
+  """
+  global _call_parser
+  if _call_parser == None:
+    _call_parser = argparser.ArgumentParser("funcname args*")
+
+  try:
+    argdict = _call_parser.parse(line)
+  except argparser.ParserException, e:
+    exported.write_error("@@: %s\nsyntax: @@ %s" % (e, _call_parser.syntaxline))
+    return
+
+  funcname = argdict["funcname"]
+
+  my_usermodule = _get_user_module()
+  if not my_usermodule:
+    exported.write_error("@@: no lyntinuser module loaded.")
+    return
+
+  func = getattr(my_usermodule, funcname, None)
+  if not callable(func):
+    exported.write_error("@@: lyntinuser has no function named %s." % funcname)
+    return
+
+  _run_captured(func, *argdict["args"])
+
 def python_cmd(ses, words, input):
   """
   #@ allows you to execute arbitrary Python code inside of Lyntin.
@@ -67,9 +204,19 @@ def python_cmd(ses, words, input):
   modules.advanced .  At present it can only handle one-line
   Python statements.
 
+  Compiled code is cached so running the same line over and over
+  again (from an action for example) doesn't recompile it every
+  time.  #diagnostics shows how often the cache hits.
+
+  #@@ calls a function in the lyntinuser module by name passing
+  it the rest of the words on the line as string arguments.  This 
+  skips compiling anything which makes it a good choice for actions 
+  that fire a lot.
+
   examples:
     #@ print "hello"
     #@ print "\\n".join(exported.get_commands())
+    #@@ handle_tell {%0} {%1}
 
   category: commands
   """
@@ -79,6 +226,11 @@ def python_cmd(ses, words, input):
   # to change this function completely.
 
   try:
+    source = input[1:].lstrip()
+    if source.startswith("@"):
+      _call_user_function(ses, source[1:])
+      return
+
     if execdictlocals == None:
       execdictlocals = {}
       
@@ -94,42 +246,9 @@ def python_cmd(ses, words, input):
         exported.write_error("No lyntinuser module loaded--executing with no context.")
       dictglobals = execdictglobals
 
-    source = input[1:].lstrip()
-    compiled = compile_command(source)
-
-    #
-    # XXX for one-liners only:
-    #
-    if not compiled:
-      compiled = compile_command(source+"\n")
-
-    old_stdout = sys.stdout
-    old_stderr = sys.stderr
-    old_stdin = sys.stdin
-    sys_stdout = StringIO.StringIO()
-    sys_stderr = StringIO.StringIO()
-    sys_stdin = StringIO.StringIO()
-    try:
-      sys.stdout = sys_stdout
-      sys.stderr = sys_stderr
-      sys.stdin = sys_stdin
-      
-      exec compiled in dictglobals, execdictlocals
-
-    finally:
-      sys.stdout = old_stdout
-      sys.stderr = old_stderr
-      sys.stdin = old_stdin
-      
-    error = sys_stderr.getvalue()
-    if error:
-      exported.write_error(error)
+    compiled = _compile_source(source)
 
-    text = sys_stdout.getvalue()
-    if text.endswith("\n"):
-      text = text[:-1]
-    if text:  
-      exported.write_message(text)  
+    _run_captured(_exec_code, compiled, dictglobals, execdictlocals)
 
   except (OverflowError, SyntaxError, ValueError, NameError):
     import traceback
@@ -139,6 +258,19 @@ def python_cmd(ses, words, input):
     exported.write_traceback("@: error in raw python stuff.")
     exported.tally_error()
 
+def get_diagnostics(args):
+  """
+  Reports on the #@ code cache for #diagnostics.
+  """
+  total = _code_cache_hits + _code_cache_misses
+  if total > 0:
+    rate = 100.0 * _code_cache_hits / total
+  else:
+    rate = 0.0
+  return ["#@ code cache:",
+          "   %d hits, %d misses (%.1f%%), %d entries" % 
+          (_code_cache_hits, _code_cache_misses, rate, len(_code_cache))]
+
 
 def load_cmd(ses, args, input):
   """
@@ -262,11 +394,13 @@ def load():
   exported.add_command("@", python_cmd)
   exported.add_command("^load", load_cmd, "modulename reload:boolean=true")
   exported.add_command("^unload", unload_cmd, "modulename")
+  exported.hook_register("diagnostics_hook", get_diagnostics)
 
 def unload():
   exported.remove_command("@")
   exported.remove_command("^load")
   exported.remove_command("^unload")
+  exported.hook_unregister("diagnostics_hook", get_diagnostics)
 
 # Local variables:
 # mode:python
@@ -281,7 +281,7 @@ class GagManager(manager.Manager):
     ses = args["session"]
     text = args["dataadj"]
 
-    if exported.get_config("ignoresubs", ses, 0) == 0 and self._gagdata.has_key(ses):
+    if getattr(exported.get_config_snapshot(ses), "ignoresubs", 0) == 0 and self._gagdata.has_key(ses):
       text = self._gagdata[ses].expand(text)
     return text
 
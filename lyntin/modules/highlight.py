@@ -341,7 +341,7 @@ class HighlightManager(manager.Manager):
     ses = args["session"]
     text = args["dataadj"]
 
-    if self._config.get("ansicolor") == 0:
+    if self._config.getSnapshot().ansicolor == 0:
       return ansi.filter_ansi(text)
     else:
       if self._highlights.has_key(ses):
@@ -22,15 +22,727 @@
 This module defines the LoggerManager which handles logging.
 
 Logging can be turned on and shut off on a session by session basis.
+
+The writing happens in a LogWriter thread for each logfile so a slow
+disk doesn't hold up the engine.  The logqueuesize, logflushsize,
+logflushtime, logsyncinterval and logbehind config items control it.
+
+Logs can be split into segments by size or time and compressed with
+gzip (see RotatingLog).
+
+Logs can also be JSON lines (see JsonlLog)--a record per line with 
+the time, the session, which way the text went and the text with and
+without ANSI.  #logsearch uses their time index to pull out what 
+happened around a given time and tools/replaybench.py can replay the
+mud data in them.
 """
-import io, os, thread
+import io, os, re, thread, threading, time, gzip, shutil, json, bisect
 from lyntin import ansi, manager, config, utils, exported, constants
 from lyntin.modules import modutils
 
+# the config items for the log writers and their defaults
+WRITER_DEFAULTS = {"logqueuesize": 1000,
+                   "logflushsize": 8192,
+                   "logflushtime": 500,
+                   "logsyncinterval": 0,
+                   "logbehind": "block"}
+
+# how long (in seconds) closing a logfile waits for the writer to 
+# catch up
+CLOSE_TIMEOUT = 5.0
+
+# how many lines of databuffer #log databuffer=true writes at a time.
+# with a scrollback archive the databuffer can be a lot bigger than
+# we want to hold in memory at once.
+DUMP_LINES = 1000
+
+SIZE_REGEXP = re.compile(r"^(\d+)([kmg]?)$", re.IGNORECASE)
+SIZE_UNITS = {"": 1, "k": 1024, "m": 1024 * 1024, "g": 1024 * 1024 * 1024}
+
+def parse_size(text):
+  """
+  Parses a size like "500k", "100m" or "2g" into a number of bytes.
+
+  @param text: the size
+  @type  text: string
+
+  @return: the number of bytes
+  @rtype:  int
+
+  @raises ValueError: if it's not a size
+  """
+  match = SIZE_REGEXP.match(text.strip())
+  if not match:
+    raise ValueError("'%s' isn't a size like 500k, 100m or 2g." % text)
+  return int(match.group(1)) * SIZE_UNITS[match.group(2).lower()]
+
+def dump_lines(lines, f):
+  """
+  Writes lines to a file DUMP_LINES at a time.
+
+  @param lines: the lines
+  @type  lines: iterable of strings
+
+  @param f: the file
+  @type  f: File or RotatingLog
+
+  @return: the number of newlines written
+  @rtype:  int
+  """
+  count = 0
+  chunk = []
+  for mem in lines:
+    chunk.append(mem)
+    if len(chunk) >= DUMP_LINES:
+      text = "".join(chunk)
+      f.write(text)
+      count += text.count("\n")
+      chunk = []
+
+  if chunk:
+    text = "".join(chunk)
+    f.write(text)
+    count += text.count("\n")
+  return count
+
+def open_log(filename, mode="a", rotatesize=0, rotatetime=0, 
+             compress="none", keep=0):
+  """
+  Opens a logfile.  If there's no rotating or compressing to do, it's
+  a plain text file like it's always been.
+
+  @param filename: the logfile
+  @type  filename: string
+
+  @param mode: "a" to append or "w" to start over
+  @type  mode: string
+
+  @return: the file
+  @rtype:  File or RotatingLog
+  """
+  if not rotatesize and not rotatetime and compress == "none":
+    return io.open(filename, mode)
+  return RotatingLog(filename, mode, rotatesize, rotatetime, compress, keep)
+
+
+class RotatingLog:
+  """
+  A logfile that gets split into segments.  The segment we're
+  writing to is the logfile itself.  When it gets rotatesize 
+  characters of text or it's been open rotatetime seconds, it gets
+  renamed to the logfile name with the time it was finished tacked
+  on, like mud.log.20070724-003903, and we start a new one.  If keep
+  is more than 0, we only keep that many finished segments and 
+  delete the oldest ones.
+
+  compress is one of:
+
+    - "none"     - segments are plain text
+    - "stream"   - the segment being written is gzip'd as it's 
+                   written (mud.log.gz, then mud.log.20070724-003903.gz).
+                   Every flush ends a gzip block, so zcat shows 
+                   everything written so far.
+    - "segments" - the segment being written is plain text and 
+                   finished segments get gzip'd in a background thread.
+
+  This gets written to from the LogWriter thread, so rotating and
+  compressing don't hold up the engine.
+  """
+  def __init__(self, filename, mode="a", rotatesize=0, rotatetime=0, 
+               compress="none", keep=0):
+    """
+    @param filename: the logfile
+    @type  filename: string
+
+    @param mode: "a" to append or "w" to start over
+    @type  mode: string
+
+    @param rotatesize: how many characters go in a segment--0 for
+        no limit
+    @type  rotatesize: int
+
+    @param rotatetime: how many seconds a segment stays open--0 for
+        no limit
+    @type  rotatetime: int
+
+    @param compress: "none", "stream" or "segments"
+    @type  compress: string
+
+    @param keep: how many finished segments to keep--0 keeps them all
+    @type  keep: int
+
+    @raises IOError: if the logfile can't be opened
+    """
+    self._base = filename
+    self._rotatesize = rotatesize
+    self._rotatetime = rotatetime
+    self._compress = compress
+    self._keep = keep
+    self._segments = 0
+
+    # the time stamp of the last segment we finished and how many 
+    # segments we've finished with that stamp--we number the ones
+    # after the first so they sort right
+    self._laststamp = None
+    self._stampcount = 0
+
+    self.name = filename
+    if compress == "stream":
+      self.name = filename + ".gz"
+    self._open(mode)
+
+  def _open(self, mode):
+    if self._compress == "stream":
+      self._file = io.TextIOWrapper(gzip.GzipFile(self.name, mode + "b"))
+      self._size = 0
+    else:
+      self._file = io.open(self.name, mode)
+      self._size = self._file.tell()
+    self._opened = time.time()
+
+  def write(self, text):
+    """
+    Writes text to the current segment, starting a new one first if 
+    it's time.
+
+    @param text: the text
+    @type  text: unicode
+    """
+    if ((self._rotatesize and self._size >= self._rotatesize) or
+        (self._rotatetime and time.time() - self._opened >= self._rotatetime)):
+      self.rotate()
+    self._file.write(text)
+    self._size += len(text)
+
+  def flush(self):
+    self._file.flush()
+
+  def fileno(self):
+    return self._file.fileno()
+
+  def close(self):
+    self._file.close()
+
+  def rotate(self):
+    """
+    Finishes the current segment and starts a new one.
+    """
+    self._file.close()
+
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime())
+    if stamp == self._laststamp:
+      self._stampcount += 1
+    else:
+      self._laststamp = stamp
+      self._stampcount = 0
+
+    while 1:
+      finished = "%s.%s" % (self._base, stamp)
+      if self._stampcount:
+        finished += "-%d" % self._stampcount
+      if not os.path.exists(finished) and not os.path.exists(finished + ".gz"):
+        break
+      self._stampcount += 1
+
+    if self._compress == "stream":
+      os.rename(self.name, finished + ".gz")
+    else:
+      os.rename(self.name, finished)
+    self._segments += 1
+    self._open("a")
+
+    if self._compress == "segments":
+      exported.myengine.startthread("logger: compress", 
+                                    lambda: self._compressSegment(finished))
+    else:
+      self._expire()
+
+  def _compressSegment(self, filename):
+    """
+    gzips a finished segment.  This runs in its own thread.
+    """
+    try:
+      src = open(filename, "rb")
+      dst = gzip.open(filename + ".gz", "wb")
+      shutil.copyfileobj(src, dst)
+      dst.close()
+      src.close()
+      os.remove(filename)
+    except (IOError, OSError), e:
+      exported.write_error("log: can't compress %s: %s" % (filename, e))
+    self._expire()
+
+  def getSegments(self):
+    """
+    Returns the finished segments there are for this logfile, oldest
+    first.
+
+    @return: the segment file names
+    @rtype:  list of strings
+    """
+    dirname, basename = os.path.split(self._base)
+    pattern = re.compile(re.escape(basename) + 
+                         r"\.(\d{8}-\d{6})(?:-(\d+))?(?:\.gz)?$")
+    segments = []
+    for mem in os.listdir(dirname or os.curdir):
+      match = pattern.match(mem)
+      if match:
+        segments.append((match.group(1), int(match.group(2) or 0), 
+                         os.path.join(dirname, mem)))
+    segments.sort()
+    return [mem[2] for mem in segments]
+
+  def _expire(self):
+    """
+    Deletes the oldest finished segments if we've got more than keep.
+    """
+    if self._keep <= 0:
+      return
+    segments = self.getSegments()
+    for mem in segments[:-self._keep]:
+      try:
+        os.remove(mem)
+      except OSError:
+        pass
+
+  def getDescription(self):
+    """
+    Returns how we're rotating and compressing for #log.
+
+    @return: the description
+    @rtype:  string
+    """
+    data = []
+    if self._rotatesize:
+      data.append("rotating at %d chars" % self._rotatesize)
+    if self._rotatetime:
+      data.append("rotating every %ds" % self._rotatetime)
+    if self._compress != "none":
+      data.append("compress=%s" % self._compress)
+    if self._keep:
+      data.append("keeping %d" % self._keep)
+    data.append("%d rotated" % self._segments)
+    return ", ".join(data)
+
+
+# how far apart (in seconds of log time or bytes of log) the entries
+# in a JSON lines log's time index are
+INDEX_SECONDS = 60
+INDEX_BYTES = 256 * 1024
+
+SEARCH_TIME_REGEXP = re.compile(
+    r"^(?:(\d{4})-(\d\d?)-(\d\d?)[T/])?(\d\d?):(\d\d)(?::(\d\d))?$")
+
+def parse_search_time(text, now=None):
+  """
+  Parses a time to search a log for.  It can be:
+
+    - a time of day like 21:14 or 21:14:30--the last time it was
+      that time
+    - a date and time like 2007-07-24/21:14
+    - a timespan like 10m--that long ago
+
+  @param text: the time
+  @type  text: string
+
+  @return: seconds since the epoch
+  @rtype:  float
+
+  @raises ValueError: if it's not a time
+  """
+  if now == None:
+    now = time.time()
+
+  match = SEARCH_TIME_REGEXP.match(text)
+  if not match:
+    try:
+      return now - utils.parse_timespan(text)
+    except:
+      raise ValueError("'%s' isn't a time like 21:14, 2007-07-24/21:14 "
+                       "or 10m." % text)
+
+  year, month, day, hour, minute, second = match.groups()
+  current = time.localtime(now)
+  if year:
+    date = (int(year), int(month), int(day))
+  else:
+    date = current[:3]
+  timetuple = date + (int(hour), int(minute), int(second or 0), 0, 0, -1)
+
+  try:
+    when = time.mktime(timetuple)
+  except (OverflowError, ValueError), e:
+    raise ValueError("'%s' isn't a time: %s" % (text, e))
+  if not year and when > now:
+    # it's not that time yet today, so they mean yesterday
+    when = time.mktime(timetuple[:2] + (timetuple[2] - 1,) + timetuple[3:])
+  return when
+
+def format_record(t, ses, direction, raw, text):
+  """
+  Builds a JSON lines log record.  The time comes first so JsonlLog 
+  can pull it out without parsing the whole record.
+
+  @param t: seconds since the epoch
+  @type  t: float
+
+  @param ses: the session name
+  @type  ses: string
+
+  @param direction: "mud", "prompt" or "user"
+  @type  direction: string
+
+  @param raw: the text as it came in (or went out) with ANSI
+  @type  raw: unicode
+
+  @param text: the text without ANSI or carriage returns
+  @type  text: unicode
+
+  @return: the record with a newline on the end--it's all ascii
+  @rtype:  string
+  """
+  return '{"t": %.3f, "ses": %s, "dir": "%s", "raw": %s, "text": %s}\n' % \
+         (t, json.dumps(ses), direction, json.dumps(raw), json.dumps(text))
+
+def record_time(line):
+  """
+  Pulls the time out of a record from format_record.
+
+  @return: the time or None if it's not a record
+  @rtype:  float
+  """
+  if not line.startswith('{"t": '):
+    return None
+  try:
+    return float(line[6:line.index(",")])
+  except ValueError:
+    return None
+
+
+class JsonlLog:
+  """
+  A JSON lines logfile (see format_record) with a time index.  The 
+  index is a file next to the log with ".idx" tacked on.  Each line
+  is a time and the byte offset of the first record in the log at or
+  after that time.  There's an entry every INDEX_SECONDS seconds of 
+  log time or INDEX_BYTES bytes of log, whichever comes first, so 
+  the index stays small and finding a time only means reading a 
+  little of the log.
+
+  This gets written to from the LogWriter thread.
+  """
+  def __init__(self, filename, mode="a"):
+    """
+    @param filename: the logfile
+    @type  filename: string
+
+    @param mode: "a" to append or "w" to start over
+    @type  mode: string
+
+    @raises IOError: if the files can't be opened
+    """
+    self.name = filename
+    self._file = open(filename, mode + "b")
+    self._file.seek(0, 2)
+    self._offset = self._file.tell()
+    self._index = open(filename + ".idx", mode)
+
+    self._lasttime = None
+    self._lastoffset = None
+
+  def write(self, text):
+    """
+    Writes records, adding index entries as we go.
+
+    @param text: whole records
+    @type  text: unicode
+    """
+    data = text.encode("ascii")
+    pos = 0
+    while pos < len(data):
+      end = data.find("\n", pos) + 1 or len(data)
+      t = record_time(data[pos:end])
+      offset = self._offset + pos
+      if t != None and (self._lasttime == None or 
+                        t - self._lasttime >= INDEX_SECONDS or
+                        offset - self._lastoffset >= INDEX_BYTES):
+        self._index.write("%.3f %d\n" % (t, offset))
+        self._lasttime = t
+        self._lastoffset = offset
+      pos = end
+
+    self._file.write(data)
+    self._offset += len(data)
+
+  def flush(self):
+    self._file.flush()
+    self._index.flush()
+
+  def fileno(self):
+    return self._file.fileno()
+
+  def close(self):
+    self._file.close()
+    self._index.close()
+
+
+def read_records(filename, start, end):
+  """
+  Reads the records from a JSON lines log between two times.  If the
+  log has a time index, we use it to skip to the right place.
+
+  @param filename: the logfile
+  @type  filename: string
+
+  @param start: the earliest time (seconds since the epoch)
+  @type  start: float
+
+  @param end: the latest time
+  @type  end: float
+
+  @return: the records (dicts) in the order they're in the log
+  @rtype:  generator
+
+  @raises IOError: if the log can't be read
+  """
+  offset = 0
+  if os.path.exists(filename + ".idx"):
+    times = []
+    offsets = []
+    f = open(filename + ".idx", "r")
+    for mem in f:
+      mem = mem.split()
+      if len(mem) == 2:
+        times.append(float(mem[0]))
+        offsets.append(int(mem[1]))
+    f.close()
+
+    # start at the last entry before start--the records between that 
+    # entry and the next one are all before the next entry's time
+    i = bisect.bisect_left(times, start) - 1
+    if i >= 0:
+      offset = offsets[i]
+
+  f = open(filename, "rb")
+  try:
+    f.seek(offset)
+    for line in f:
+      t = record_time(line)
+      if t == None or t < start:
+        continue
+      if t > end:
+        break
+      try:
+        yield json.loads(line)
+      except ValueError:
+        continue
+  finally:
+    f.close()
+
+
+class LogWriter:
+  """
+  Writes to a logfile in its own thread.  Text gets queued up and the
+  writer thread writes it out in groups: when there's logflushsize
+  bytes waiting or the oldest text has been waiting logflushtime
+  milliseconds, whichever comes first.  If logsyncinterval is more
+  than 0, the file also gets fsync'd at most that many seconds apart.
+
+  If the writer falls behind and logqueuesize writes are waiting, 
+  logbehind says what happens: "block" holds up whoever's writing 
+  until there's room (no text is lost) and "drop" throws the text
+  away and puts a note in the log saying how many lines were lost.
+  """
+  def __init__(self, fileob, settings):
+    """
+    @param fileob: the file to write to--the writer closes it when 
+        it's done
+    @type  fileob: File
+
+    @param settings: config item name -> value for the WRITER_DEFAULTS
+        config items.  this is shared and can change while we run.
+    @type  settings: dict
+    """
+    self._file = fileob
+    self._settings = settings
+
+    self._cond = threading.Condition()
+    self._pending = []
+    self._pendingbytes = 0
+    self._firstpending = 0
+    self._closed = 0
+    self._done = 0
+    self._error = None
+
+    # dropped lines we haven't put a note in the log about yet
+    self._unreported = 0
+
+    # for getStatus
+    self._writes = 0
+    self._flushes = 0
+    self._syncs = 0
+    self._dropped = 0
+    self._blocked = 0
+
+  def start(self, name):
+    """
+    Starts the writer thread.
+
+    @param name: the name of the thread
+    @type  name: string
+    """
+    exported.myengine.startthread(name, self.run)
+
+  def write(self, text):
+    """
+    Queues text to be written.
+
+    @param text: the text
+    @type  text: unicode
+
+    @raises IOError: if the writer thread couldn't write to the file
+    """
+    settings = self._settings
+    self._cond.acquire()
+    try:
+      if self._error != None:
+        raise self._error
+      if self._closed:
+        return
+
+      # with no room at all, blocking would wait forever and dropping
+      # would drop everything
+      queuesize = max(1, settings["logqueuesize"])
+      if len(self._pending) >= queuesize:
+        if settings["logbehind"] == "drop":
+          self._dropped += 1
+          self._unreported += 1
+          return
+
+        self._blocked += 1
+        while (len(self._pending) >= queuesize and
+               self._error == None and not self._done):
+          self._cond.wait(1.0)
+        if self._error != None:
+          raise self._error
+
+      if not self._pending:
+        self._firstpending = time.time()
+        self._cond.notifyAll()
+      self._pending.append(text)
+      self._pendingbytes += len(text)
+      if self._pendingbytes >= settings["logflushsize"]:
+        self._cond.notifyAll()
+    finally:
+      self._cond.release()
+
+  def close(self):
+    """
+    Tells the writer thread to write out what's left and close the
+    file.  We wait CLOSE_TIMEOUT seconds for it to finish.
+    """
+    self._cond.acquire()
+    try:
+      self._closed = 1
+      self._cond.notifyAll()
+      end = time.time() + CLOSE_TIMEOUT
+      while not self._done and time.time() < end:
+        self._cond.wait(end - time.time())
+    finally:
+      self._cond.release()
+
+  def run(self):
+    """
+    The writer thread.
+    """
+    settings = self._settings
+    lastsync = time.time()
+    while 1:
+      self._cond.acquire()
+      try:
+        while not self._closed:
+          if self._pendingbytes >= settings["logflushsize"]:
+            break
+          if self._pending:
+            wait = (self._firstpending + settings["logflushtime"] / 1000.0 - 
+                    time.time())
+            if wait <= 0:
+              break
+            self._cond.wait(wait)
+          else:
+            self._cond.wait()
+
+        batch = self._pending
+        if self._unreported:
+          batch.append(u"--- %d lines dropped: the log writer fell behind ---\n" 
+                       % self._unreported)
+          self._unreported = 0
+        self._pending = []
+        self._pendingbytes = 0
+        closed = self._closed
+
+        # there's room now for anyone waiting to write
+        self._cond.notifyAll()
+      finally:
+        self._cond.release()
+
+      try:
+        if batch:
+          self._file.write(u"".join(batch))
+          self._file.flush()
+          self._writes += len(batch)
+          self._flushes += 1
+
+        syncinterval = settings["logsyncinterval"]
+        if syncinterval > 0 and (closed or time.time() - lastsync >= syncinterval):
+          os.fsync(self._file.fileno())
+          lastsync = time.time()
+          self._syncs += 1
+
+        if closed:
+          self._file.close()
+      except Exception, e:
+        self._cond.acquire()
+        self._error = e
+        self._done = 1
+        self._cond.notifyAll()
+        self._cond.release()
+        return
+
+      if closed:
+        self._cond.acquire()
+        self._done = 1
+        self._cond.notifyAll()
+        self._cond.release()
+        return
+
+  def getStatus(self):
+    """
+    Returns a short description of how the writer is doing.
+
+    @return: the description
+    @rtype:  string
+    """
+    status = "%d pending, %d written in %d flushes" % \
+             (len(self._pending), self._writes, self._flushes)
+    if self._syncs:
+      status += ", %d syncs" % self._syncs
+    if self._blocked:
+      status += ", blocked %d times" % self._blocked
+    if self._dropped:
+      status += ", %d dropped" % self._dropped
+    return status
+
 
 class LoggerData:
-  def __init__(self, session):
+  def __init__(self, session, settings=WRITER_DEFAULTS):
     self._logfile = None
+    self._writer = None
+    self._settings = settings
+    # "text" or "jsonl"
+    self._format = "text"
+    # the time of the last jsonl record so the times never go backwards
+    self._lasttime = 0
     self._session = session
     # whether or not to strip ansi--0 is off, 1 is on
     self._strip_ansi = 0
@@ -50,7 +762,7 @@ class LoggerData:
     @param input: the string to log to the logfile for this session
     @type  input: string
     """
-    if self._logfile == None:
+    if self._writer == None:
       return
 
     try:
@@ -59,10 +771,39 @@ class LoggerData:
 
       text = utils.filter_cm(input)
       #text = text.replace("\n", os.linesep)
-      self._logfile.write(text)
-      self._logfile.flush()
+      self._writer.write(text)
+    except:
+      self._logfile = None
+      self._writer = None
+      exported.write_traceback("Logfile cannot be written to.", self._session)
+
+  def record(self, direction, raw):
+    """
+    Logs a JSON lines record.
+
+    @param direction: "mud", "prompt" or "user"
+    @type  direction: string
+
+    @param raw: the text
+    @type  raw: string
+    """
+    if self._writer == None:
+      return
+
+    try:
+      self._lock.acquire()
+      t = max(time.time(), self._lasttime)
+      self._lasttime = t
+    finally:
+      self._lock.release()
+
+    try:
+      text = ansi.filter_ansi(utils.filter_cm(raw))
+      self._writer.write(format_record(t, self._session.getName(), 
+                                       direction, raw, text))
     except:
       self._logfile = None
+      self._writer = None
       exported.write_traceback("Logfile cannot be written to.", self._session)
 
   def log_mud(self, input):
@@ -72,6 +813,13 @@ class LoggerData:
     @param input: the string from the mud for this session
     @type  input: string
     """
+    if self._format == "jsonl":
+      if input.endswith("\n"):
+        self.record("mud", input)
+      else:
+        self.record("prompt", input)
+      return
+
     try:
       self._lock.acquire()
       
@@ -110,6 +858,10 @@ class LoggerData:
     @param input: the string from user
     @type  input: string
     """
+    if self._format == "jsonl":
+      self.record("user", input)
+      return
+
     try:
       self._lock.acquire()
       self._user_input.append(input)
@@ -138,7 +890,7 @@ class LoggerData:
     @returns: 1 if we're logging, 0 if not
     @rtype: boolean
     """
-    if self._logfile == None:
+    if self._writer == None:
       return 0
     return 1
 
@@ -157,11 +909,12 @@ class LoggerData:
     finally:
       self._lock.release()
 
-    if self._logfile:
-      self._logfile.close()
+    if self._writer:
+      self._writer.close()
+      self._writer = None
       self._logfile = None
 
-  def openLogFile(self, filename, stripansi=1, userprefix=''):
+  def openLogFile(self, filename, stripansi=1, userprefix='', **rotation):
     """
     Opens a new logfile.
 
@@ -171,21 +924,33 @@ class LoggerData:
     @param stripansi: whether (1) or not (0) to strip ansi from the
         logs
     @type  stripansi: boolean
+
+    @param rotation: rotatesize, rotatetime, compress and keep 
+        arguments for open_log
+    @type  rotation: dict
     """
       
     # FIXME - what happens if we already have a logfile open?
-    self.setLogFile(io.open(filename, "a"), stripansi, userprefix)
+    self.setLogFile(open_log(filename, "a", **rotation), stripansi, userprefix)
 
-  def setLogFile(self, fileob, stripansi=1, userprefix=""):
+  def setLogFile(self, fileob, stripansi=1, userprefix="", format="text"):
     """
     Sets the logfile.
 
     @param fileob: the new File instance
     @type  fileob: File
+
+    @param format: "text" or "jsonl"--for jsonl, fileob should be a
+        JsonlLog
+    @type  format: string
     """
     self._logfile = fileob
     self._strip_ansi = stripansi
     self._userprefix = userprefix
+    self._format = format
+
+    self._writer = LogWriter(fileob, self._settings)
+    self._writer.start("logger: %s" % self._session.getName())
 
   def clear(self):
     """
@@ -200,11 +965,16 @@ class LoggerData:
     @return: one liner describing this object
     @rtype: string
     """
-    if self._logfile:
+    if self._writer:
       if self._strip_ansi == 1:
-        return "logging to '" + self._logfile.name + "' (noansi)"
+        status = "logging to '" + self._logfile.name + "' (noansi)"
       else:
-        return "logging to '%s'" % self._logfile.name
+        status = "logging to '%s'" % self._logfile.name
+      if isinstance(self._logfile, RotatingLog):
+        status += " (%s)" % self._logfile.getDescription()
+      if self._format == "jsonl":
+        status += " (jsonl)"
+      return "%s: %s" % (status, self._writer.getStatus())
     else:
       return "logging not enabled"
 
@@ -213,6 +983,10 @@ class LoggerManager(manager.Manager):
   def __init__(self):
     self._loggers = {}
 
+    # the current values of the log writer config items--the 
+    # LogWriters all share this
+    self._settings = WRITER_DEFAULTS.copy()
+
   def clear(self, ses):
     if self._loggers.has_key(ses):
       self._loggers[ses].clear()
@@ -231,10 +1005,26 @@ class LoggerManager(manager.Manager):
     if self._loggers.has_key(ses):
       return self._loggers[ses]
 
-    logger = LoggerData(ses)
+    logger = LoggerData(ses, self._settings)
     self._loggers[ses] = logger
     return logger
 
+  def configchange(self, args):
+    """
+    config_change_hook function for keeping the log writer settings
+    up to date.
+    """
+    if args["session"] == None and self._settings.has_key(args["name"]):
+      self._settings[args["name"]] = args["newvalue"]
+
+  def shutdown(self, args):
+    """
+    shutdown_hook function for writing out what the log writers
+    have queued up and closing the logfiles.
+    """
+    for mem in self._loggers.values():
+      mem.closeLogFile()
+
   def mudfilter(self, args):
     """
     mud_filter_hook function for filtering incoming data from the mud.
@@ -285,12 +1075,52 @@ def log_cmd(ses, args, input):
   If USERPREFIX is omitted, then the user input will be attached to 
   mud prompts before logging.
 
+  The log can be split into segments.  ROTATESIZE starts a new 
+  segment when the current one has that much text (like 500k, 100m
+  or 2g) and ROTATETIME starts one when the current one has been 
+  open that long (like 1h or 1d).  Finished segments get the time 
+  they were finished tacked on to the logfile name (mud.log becomes
+  mud.log.20070724-003903).  KEEP sets how many finished segments
+  to keep--the oldest ones get deleted.
+
+  COMPRESS can be "stream" to gzip the log as it's written (the 
+  logfile gets .gz tacked on) or "segments" to gzip finished 
+  segments in the background.
+
+  FORMAT can be "jsonl" to log a JSON record per line with the time,
+  the session, whether it's mud data, a prompt or user input, and the
+  text with and without ANSI.  There's a time index next to the log
+  (the logfile with .idx tacked on) that #logsearch uses.  JSON lines
+  logs don't rotate or compress.  STRIPANSI and USERPREFIX don't 
+  apply to them.
+
+  examples:
+    #log mud.log rotatesize=100m compress=stream keep=10
+        logs to mud.log.gz, starts a new segment every 100 megs of 
+        text, and keeps the last 10 finished segments
+
   category: commands
   """
   logfile = args["logfile"]
   databuffer = args["databuffer"]
   stripansi = args["stripansi"]
   userprefix = args["userprefix"]
+  format = args["format"]
+  rotation = {"rotatetime": args["rotatetime"],
+              "compress": args["compress"],
+              "keep": args["keep"]}
+  try:
+    rotation["rotatesize"] = parse_size(args["rotatesize"])
+  except ValueError, e:
+    exported.write_error("log: %s" % e, ses)
+    return
+
+  if format == "jsonl" and (databuffer or rotation["rotatesize"] or 
+                            rotation["rotatetime"] or 
+                            rotation["compress"] != "none"):
+    exported.write_error("log: jsonl logs can't include the databuffer, "
+                         "rotate, or compress.", ses)
+    return
 
   if not ses.isConnected():
     exported.write_error("log: You must have a session to log.", ses)
@@ -318,16 +1148,18 @@ def log_cmd(ses, args, input):
     if os.sep not in logfile:
       logfile = config.options["datadir"] + logfile
 
-    if databuffer:
-      f = io.open(logfile, "w")
-      buffer = "".join(ses.getDataBuffer())
-      f.write(buffer)
-      exported.write_message("log: dumped %d lines of databuffer to logfile" % buffer.count("\n"), ses)
+    if format == "jsonl":
+      loggerdata.setLogFile(JsonlLog(logfile), 0, "", "jsonl")
+
+    elif databuffer:
+      f = open_log(logfile, "w", **rotation)
+      count = dump_lines(ses.getDataBuffer(), f)
+      exported.write_message("log: dumped %d lines of databuffer to logfile" % count, ses)
       loggerdata.setLogFile(f, stripansi, userprefix)
 
     else:
-      loggerdata.openLogFile(logfile, stripansi, userprefix)
-    if stripansi:
+      loggerdata.openLogFile(logfile, stripansi, userprefix, **rotation)
+    if stripansi and format == "text":
       stripansimessage = " stripping ansi"
     else:
       stripansimessage = ""
@@ -336,7 +1168,78 @@ def log_cmd(ses, args, input):
   except Exception, e:
     exported.write_error("log: logfile cannot be opened for appending. %s" % (e), ses)
 
-commands_dict["log"] = (log_cmd, 'logfile= databuffer:boolean=false stripansi:boolean=true userprefix=')
+commands_dict["log"] = (log_cmd, 'logfile= databuffer:boolean=false stripansi:boolean=true userprefix= rotatesize=0 rotatetime:timespan=0 compress:choice:none|stream|segments=none keep:int=0 format:choice:text|jsonl=text')
+
+def logsearch_cmd(ses, args, input):
+  """
+  Shows what happened around a time in a JSON lines log (see the 
+  format argument of #log).  The log's time index lets us skip 
+  straight to that time no matter how big the log is.
+
+  WHEN can be a time of day (the last time it was that time), a date
+  and time, or a timespan (that long ago).  We show everything from
+  WINDOW before WHEN to WINDOW after it.  PATTERN is a regular 
+  expression the text has to match and DIRECTION picks mud data, 
+  prompts, or user input.
+
+  examples:
+    #logsearch mud.jsonl 21:14
+    #logsearch mud.jsonl 2007-07-24/21:14 window=1m
+    #logsearch mud.jsonl 2h pattern={tells you} direction=mud
+
+  category: commands
+  """
+  logfile = args["logfile"]
+  window = args["window"]
+  direction = args["direction"]
+  limit = args["limit"]
+
+  if os.sep not in logfile:
+    logfile = config.options["datadir"] + logfile
+
+  try:
+    when = parse_search_time(args["when"])
+  except ValueError, e:
+    exported.write_error("logsearch: %s" % e, ses)
+    return
+
+  try:
+    pattern = None
+    if args["pattern"]:
+      pattern = re.compile(args["pattern"])
+  except re.error, e:
+    exported.write_error("logsearch: bad pattern: %s" % e, ses)
+    return
+
+  data = []
+  more = 0
+  try:
+    for mem in read_records(logfile, when - window, when + window):
+      if direction != "all" and mem["dir"] != direction:
+        continue
+      if pattern and not pattern.search(mem["text"]):
+        continue
+      if len(data) >= limit:
+        more = 1
+        break
+      data.append("%s %-6s %s" % (time.strftime("%H:%M:%S", 
+                                  time.localtime(mem["t"])), 
+                                  mem["dir"], mem["text"].rstrip("\n")))
+  except (IOError, OSError), e:
+    exported.write_error("logsearch: can't read %s: %s" % (logfile, e), ses)
+    return
+
+  header = "logsearch: %s from %s to %s" % (logfile, 
+      time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(when - window)),
+      time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(when + window)))
+  if not data:
+    exported.write_message(header + ": nothing found.", ses)
+    return
+  if more:
+    data.append("(stopped after %d records)" % limit)
+  exported.write_message(header + "\n" + "\n".join(data), ses)
+
+commands_dict["logsearch"] = (logsearch_cmd, "logfile when window:timespan=5m pattern= direction:choice:all|mud|prompt|user=all limit:int=200")
 
 
 
@@ -352,6 +1255,32 @@ def load():
   exported.hook_register("to_mud_hook", lm.tomudfilter, constants.LAST+1)
   exported.hook_register("mud_filter_hook", lm.mudfilter, 30)
   exported.hook_register("prompt_hook", lm.promptfilter, 30)
+  exported.hook_register("config_change_hook", lm.configchange)
+  exported.hook_register("shutdown_hook", lm.shutdown)
+
+  exported.add_config("logqueuesize", config.IntConfig("logqueuesize", 
+      WRITER_DEFAULTS["logqueuesize"], 0,
+      "How many writes can be waiting for a log writer before logbehind "
+      "kicks in.  Anything less than 1 counts as 1."))
+  exported.add_config("logflushsize", config.IntConfig("logflushsize", 
+      WRITER_DEFAULTS["logflushsize"], 0,
+      "Log writers write out what's waiting once there's this many "
+      "characters of it."))
+  exported.add_config("logflushtime", config.IntConfig("logflushtime", 
+      WRITER_DEFAULTS["logflushtime"], 0,
+      "Log writers write out what's waiting once it's been waiting this "
+      "long (in milliseconds)."))
+  exported.add_config("logsyncinterval", config.IntConfig("logsyncinterval", 
+      WRITER_DEFAULTS["logsyncinterval"], 0,
+      "If this is more than 0, log writers make sure what they've "
+      "written is on the disk (fsync) at most this many seconds apart "
+      "and when the log is closed."))
+  exported.add_config("logbehind", config.ChoiceConfig("logbehind", 
+      WRITER_DEFAULTS["logbehind"], 0,
+      "What happens when a log writer has logqueuesize writes waiting: "
+      "block holds up Lyntin until the writer catches up and drop throws "
+      "away log text (with a note in the log saying how many lines).",
+      ["block", "drop"]))
 
 def unload():
   """ Unloads the module by calling any unload/unbind functions."""
@@ -362,6 +1291,12 @@ def unload():
   exported.hook_unregister("to_mud_hook", lm.tomudfilter)
   exported.hook_unregister("mud_filter_hook", lm.mudfilter)
   exported.hook_unregister("prompt_hook", lm.promptfilter)
+  exported.hook_unregister("config_change_hook", lm.configchange)
+  exported.hook_unregister("shutdown_hook", lm.shutdown)
+  lm.shutdown({})
+
+  for mem in WRITER_DEFAULTS.keys():
+    exported.remove_config(mem)
 
 # Local variables:
 # mode:python
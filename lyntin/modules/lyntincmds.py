@@ -27,6 +27,9 @@ from lyntin.modules import modutils
 
 commands_dict = {}
 
+# how many #grep results get written out at a time
+GREP_CHUNK = 200
+
 def _fixmap(w, themap):
   keys = themap.keys()
   keys.sort()
@@ -183,6 +186,18 @@ def grep_cmd(ses, args, input):
     Greps the last 1000 lines of the databuffer for lines that have
     "says:" in them.
 
+  If the scrollbackarchive config item is on for the session, the
+  databuffer reaches back into the archive, so the size can be
+  bigger than the number of lines kept in memory.
+
+  The first #grep in a session builds an index of the scrollback 
+  that's kept up to date from then on, so searches for text (rather
+  than patterns like "\d+ gold") only look at the lines that have the
+  text in them.  Doing the same #grep again only searches the lines
+  that came in since the last time.
+
+  Lots of results get written out a chunk at a time.
+
   category: commands
   """
   if (ses.getName() == "common"):
@@ -194,35 +209,32 @@ def grep_cmd(ses, args, input):
   context = args["context"]
   buffer = ses.getDataBuffer()
 
-  ret = []
-  cpattern = re.compile(pattern)
-  for i in range(max(len(buffer)-size,0), len(buffer)):
-    mem = buffer[i]
-    if cpattern.search(mem):
-      if context > 0:
-        mem = []
-        if i > 0:
-          bound = i - context
-          if bound < 0: bound = 0
-          for j in range(bound, i):
-            mem.append("  " + buffer[j])
-
-        mem.append("+ " + buffer[i])
-
-        if i < len(buffer):
-          bound = i+context+1
-          if bound > len(buffer)-1: bound = len(buffer)-1
-          for j in range(i+1, bound):
-            mem.append("  " + buffer[j])
-        mem = "".join(mem)
-
-      ret.append(mem)
-
   if context == 0:
     splitter = ""
   else:
     splitter = "---\n"
-  exported.write_message("grep %s results:\n%s" % (pattern, splitter.join(ret)), ses)
+
+  ret = []
+  header = "grep %s results:\n" % pattern
+  cpattern = re.compile(pattern)
+  for i, mem in buffer.search(cpattern, len(buffer) - size):
+    if context > 0:
+      mem = ["  " + line for line in buffer[max(i - context, 0):i]] + \
+            ["+ " + mem] + \
+            ["  " + line for line in buffer[i + 1:i + 1 + context]]
+      mem = "".join(mem)
+    ret.append(mem)
+
+    if len(ret) >= GREP_CHUNK:
+      text = header + splitter.join(ret)
+      if text.endswith("\n"):
+        text = text[:-1]
+      exported.write_message(text, ses)
+      header = splitter
+      ret = []
+
+  if ret or header != splitter:
+    exported.write_message(header + splitter.join(ret), ses)
 
 commands_dict["grep"] = (grep_cmd, "pattern size:int=300 context:int=0")
 
@@ -241,6 +253,14 @@ def diagnostics_cmd(ses, args, input):
   to that file.  This allows you easier method of submitting diagnostics
   output along with bug reports.
 
+  If the eventtiming config item is on, the timingfile argument will
+  write the event timing histograms to that file as JSON for graphing
+  and comparing runs.  Times are in seconds.
+
+  examples:
+    #diagnostics dumpfile.txt
+    #diagnostics timingfile=timings.json
+
   Note: Windows users should either use two \\'s or use / to separate
   directory names.
 
@@ -298,7 +318,117 @@ def diagnostics_cmd(ses, args, input):
       exported.write_error("diagnostics: Error writing to file %s. %s" 
                             % (logfile, e))
 
-commands_dict["diagnostics"] = (diagnostics_cmd, "logfile=")
+  timingfile = args["timingfile"]
+  if timingfile:
+    timings = exported.myengine.getEventTimings()
+    if timings == None:
+      exported.write_error("diagnostics: eventtiming is off.  Turn it on "
+                           "with #config eventtiming on.")
+      return
+
+    import json, time
+    try:
+      f = open(timingfile, "w")
+      json.dump({"created": time.time(), "events": timings}, f, indent=1,
+                sort_keys=True)
+      f.close()
+      exported.write_message("diagnostics: timings written out to file %s." 
+                             % timingfile)
+    except Exception, e:
+      exported.write_error("diagnostics: Error writing to file %s. %s" 
+                            % (timingfile, e))
+
+commands_dict["diagnostics"] = (diagnostics_cmd, "logfile= timingfile=")
+
+
+def _funcname(func):
+  """
+  Returns a readable name for a function registered with a hook.
+  """
+  name = getattr(func, "__name__", None)
+  if name == None:
+    return repr(func)
+  if hasattr(func, "im_class"):
+    name = func.im_class.__name__ + "." + name
+  module = getattr(func, "__module__", None)
+  if module:
+    name = module + "." + name
+  return name
+
+def hookprof_cmd(ses, args, input):
+  """
+  Profiles the functions registered with hooks so you can see which
+  plugins are slowing things down.  For each hook, it shows how many
+  times each function got called along with the total and the max
+  time it took.  Hooks with the most total time are listed first.
+
+  Profiling is off until you turn it on.  Turning it off throws the
+  data away.
+
+  examples:
+    #hookprof on
+    #hookprof
+    #hookprof hook=mud_filter_hook
+    #hookprof reset
+    #hookprof off
+
+  category: commands
+  """
+  action = args["action"]
+  hook = args["hook"]
+
+  if action == "on":
+    exported.myengine.setHookProfiling(1)
+    exported.write_message("hookprof: hook profiling on.")
+    return
+
+  if action == "off":
+    exported.myengine.setHookProfiling(0)
+    exported.write_message("hookprof: hook profiling off.")
+    return
+
+  if action == "reset":
+    if exported.myengine.isHookProfiling():
+      exported.myengine.setHookProfiling(0)
+      exported.myengine.setHookProfiling(1)
+    exported.write_message("hookprof: hook profiling data reset.")
+    return
+
+  if action:
+    hook = action
+
+  if not exported.myengine.isHookProfiling():
+    exported.write_error("hookprof: hook profiling is off.  Turn it on "
+                         "with #hookprof on.")
+    return
+
+  profile = exported.myengine.getHookProfile()
+  hooks = []
+  for name, funcs in profile.items():
+    if hook and name != hook:
+      continue
+    total = 0.0
+    for func, calls, functotal, maxtime in funcs:
+      total += functotal
+    hooks.append((total, name, funcs))
+  hooks.sort()
+  hooks.reverse()
+
+  if not hooks:
+    exported.write_message("hookprof: no hook calls recorded.")
+    return
+
+  data = ["hookprof:"]
+  for total, name, funcs in hooks:
+    data.append("%s: %.2fms total" % (name, total * 1000))
+    for func, calls, functotal, maxtime in funcs:
+      data.append("   %9.2fms total %7d calls %8.3fms avg %8.2fms max  %s" %
+                  (functotal * 1000, calls, functotal * 1000 / calls,
+                   maxtime * 1000, _funcname(func)))
+
+  exported.write_message("\n".join(data))
+
+commands_dict["hookprof"] = (hookprof_cmd, "action= hook=")
 
 
 def raw_cmd(ses, args, input):
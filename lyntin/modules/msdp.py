@@ -188,7 +188,7 @@ def handle_telnet_option(args):
                 requested_vars= args["requested_vars"]
                 if requested_vars:
                     session._socket.write(''.join(encode_msdp([MSDPVar("REPORT", v)]) for v in requested_vars), 0)
-        event.SpamEvent("msdp_data", {'session': session, 'vars': vars}).enqueue()
+        event.SpamEvent("msdp_data", {'session': session, 'vars': vars}, lane="mud").enqueue()
     raise exported.StopSpammingException
 
 def load():
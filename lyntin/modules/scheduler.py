@@ -21,16 +21,16 @@
 """
 This module defines the ScheduleManager which manages scheduling 
 events for Lyntin.  It's pretty intense.  It handles both events
-oriented around "lyntin time" (what the current Lyntin tick is)
-as well as "real time" (what time it really is).  Scheduled
-events can be lyntin commands as well as functions with 
+that kick off some number of seconds from now (fractions of a 
+second are fine) as well as "real time" (what time it really is).
+Scheduled events can be lyntin commands as well as functions with 
 arguments.
 
 This module implements the #schedule and #unschedule commands
 as well as the completely re-implemented #tick* suite of
 commands.
 """
-import time
+import time, heapq, threading
 from lyntin import exported, manager, utils, event
 from lyntin.modules import modutils
 
@@ -59,8 +59,8 @@ class SchedEvent:
 
   def __repr__(self):
     if self._repeat == 0:
-      return truncate("%s [%s] %d {%s}" % (self._id, self._ses._name, self._offset, self._cmd), 60)
-    return truncate("%s [%s] %d(r) {%s}" % (self._id, self._ses._name, self._offset, self._cmd), 60)
+      return truncate("%s [%s] %s {%s}" % (self._id, self._ses._name, self._offset, self._cmd), 60)
+    return truncate("%s [%s] %s(r) {%s}" % (self._id, self._ses._name, self._offset, self._cmd), 60)
 
 class SchedTimeEvent:
   """
@@ -86,28 +86,168 @@ class SchedTimeEvent:
 
 
 
-class Scheduler:
+class _DueEvent(event.Event):
+  """
+  Runs the scheduled events that are due.  The scheduler thread puts
+  one of these in the event queue when the next deadline comes up so
+  the events get executed by the engine.
+  """
+  lane = "timer"
+
+  def __init__(self, scheduler):
+    self._scheduler = scheduler
+
+  def execute(self):
+    self._scheduler.runDue()
+
+
+class Scheduler(manager.Manager):
   """
   Manages scheduled data.
+
+  Events are kept in a heap ordered by their deadline (seconds since
+  the epoch as a float).  The scheduler thread sleeps until the 
+  deadline at the top of the heap, then has the engine run everything 
+  that's due.
+
+  We keep indexes of the heap entries by event id, by tag, and by
+  session so lookups don't have to go through the whole heap.  
+  Removing an event just marks its heap entry as dead (a tombstone)
+  which gets skipped when it comes up.  When more than half the heap 
+  is tombstones, we rebuild it.
   """
   def __init__(self):
-    # mapping of tick time -> SchedEvent list
-    self._events = {}
+    # heap of [deadline, sequence number, SchedEvent, in heap] entries.
+    # the sequence number keeps events with the same deadline in the
+    # order they were added.  the SchedEvent is None for tombstones.
+    # in heap is 0 once runDue has popped the entry to run it.
+    self._heap = []
+    self._seq = 0
+
+    # the number of tombstones in the heap.  entries that get killed
+    # after runDue popped them aren't in the heap, so they don't count.
+    self._dead = 0
 
-    # mapping of seconds since epoch -> SchedEvent list
-    self._tevents = {}
+    # event id -> heap entry
+    self._byid = {}
 
-    # the current Lyntin tick
-    self._current_tick = 0
+    # tag -> dict of event id -> heap entry
+    self._bytag = {}
+
+    # session -> dict of event id -> heap entry
+    self._bysession = {}
+
+    # guards the heap and the indexes and wakes up the scheduler 
+    # thread when the heap changes
+    self._cond = threading.Condition()
+
+    # whether there's a _DueEvent in the event queue we're waiting on
+    self._pending = 0
+
+    self._stopped = 1
 
     # the event id index
     self._eid = 0
 
   def startup(self):
-    exported.hook_register("timer_hook", self.timeUpdate)
+    self._stopped = 0
+    exported.myengine.startthread("scheduler", self._run)
 
   def shutdown(self):
-    exported.hook_unregister("timer_hook", self.timeUpdate)
+    self._cond.acquire()
+    try:
+      self._stopped = 1
+      self._cond.notify()
+    finally:
+      self._cond.release()
+
+  def _run(self):
+    """
+    The scheduler thread.  Sleeps until the next deadline, then puts
+    a _DueEvent in the event queue and waits for it to run.
+    """
+    self._cond.acquire()
+    try:
+      while not self._stopped:
+        heap = self._heap
+        while heap and heap[0][2] == None:
+          heapq.heappop(heap)
+          self._dead -= 1
+
+        if self._pending or not heap:
+          self._cond.wait()
+          continue
+
+        timeout = heap[0][0] - time.time()
+        if timeout > 0:
+          self._cond.wait(timeout)
+          continue
+
+        self._pending = 1
+        _DueEvent(self).enqueue()
+    finally:
+      self._cond.release()
+
+  def _push(self, deadline, sevent):
+    """
+    Adds an event to the heap and the indexes and wakes the scheduler 
+    thread up if it's the next event due.  Only call this when 
+    holding the lock.
+    """
+    entry = [deadline, self._seq, sevent, 1]
+    self._seq += 1
+    heapq.heappush(self._heap, entry)
+
+    self._byid[sevent._id] = entry
+    self._bytag.setdefault(sevent._tag, {})[sevent._id] = entry
+    self._bysession.setdefault(sevent._ses, {})[sevent._id] = entry
+
+    if self._heap[0] is entry:
+      self._cond.notify()
+
+  def _unindex(self, entry):
+    """
+    Takes a heap entry out of the indexes.  Only call this when 
+    holding the lock.
+    """
+    sevent = entry[2]
+    if self._byid.get(sevent._id) is not entry:
+      return
+
+    del self._byid[sevent._id]
+    for index, key in ((self._bytag, sevent._tag), 
+                       (self._bysession, sevent._ses)):
+      entries = index[key]
+      del entries[sevent._id]
+      if not entries:
+        del index[key]
+
+  def _kill(self, entry):
+    """
+    Takes an event out of the schedule by turning its heap entry into
+    a tombstone.  Only call this when holding the lock.
+
+    @return: the repr of the event
+    @rtype:  string
+    """
+    sevent = entry[2]
+    self._unindex(entry)
+    entry[2] = None
+    if entry[3]:
+      self._dead += 1
+    return repr(sevent)
+
+  def _compact(self):
+    """
+    Rebuilds the heap without the tombstones if they've taken over.
+    Only call this when holding the lock.
+    """
+    if self._dead > 16 and self._dead * 2 > len(self._heap):
+      self._heap = [mem for mem in self._heap if mem[2] != None]
+      heapq.heapify(self._heap)
+      # everything left is alive and _dead only counts what's in the
+      # heap
+      self._dead = 0
  
   def getEvents(self, ses):
     """
@@ -119,16 +259,11 @@ class Scheduler:
     @returns: the list of session information
     @rtype: list of strings
     """
-    output = []
-    for listing in self._events.values():
-      for mem in listing:
-        if mem._ses == ses:
-          output.append(repr(mem))
-
-    for listing in self._tevents.values():
-      for mem in listing:
-        if mem._ses == ses:
-          output.append(repr(mem))
+    self._cond.acquire()
+    try:
+      output = [repr(mem[2]) for mem in self._bysession.get(ses, {}).values()]
+    finally:
+      self._cond.release()
 
     output.sort()
     return output
@@ -136,8 +271,9 @@ class Scheduler:
   def getEventById(self, id):
     """
     Finds an event by id or by tag.  It returns the event as well
-    as adding a _next_tick attribute to the event telling you
-    when the event is next scheduled to execute.  Sneaky, eh?
+    as adding a _next_time attribute to the event telling you
+    when (in seconds since the epoch) the event is next scheduled to 
+    execute.  Sneaky, eh?
 
     @param id: the id or tag of the event to find
     @type  id: string
@@ -145,19 +281,17 @@ class Scheduler:
     @returns: the SchedEvent instance or None
     @rtype: SchedEvent
     """
-    for key in self._events.keys():
-      listing = self._events[key]
-      for mem in listing:
-        if mem._id == id or mem._tag == id:
-          mem._next_tick = key
-          return mem
-
-    for key in self._tevents.keys():
-      listing = self._tevents[key]
-      for mem in listing:
-        if mem._id == id or mem._tag == id:
-          mem._next_tick = key
-          return mem
+    self._cond.acquire()
+    try:
+      entry = self._byid.get(id)
+      if entry == None and self._bytag.has_key(id):
+        entry = self._bytag[id].values()[0]
+
+      if entry != None:
+        entry[2]._next_time = entry[0]
+        return entry[2]
+    finally:
+      self._cond.release()
 
     return []
 
@@ -172,17 +306,48 @@ class Scheduler:
     @rtype: list of strings
     """
     output = []
-    for listing in self._events.values():
-      for mem in listing:
-        if id == '*' or mem._id == id or mem._tag == id:
-          output.append(repr(mem))
-          listing.remove(mem)
-
-    for listing in self._tevents.values():
-      for mem in listing:
-        if id == '*' or mem._id == id or mem._tag == id:
-          output.append(repr(mem))
-          listing.remove(mem)
+    self._cond.acquire()
+    try:
+      if id == '*':
+        entries = self._byid.values()
+      else:
+        entries = self._bytag.get(id, {}).values()
+        if self._byid.has_key(id) and self._byid[id] not in entries:
+          entries.append(self._byid[id])
+
+      for mem in entries:
+        output.append(self._kill(mem))
+
+      if output:
+        self._compact()
+        self._cond.notify()
+    finally:
+      self._cond.release()
+
+    output.sort()
+    return output
+
+  def removeSession(self, ses):
+    """
+    Removes all the events for a session that's gone away.
+
+    @param ses: the session
+    @type  ses: Session
+
+    @returns: a list of the events unscheduled
+    @rtype: list of strings
+    """
+    output = []
+    self._cond.acquire()
+    try:
+      for mem in self._bysession.get(ses, {}).values():
+        output.append(self._kill(mem))
+
+      if output:
+        self._compact()
+        self._cond.notify()
+    finally:
+      self._cond.release()
 
     output.sort()
     return output
@@ -191,8 +356,8 @@ class Scheduler:
     """
     Adds an event to the scheduler.
 
-    @param tick: the tick that this event kicks off at
-    @type  tick: int
+    @param tick: when this event kicks off
+    @type  tick: int or float
 
     @param sevent: the SchedEvent object
     @type  sevent: SchedEvent
@@ -201,58 +366,64 @@ class Scheduler:
         epoch) or a regular event (tick is an offset of seconds from now)
     @type  real: int
     """
-    if id == -1:
-      eid = self._eid
-      self._eid += 1
-    else:
-      eid = id
+    self._cond.acquire()
+    try:
+      if id == -1:
+        eid = self._eid
+        self._eid += 1
+      else:
+        eid = id
 
-    sevent._id = str(eid)
+      sevent._id = str(eid)
 
-    if real == 0:
-      eventdict = self._events
-    else:
-      eventdict = self._tevents
+      # an event with the same id replaces the old one
+      if self._byid.has_key(sevent._id):
+        self._kill(self._byid[sevent._id])
 
-    if eventdict.has_key(tick):
-      eventdict[tick].append(sevent)
-    else:
-      eventdict[tick] = [sevent]
+      if real == 0:
+        tick = time.time() + tick
 
-  def timeUpdate(self, args):
+      self._push(tick, sevent)
+    finally:
+      self._cond.release()
+
+  def runDue(self):
     """
-    This gets called by the timer_hook in the engine every
-    second.  It goes through and executes all the events for this
-    Lyntin tick as well as events who are supposed to execute at
-    this seconds since the epoch or before.
+    Executes all the events whose deadlines have passed.  This gets 
+    called in the engine thread by the _DueEvent the scheduler thread
+    enqueues.
 
     It also handles tossing events back in the schedule if they
     need repeating.
     """
-    tick = args["tick"]
-
-    events = []
+    now = time.time()
+    due = []
 
-    if self._events.has_key(tick):
-      for mem in self._events[tick]:
-        events.append(mem)
-
-      del self._events[tick]
-
-    self._current_tick = tick
-
-    # we want to execute for this second and any previous seconds
-    # that have been missed.
-    sec = int(time.time())
-    keys = self._tevents.keys()
-    keys = [mem for mem in keys if mem < sec]
-    for key in keys:
-      for mem in self._tevents[key]:
-        events.append(mem)
-      del self._tevents[key]
+    self._cond.acquire()
+    try:
+      self._pending = 0
+      heap = self._heap
+      while heap and heap[0][0] <= now:
+        entry = heapq.heappop(heap)
+        entry[3] = 0
+        if entry[2] == None:
+          self._dead -= 1
+        else:
+          due.append(entry)
+      self._cond.notify()
+    finally:
+      self._cond.release()
+
+    # go through and execute all the events we've found.  they stay in
+    # the indexes while this happens so that they can be unscheduled 
+    # by the events that run before them (or by themselves if they
+    # repeat).
+    for entry in due:
+      mem = entry[2]
+      if mem == None:
+        # an event that ran before it unscheduled it
+        continue
 
-    # go through and execute all the events we've found
-    for mem in events:
       if not mem._quiet:
         exported.write_message("Executing %r." % mem)
 
@@ -264,9 +435,23 @@ class Scheduler:
         except:
           exported.write_traceback("exception kicked up while trying to execute event.")
 
-      # handles repeating events
-      if mem._repeat == 1:
-        self.addEvent(tick + mem._offset, mem, id=mem._id)
+      self._cond.acquire()
+      try:
+        if entry[2] == None:
+          # it got unscheduled while it ran
+          continue
+
+        self._unindex(entry)
+
+        # handles repeating events.  we go from the deadline rather 
+        # than from now so we don't drift, unless we've fallen behind.
+        if mem._repeat == 1:
+          deadline = entry[0] + mem._offset
+          if deadline <= now:
+            deadline = now + mem._offset
+          self._push(deadline, mem)
+      finally:
+        self._cond.release()
 
 def schedule_cmd(ses, args, input):
   """
@@ -288,8 +473,11 @@ def schedule_cmd(ses, args, input):
 
     #schedule {5} {#showme blah}
 
-  will kick off 5 ticks from now (a tick is approx one second) and
-  will execute "#showme blah".
+  will kick off 5 seconds from now and will execute "#showme blah".
+
+    #schedule {0.25} {#showme blah}
+
+  will kick off a quarter of a second from now.
 
     #schedule {1m30s} {#showme blah}
 
@@ -331,8 +519,7 @@ def schedule_cmd(ses, args, input):
 
   if setimespan != 0:
     sevent = SchedEvent(setimespan, ses, cmd, repeat, quiet)
-    tick = setimespan + myscheduler._current_tick
-    myscheduler.addEvent(tick, sevent)
+    myscheduler.addEvent(setimespan, sevent)
 
   else:
     repeat = 0
@@ -447,7 +634,7 @@ def _addtickevents(ses):
   sevent = SchedEvent(ses._ticker["len"], ses, _tickfunc, repeat=1, 
                       quiet=1, tag=tick_tagname)
   sevent._args = [ses]
-  tick = myscheduler._current_tick + ses._ticker["len"]
+  tick = ses._ticker["len"]
   myscheduler.addEvent(tick, sevent)
 
   # build the tickwarn event, figure out when it should start,
@@ -506,9 +693,8 @@ def tick_cmd(ses, args, input):
     ses._ticker = DEFAULT_TICKER.copy()
 
   if ses._ticker["enabled"] == 1:
-    tick = myscheduler._current_tick
     sevent = myscheduler.getEventById(ses.getName() + "tick")
-    delta = sevent._next_tick - tick
+    delta = int(sevent._next_time - time.time() + 0.5)
 
     exported.write_message("tick: next tick in %d seconds." % delta, ses)
   else:
@@ -645,11 +831,13 @@ def load():
 
   myscheduler = Scheduler()
   myscheduler.startup()
+  exported.add_manager("scheduler", myscheduler)
   modutils.load_commands(commands_dict)
 
 def unload():
   global myscheduler
 
   myscheduler.shutdown()
+  exported.remove_manager("scheduler")
   myscheduler = None
   modutils.unload_commands(commands_dict)
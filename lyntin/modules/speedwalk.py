@@ -377,6 +377,24 @@ class SpeedwalkManager(manager.Manager):
 
     return data
 
+  def isSpeedwalk(self, ses, text):
+    """
+    Returns whether the text is a speedwalk we'd expand in this
+    session.
+
+    @return: 1 if it is, 0 if not
+    @rtype:  boolean
+    """
+    if not self._hashes.has_key(ses) or exported.get_config("speedwalk", ses) == 0:
+      return 0
+
+    sdata = self._hashes[ses]
+
+    if not sdata._dirs or not sdata._regexp or text in sdata._excludes \
+        or text in sdata._aliases or not sdata._regexp.match(text):
+      return 0
+    return 1
+
   def userfilter(self, args):
     """
     user_filter_hook function to check for speedwalking expansion.
@@ -386,14 +404,10 @@ class SpeedwalkManager(manager.Manager):
     verbatim = args["verbatim"]
     text = args["dataadj"]
     
-    if not self._hashes.has_key(ses) or exported.get_config("speedwalk", ses) == 0 or verbatim == 1:
+    if verbatim == 1 or not self.isSpeedwalk(ses, text):
       return text
 
     sdata = self._hashes[ses]
-
-    if not sdata._dirs or not sdata._regexp or text in sdata._excludes \
-        or text in sdata._aliases or not sdata._regexp.match(text):
-      return text
     
     swdirs = []
     dir = num = ""
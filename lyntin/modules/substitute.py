@@ -316,7 +316,7 @@ class SubstituteManager(manager.Manager):
     ses = args["session"]
     text = args["dataadj"]
 
-    if exported.get_config("ignoresubs", ses, 0) == 0:
+    if getattr(exported.get_config_snapshot(ses), "ignoresubs", 0) == 0:
       text = self.expand(ses, text)
     return text
 
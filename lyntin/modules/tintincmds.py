@@ -20,7 +20,7 @@
 #########################################################################
 
 import io
-import os, os.path
+import os, os.path, types
 from lyntin import net, utils, engine, constants, config, exported, event
 from lyntin.modules import modutils
 
@@ -152,6 +152,12 @@ def history_cmd(ses, args, input):
     !4 3k=gk
         executes the fourth to last thing you did after replacing
         3k with gk in it
+    !say
+        executes the last thing you did that started with "say"
+
+  The historysize config item sets how much history we keep.  Turn
+  on the savehistory config item to keep the history in a file 
+  between runs.
 
   category: commands
   """
@@ -195,7 +201,7 @@ def if_cmd(ses, args, input):
   elseaction = args["elseaction"]
 
   try:
-    if eval(expr):
+    if utils.eval_expression(expr, globals()):
       exported.lyntin_command(action, 1, ses)
     elif elseaction:
       exported.lyntin_command(elseaction, 1, ses)
@@ -329,7 +335,7 @@ def math_cmd(ses, args, input):
   quiet = args["quiet"]
 
   try:
-    rvalue = eval(ops)
+    rvalue = utils.eval_expression(ops, globals())
     varman = exported.get_manager("variable")
     if varman:
       varman.addVariable(ses,var, str(rvalue))
@@ -338,7 +344,7 @@ def math_cmd(ses, args, input):
   except Exception, e:
     exported.write_error("math: exception: %s\n%s" % (ops, e), ses)
 
-commands_dict["math"] = (math_cmd, "var operation quiet:boolean=false")
+commands_dict["math"] = (math_cmd, "var operation quiet:boolean=false", "cache=64")
 
 
 def nop_cmd(ses, args, input):
@@ -379,6 +385,12 @@ def read_cmd(ses, args, input):
   If you don't specify a directory, Lyntin will look for the file
   in your datadir.
 
+  Lyntin saves a parsed version of the file in the readcache 
+  directory of your datadir so that reading it again is faster.
+  Commands that use variables, aliases, or other things that have 
+  to be worked out at the time they're run are always run the 
+  regular way.  Use cache=false to skip this.
+
   category: commands
   """
   filename = args["filename"]
@@ -412,6 +424,7 @@ def read_cmd(ses, args, input):
   if not contents[0].startswith(c):
     exported.lyntin_command("%sconfig commandchar %s" % (c, contents[0][0]), internal=1, session=ses)
 
+  commands = []
   command = ""
   continued = 0
   # FIXME - should this be a config setting?
@@ -429,12 +442,105 @@ def read_cmd(ses, args, input):
 
     command = command + mem
     if not continued:
-      exported.lyntin_command(command, internal=1, session=ses)
+      commands.append(command)
       command = ""
 
+  if filename.startswith("http://") or not args["cache"]:
+    for mem in commands:
+      exported.lyntin_command(mem, internal=1, session=ses)
+  else:
+    _read_compiled(ses, filename, "".join(contents), commands)
+
   exported.write_message("read: file %s read." % filename, ses)
 
-commands_dict["read"] = (read_cmd, "filename")
+commands_dict["read"] = (read_cmd, "filename cache:boolean=true")
+
+# bump this when the format of the compiled entries changes
+READ_CACHE_VERSION = 2
+
+def _read_compiled(ses, filename, text, commands):
+  """
+  Runs the commands from a #read file using the compiled version of
+  the file that's stored in the readcache directory of the datadir
+  if it's up to date.  If it's not, we compile the commands as we run
+  them and write out a new one.
+
+  @param ses: the session to run the commands in
+  @type  ses: session.Session
+
+  @param filename: the name of the file we read
+  @type  filename: string
+
+  @param text: the contents of the file
+  @type  text: string
+
+  @param commands: the commands in the file
+  @type  commands: list of strings
+  """
+  import marshal, hashlib
+  cm = exported.get_manager("command")
+
+  # the directory the file is in might not be ours to write to, so
+  # the cache goes in the datadir.  the hash of the full path keeps 
+  # files with the same name apart.
+  fullname = os.path.abspath(filename)
+  if isinstance(fullname, unicode):
+    fullname = fullname.encode("utf-8")
+  cachedir = config.options["datadir"] + "readcache"
+  cachefile = os.path.join(cachedir, "%s.%s.lyc" % (os.path.basename(filename),
+                           hashlib.md5(fullname).hexdigest()[:12]))
+
+  try:
+    mtime = os.path.getmtime(filename)
+  except OSError:
+    mtime = None
+  digest = hashlib.md5(text.encode("utf-8")).hexdigest()
+
+  # the cache is marshalled rather than pickled--loading a pickle can
+  # run code and the compiled entries are plain data anyhow
+  compiled = None
+  try:
+    f = open(cachefile, "rb")
+    try:
+      data = marshal.load(f)
+    finally:
+      f.close()
+  except (IOError, OSError, EOFError, ValueError, TypeError):
+    data = None
+
+  if type(data) == types.DictType and \
+      data.get("version") == READ_CACHE_VERSION and \
+      data.get("mtime") == mtime and data.get("digest") == digest and \
+      type(data.get("entries")) == types.ListType and \
+      len(data["entries"]) == len(commands):
+    compiled = data["entries"]
+
+  if compiled != None:
+    for i in range(len(commands)):
+      if compiled[i] == None or not cm.runCompiledCommand(ses, compiled[i]):
+        exported.lyntin_command(commands[i], internal=1, session=ses)
+    return
+
+  # compile each command right before we run it so that it sees
+  # whatever the commands before it did
+  compiled = []
+  for mem in commands:
+    entry = cm.compileCommand(ses, mem)
+    compiled.append(entry)
+    if entry == None or not cm.runCompiledCommand(ses, entry):
+      exported.lyntin_command(mem, internal=1, session=ses)
+
+  try:
+    if not os.path.isdir(cachedir):
+      os.makedirs(cachedir)
+    f = open(cachefile, "wb")
+    try:
+      marshal.dump({"version": READ_CACHE_VERSION, "mtime": mtime, 
+                    "digest": digest, "entries": compiled}, f, 2)
+    finally:
+      f.close()
+  except (IOError, OSError, ValueError):
+    pass
 
 
 def session_cmd(ses, args, input):
@@ -556,7 +662,7 @@ def showme_cmd(ses, args, input):
 
   exported.write_message(input, ses)
      
-commands_dict["showme"] = (showme_cmd, "input=", "limitparsing=0")
+commands_dict["showme"] = (showme_cmd, "input=", "limitparsing=0 cache=64")
 
 def wshowme_cmd(ses, args, input):
   """
@@ -269,7 +269,7 @@ def variable_cmd(ses, args, input):
   except Exception, e:
     exported.write_error("variable: cannot be set. %s" % e, ses)
 
-commands_dict["variable"] = (variable_cmd, "var= expansion= quiet:boolean=false")
+commands_dict["variable"] = (variable_cmd, "var= expansion= quiet:boolean=false", "cache=64")
 
 
 def unvariable_cmd(ses, args, input):
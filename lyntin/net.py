@@ -365,6 +365,38 @@ class SocketCommunicator:
 
     return data
 
+  def handleRead(self, data, newdata):
+    """
+    Filters data we just read from the mud, splits it into lines and
+    prompts and handles each of them.  This is what run does with 
+    each read--it's separate so data can be replayed through it 
+    without a socket.
+
+    @param data: the incomplete line left over from the last read
+    @type  data: string
+
+    @param newdata: the data we just read
+    @type  newdata: string
+
+    @return: the incomplete line left over from this read (empty if
+        the data ended with a delimiter)
+    @rtype:  string
+    """
+    newdata = self._filterIncomingData(newdata)
+    if newdata == "":
+      return data
+
+    last_index = 0
+    alldata = (data+newdata).replace("\r","")
+    # incrementally walk through each line in the data,
+    # adjusting last_index to the end of the previous match
+    for (m) in self._line_regex.finditer(alldata):
+      oneline = alldata[last_index:m.end()]
+      last_index = m.end()
+      self.handleData(oneline)
+    # keep the remainder (empty if alldata ended with a delimiter)
+    return alldata[last_index:]
+
   def run(self):
     """
     While the connection hasn't been shut down, we spin through this
@@ -377,20 +409,7 @@ class SocketCommunicator:
         newdata = self._pollForData()
 
         if newdata:
-          newdata = self._filterIncomingData(newdata)
-          if newdata == "":
-            continue
-
-          last_index = 0
-          alldata = (data+newdata).replace("\r","")
-          # incrementally walk through each line in the data,
-          # adjusting last_index to the end of the previous match
-          for (m) in self._line_regex.finditer(alldata):
-            oneline = alldata[last_index:m.end()]
-            last_index = m.end()
-            self.handleData(oneline)
-          # keep the remainder (empty if alldata ended with a delimiter)
-          data = alldata[last_index:]
+          data = self.handleRead(data, newdata)
 
         elif newdata == '':
           # if we got back an empty string, then something's amiss
@@ -492,7 +511,8 @@ class SocketCommunicator:
     # handle the bell
     count = data.count(BELL)
     for i in range(count):
-      event.SpamEvent(hookname="bell_hook", argmap={"session": self._session}).enqueue()
+      event.SpamEvent(hookname="bell_hook", argmap={"session": self._session}, 
+                      lane="mud").enqueue()
     data = data.replace(BELL, "")
 
     # handle telnet option stuff
@@ -500,10 +520,11 @@ class SocketCommunicator:
       data = self.handleNego(data)
 
     data = data.decode(config.options['serverencoding'])
-    if not self._config.get("promptdetection") or data.endswith("\n"):
+    if not self._config.getSnapshot().promptdetection or data.endswith("\n"):
       event.MudEvent(self._session, data).enqueue() 
     else:
-      event.SpamEvent(hookname="prompt_hook", argmap={"session": self._session, "prompt": data}).enqueue()
+      event.SpamEvent(hookname="prompt_hook", argmap={"session": self._session, "prompt": data},
+                      lane="mud").enqueue()
 
 
   def handleNego(self, data):
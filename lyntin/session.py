@@ -104,11 +104,774 @@ X{mud_filter_hook}::
 
    dataadj - the latest adjusted data from the mud
 """
-import re, copy, string, os
+import re, copy, string, os, types, mmap, struct, bisect
+from array import array
+from collections import deque
 from lyntin import exported, utils, ansi, config, event
 
 ESC = chr(27)
 
+# finds bytes that might not be utf-8 in lines we're packing
+_nonascii = re.compile("[\x80-\xff]")
+
+class ScrollbackArchive:
+  """
+  An append-only file of every line of scrollback for a session so
+  #grep and post-mortems can reach back further than the DataBuffer
+  keeps in memory.
+
+  There are two files.  The data file is the lines encoded as utf-8
+  one after another.  The index file has the offset in the data file
+  where each line ends as 8 byte little-endian unsigned ints, so we
+  can find line i without reading the lines before it.  Both get read
+  back through mmap so the operating system pages in what we look 
+  at and nothing else.
+
+  Lines get buffered and written out when flush is called.  The data
+  gets written before the index, so if we die in the middle, the
+  index never points past the data.  When we open an existing 
+  archive, we cut off whatever the index doesn't cover.
+  """
+  INDEXFORMAT = "<Q"
+  INDEXSIZE = struct.calcsize(INDEXFORMAT)
+
+  def __init__(self, filename):
+    """
+    Opens the archive, creating it if it doesn't exist.
+
+    @param filename: the data file--the index file is this with 
+        ".idx" tacked on
+    @type  filename: string
+
+    @raises IOError: if the files can't be opened
+    """
+    self._filename = filename
+    self._datafile = open(filename, "a+b")
+    self._indexfile = open(filename + ".idx", "a+b")
+
+    self._pending = []
+    self._pendingends = []
+    self._datamap = None
+    self._indexmap = None
+    self._mapped = 0
+
+    self._recover()
+
+  def _recover(self):
+    """
+    Figures out how many lines there are and cleans up after a write
+    that didn't finish.
+    """
+    indexsize = os.path.getsize(self._filename + ".idx")
+    count = indexsize // self.INDEXSIZE
+    datasize = os.path.getsize(self._filename)
+
+    end = 0
+    while count > 0:
+      self._indexfile.seek((count - 1) * self.INDEXSIZE)
+      end = struct.unpack(self.INDEXFORMAT, 
+                          self._indexfile.read(self.INDEXSIZE))[0]
+      if end <= datasize:
+        break
+      count -= 1
+      end = 0
+
+    if count * self.INDEXSIZE != indexsize:
+      self._indexfile.truncate(count * self.INDEXSIZE)
+    if end != datasize:
+      self._datafile.truncate(end)
+
+    self._count = count
+    self._written = count
+    self._end = end
+
+  def getFilename(self):
+    """
+    @return: the name of the data file
+    @rtype:  string
+    """
+    return self._filename
+
+  def append(self, line):
+    """
+    Adds a line.  It doesn't get written until the next flush.
+
+    @param line: the line
+    @type  line: unicode
+    """
+    data = line.encode("utf-8")
+    self._end += len(data)
+    self._pending.append(data)
+    self._pendingends.append(self._end)
+    self._count += 1
+
+  def flush(self):
+    """
+    Writes out the lines we've buffered.
+    """
+    if not self._pending:
+      return
+    self._datafile.write("".join(self._pending))
+    self._datafile.flush()
+    self._indexfile.write(struct.pack("<%dQ" % len(self._pendingends), 
+                                      *self._pendingends))
+    self._indexfile.flush()
+    self._written = self._count
+    self._pending = []
+    self._pendingends = []
+
+  def _map(self):
+    """
+    Maps the files again to pick up everything we've written.
+    """
+    self.flush()
+    self._unmap()
+    if self._written > 0:
+      self._datamap = mmap.mmap(self._datafile.fileno(), 0, 
+                                access=mmap.ACCESS_READ)
+      self._indexmap = mmap.mmap(self._indexfile.fileno(), 0, 
+                                 access=mmap.ACCESS_READ)
+    self._mapped = self._written
+
+  def _unmap(self):
+    if self._datamap != None:
+      self._datamap.close()
+      self._indexmap.close()
+    self._datamap = None
+    self._indexmap = None
+    self._mapped = 0
+
+  def __len__(self):
+    return self._count
+
+  def getLine(self, index):
+    """
+    Returns a line.
+
+    @param index: the line number (0 is the first line)
+    @type  index: int
+
+    @return: the line
+    @rtype:  unicode
+
+    @raises IndexError: if there's no such line
+    """
+    if index < 0 or index >= self._count:
+      raise IndexError("ScrollbackArchive index out of range")
+
+    if index >= self._written:
+      return self._pending[index - self._written].decode("utf-8", "replace")
+
+    if index >= self._mapped:
+      self._map()
+
+    if index == 0:
+      start = 0
+    else:
+      start = struct.unpack_from(self.INDEXFORMAT, self._indexmap, 
+                                 (index - 1) * self.INDEXSIZE)[0]
+    end = struct.unpack_from(self.INDEXFORMAT, self._indexmap, 
+                             index * self.INDEXSIZE)[0]
+    return self._datamap[start:end].decode("utf-8", "replace")
+
+  def close(self):
+    """
+    Writes out anything that's buffered and closes the files.
+    """
+    self.flush()
+    self._unmap()
+    self._datafile.close()
+    self._indexfile.close()
+
+
+class DataBuffer:
+  """
+  Holds the last so many lines of mud data for a session (the
+  scrollback).  It acts like a read-only list of lines--len, indexing,
+  slicing and iterating all work--so #grep and friends can treat it 
+  like one.
+
+  Lines come in one at a time, but get packed into blocks of 
+  BLOCKLINES lines each.  A block is the lines encoded as one utf-8
+  string along with the offset where each line ends.  That's a lot
+  smaller than a unicode object per line.  Lines that haven't been
+  packed yet are kept as the utf-8 strings they came in as, so adding
+  a line doesn't decode it.  Lines and blocks get decoded when 
+  someone looks at them and we keep the last couple of decoded blocks
+  around so walking through the buffer doesn't decode the same block
+  over and over.
+
+  The packed blocks are in a deque and _start is how many lines of
+  the first block have fallen off the front, so dropping old lines
+  is O(1).
+
+  If there's a ScrollbackArchive attached, every line goes into it
+  when it's finished.  The lines in memory are then the tail end of
+  the archive and the buffer acts like a list of everything in the
+  archive plus the line that isn't finished yet.  Lines that aren't
+  in memory any more come from the archive.
+
+  Searching the buffer goes through a GrepIndex over the finished
+  lines in memory.  It gets built the first time someone searches
+  and brought up to date with the lines that came in since every
+  time after that, so adding lines doesn't cost anything extra.
+  """
+  BLOCKLINES = 64
+  DECODECACHE = 2
+
+  def __init__(self, size=10000):
+    """
+    @param size: the most lines to keep in memory
+    @type  size: int
+    """
+    self._size = max(1, size)
+    self._archive = None
+
+    # how many lines have been finished since we were created--the 
+    # GrepIndex numbers lines with this
+    self._total = 0
+    self.clear()
+
+  def clear(self):
+    """
+    Removes all the lines from memory.  The archive (if there is one)
+    keeps them.
+    """
+    # packed blocks: (utf-8 data, array of the byte offset where each
+    # line ends)
+    self._blocks = deque()
+
+    # the lines that haven't been packed yet as utf-8 strings.  the
+    # last one might not be finished.
+    self._open = []
+    self._start = 0
+    self._decoded = []
+
+    # how many of the finished lines in memory haven't been archived
+    self._unarchived = 0
+
+    # built the first time we're searched
+    self._grepindex = None
+
+  def resize(self, size):
+    """
+    Changes the most lines we keep in memory, dropping old lines if
+    we've got too many.
+
+    @param size: the most lines to keep
+    @type  size: int
+    """
+    self._size = max(1, size)
+    self._trim()
+    if self._grepindex != None:
+      self._grepindex.resize(self._size)
+
+  def getSize(self):
+    """
+    @return: the most lines we keep in memory
+    @rtype:  int
+    """
+    return self._size
+
+  def attachArchive(self, archive):
+    """
+    Starts sending lines to an archive.  The finished lines we've got
+    in memory that haven't been archived yet go into it first.
+
+    @param archive: the archive
+    @type  archive: ScrollbackArchive
+    """
+    self.detachArchive()
+    if self._unarchived > 0:
+      lines = [mem for mem in self._iterMemory() if mem[-1:] == u"\n"]
+      for mem in lines[-self._unarchived:]:
+        archive.append(mem)
+      archive.flush()
+      self._unarchived = 0
+    self._archive = archive
+
+  def detachArchive(self):
+    """
+    Stops sending lines to the archive and closes it.
+    """
+    if self._archive != None:
+      self._archive.close()
+      self._archive = None
+
+  def getArchive(self):
+    """
+    @return: the archive or None if there isn't one
+    @rtype:  ScrollbackArchive
+    """
+    return self._archive
+
+  def flush(self):
+    """
+    Writes out anything the archive has buffered.
+    """
+    if self._archive != None:
+      self._archive.flush()
+
+  def addText(self, text):
+    """
+    Adds text to the buffer.  If the last line we have isn't 
+    finished, the text gets tacked onto it.
+
+    @param text: the text to add
+    @type  text: string
+    """
+    if type(text) == types.UnicodeType:
+      text = text.encode("utf-8")
+
+    openlines = self._open
+    archive = self._archive
+    for mem in text.splitlines(1):
+      if openlines and openlines[-1][-1:] != "\n":
+        openlines[-1] += mem
+      else:
+        if len(openlines) >= self.BLOCKLINES:
+          self._pack()
+          openlines = self._open
+        openlines.append(mem)
+
+      if mem[-1:] == "\n":
+        self._total += 1
+        if archive != None:
+          archive.append(openlines[-1].decode("utf-8", "replace"))
+        else:
+          self._unarchived += 1
+
+    # this is _trim, but once we're full it happens for every line, so
+    # we only go through the blocks when one has fallen off
+    extra = (len(self._blocks) * self.BLOCKLINES + len(openlines) - 
+             self._start - self._size)
+    if extra > 0:
+      self._start += extra
+      if self._start >= self.BLOCKLINES or not self._blocks:
+        self._dropLines()
+
+  def _pack(self):
+    """
+    Packs the open lines into a block.
+    """
+    encoded = self._open
+    data = "".join(encoded)
+    if _nonascii.search(data):
+      # clean up anything that isn't utf-8 so the block decodes.  we
+      # do this a line at a time rather than decoding the whole block
+      # at once--a big temporary unicode string between the long lived
+      # blocks fragments the heap badly.
+      encoded = [mem.decode("utf-8", "replace").encode("utf-8") 
+                 for mem in encoded]
+      data = "".join(encoded)
+    ends = array("I")
+    end = 0
+    for mem in encoded:
+      end += len(mem)
+      ends.append(end)
+    self._blocks.append((data, ends))
+    self._open = []
+
+    if self._archive != None:
+      self._archive.flush()
+
+  def _memlen(self):
+    """
+    Returns the number of lines in memory.
+    """
+    return len(self._blocks) * self.BLOCKLINES + len(self._open) - self._start
+
+  def _trim(self):
+    """
+    Drops lines off the front until we're down to size.
+    """
+    extra = self._memlen() - self._size
+    if extra > 0:
+      self._start += extra
+      self._dropLines()
+
+  def _dropLines(self):
+    """
+    Gets rid of the lines _start says have fallen off the front.
+    """
+    while self._blocks and self._start >= self.BLOCKLINES:
+      block = self._blocks.popleft()
+      self._start -= self.BLOCKLINES
+      for i in range(len(self._decoded)):
+        if self._decoded[i][0] is block:
+          del self._decoded[i]
+          break
+
+    if not self._blocks and self._start > 0:
+      # this only happens when we're smaller than a block
+      del self._open[:self._start]
+      self._start = 0
+
+  def _decode(self, block):
+    """
+    Returns the lines in a packed block.
+    """
+    for mem in self._decoded:
+      if mem[0] is block:
+        return mem[1]
+
+    data, ends = block
+    lines = []
+    start = 0
+    for end in ends:
+      lines.append(data[start:end].decode("utf-8"))
+      start = end
+
+    self._decoded.append((block, lines))
+    if len(self._decoded) > self.DECODECACHE:
+      del self._decoded[0]
+    return lines
+
+  def __len__(self):
+    if self._archive != None:
+      if self._open and self._open[-1][-1:] != "\n":
+        return len(self._archive) + 1
+      return len(self._archive)
+    return self._memlen()
+
+  def __getitem__(self, index):
+    if type(index) == types.SliceType:
+      return [self[i] for i in range(*index.indices(len(self)))]
+
+    length = len(self)
+    if index < 0:
+      index += length
+    if index < 0 or index >= length:
+      raise IndexError("DataBuffer index out of range")
+
+    if self._archive != None:
+      # the lines in memory are the last ones
+      first = length - self._memlen()
+      if index < first:
+        return self._archive.getLine(index)
+      index -= first
+
+    index += self._start
+    blocknum = index // self.BLOCKLINES
+    if blocknum < len(self._blocks):
+      return self._decode(self._blocks[blocknum])[index % self.BLOCKLINES]
+    mem = self._open[index - len(self._blocks) * self.BLOCKLINES]
+    return mem.decode("utf-8", "replace")
+
+  def __iter__(self):
+    if self._archive != None:
+      archive = self._archive
+      for i in xrange(len(self) - self._memlen()):
+        yield archive.getLine(i)
+    for mem in self._iterMemory():
+      yield mem
+
+  def _iterMemory(self):
+    start = self._start
+    for block in list(self._blocks):
+      for mem in self._decode(block)[start:]:
+        yield mem
+      start = 0
+    for mem in self._open[start:]:
+      yield mem.decode("utf-8", "replace")
+
+  def getGrepIndex(self):
+    """
+    @return: the GrepIndex or None if we haven't been searched yet
+    @rtype:  GrepIndex
+    """
+    return self._grepindex
+
+  def _updateGrepIndex(self):
+    """
+    Builds the GrepIndex if we don't have one and adds the finished
+    lines in memory it doesn't have yet.  Lines that fell off the 
+    front before it got to them are skipped.
+
+    @return: the index
+    @rtype:  GrepIndex
+    """
+    if self._grepindex == None:
+      self._grepindex = GrepIndex(self._size)
+    index = self._grepindex
+
+    first, next = index.getRange()
+    if next < self._total:
+      finished = self._finished()
+      inmemory = self._memlen() - (len(self) - finished)
+      start = max(next, self._total - inmemory)
+      offset = self._total - finished
+      index.addLines(start, self[start - offset:finished])
+    return index
+
+  def search(self, regexp, start=0):
+    """
+    Finds the lines from start on that a regular expression matches.
+    Lines the GrepIndex covers get narrowed down with the index first,
+    older lines (which are in the archive) get searched one by one.
+
+    @param regexp: the compiled regular expression
+    @type  regexp: Re
+
+    @param start: the index of the first line to look at
+    @type  start: int
+
+    @return: (index, line) for each matching line, oldest first
+    @rtype:  generator
+    """
+    length = len(self)
+    start = max(0, start)
+    finished = self._finished()
+
+    # line number - offset = index into the buffer
+    index = self._updateGrepIndex()
+    offset = self._total - finished
+    first, next = index.getRange()
+    indexed = max(first - offset, start)
+
+    for i in xrange(start, min(indexed, finished)):
+      mem = self[i]
+      if regexp.search(mem):
+        yield i, mem
+
+    if indexed < finished:
+      for num in index.search(regexp, indexed + offset, self._getNumbered):
+        yield num - offset, self[num - offset]
+
+    if finished < length and start <= finished:
+      mem = self[finished]
+      if regexp.search(mem):
+        yield finished, mem
+
+  def _finished(self):
+    """
+    Returns the number of finished lines.
+    """
+    if self._open and self._open[-1][-1:] != "\n":
+      return len(self) - 1
+    return len(self)
+
+  def _getNumbered(self, num):
+    """
+    Returns a finished line by its GrepIndex line number.
+    """
+    return self[num - self._total + self._finished()]
+
+  def getMemoryUsage(self):
+    """
+    Returns roughly how many bytes of text we're holding on to.  This
+    doesn't count Python object overhead.
+
+    @return: the number of bytes
+    @rtype:  int
+    """
+    total = 0
+    for data, ends in self._blocks:
+      total += len(data) + ends.itemsize * len(ends)
+    for mem in self._open:
+      total += len(mem)
+    return total
+
+
+class GrepIndex:
+  """
+  A trigram index over the last so many finished lines of a DataBuffer
+  so searches don't have to run the regular expression on every line.
+  For every three character string that shows up in a line, we keep
+  an array of the numbers of the lines it shows up in.  Text a 
+  regular expression has to match (see utils.get_required_literals)
+  can only be in lines that have every one of its trigrams, so we 
+  intersect those arrays and run the regular expression on what's 
+  left.
+
+  Lines get added in batches right before a search rather than as
+  they come in.  Line numbers count every line the DataBuffer has 
+  finished, so they don't change when old lines fall off the front.
+  The numbers of lines we don't cover any more stay in the arrays 
+  until there are as many of them as lines we cover, then they get 
+  cleaned out all at once.
+
+  We also remember the last search, so doing the same search again
+  only looks at the lines that came in since.
+  """
+  GRAMSIZE = 3
+
+  def __init__(self, size):
+    """
+    @param size: the most lines to cover
+    @type  size: int
+    """
+    self._size = max(1, size)
+    self._grams = {}
+    self._first = 0
+    self._next = 0
+    self._cleaned = 0
+
+    # ((pattern, flags), first line number, next line number, matching
+    # line numbers) for the last search
+    self._lastsearch = None
+
+  def addLines(self, start, lines):
+    """
+    Adds lines.  If start is past the next line number we expected,
+    the lines in between are gone and we skip them.
+
+    @param start: the line number of the first line
+    @type  start: int
+
+    @param lines: the lines
+    @type  lines: list of unicode
+    """
+    # only the last size lines would end up covered anyhow
+    skip = max(0, len(lines) - self._size)
+    start += skip
+    num = max(start, self._next)
+    if num > self._next:
+      self._first = num
+
+    grams = self._grams
+    n = self.GRAMSIZE
+    for line in lines[skip + num - start:]:
+      for mem in set([line[i:i+n] for i in xrange(len(line) - n + 1)]):
+        posting = grams.get(mem)
+        if posting == None:
+          posting = grams[mem] = array("I")
+        posting.append(num)
+      num += 1
+
+    self._next = num
+    if self._next - self._first > self._size:
+      self._first = self._next - self._size
+      if self._first - self._cleaned >= self._size:
+        self._clean()
+
+  def resize(self, size):
+    """
+    Changes the most lines we cover.
+
+    @param size: the most lines to cover
+    @type  size: int
+    """
+    self._size = max(1, size)
+    self._first = max(self._first, self._next - self._size)
+
+  def _clean(self):
+    """
+    Drops the numbers of lines we don't cover any more.
+    """
+    first = self._first
+    grams = self._grams
+    for mem, posting in grams.items():
+      if posting[0] >= first:
+        continue
+      i = bisect.bisect_left(posting, first)
+      if i == len(posting):
+        del grams[mem]
+      else:
+        grams[mem] = posting[i:]
+    self._cleaned = first
+
+  def getRange(self):
+    """
+    @return: the first line number we cover and the line number the
+        next line will get
+    @rtype:  tuple of (int, int)
+    """
+    return (self._first, self._next)
+
+  def getCandidates(self, literals, start):
+    """
+    Returns the numbers of the lines from start on that have every
+    trigram in the literals.
+
+    @param literals: the text the lines have to have
+    @type  literals: list of unicode
+
+    @param start: the first line number to look at
+    @type  start: int
+
+    @return: the line numbers in order or None if the literals are 
+        too short to narrow anything down
+    @rtype:  list of ints
+    """
+    n = self.GRAMSIZE
+    wanted = {}
+    for mem in literals:
+      for i in xrange(len(mem) - n + 1):
+        wanted[mem[i:i+n]] = 1
+    if not wanted:
+      return None
+
+    postings = []
+    for mem in wanted.keys():
+      posting = self._grams.get(mem)
+      if posting == None:
+        return []
+      postings.append((len(posting), posting))
+    postings.sort()
+
+    # start with the rarest trigram and narrow it down with the rest
+    posting = postings[0][1]
+    candidates = posting[bisect.bisect_left(posting, start):].tolist()
+    for size, posting in postings[1:]:
+      if not candidates:
+        break
+      low = bisect.bisect_left(posting, candidates[0])
+      high = bisect.bisect_right(posting, candidates[-1])
+      present = set(posting[low:high])
+      candidates = [mem for mem in candidates if mem in present]
+    return candidates
+
+  def search(self, regexp, start, getline):
+    """
+    Finds the lines from start on that a regular expression matches.
+
+    @param regexp: the compiled regular expression
+    @type  regexp: Re
+
+    @param start: the first line number to look at
+    @type  start: int
+
+    @param getline: function that takes a line number and returns
+        the line
+    @type  getline: function
+
+    @return: the matching line numbers in order
+    @rtype:  list of ints
+    """
+    start = max(start, self._first)
+    matches = []
+    searchfrom = start
+
+    key = (regexp.pattern, regexp.flags)
+    last = self._lastsearch
+    if last != None and last[0] == key and last[1] <= start <= last[2]:
+      matches = [mem for mem in last[3] if mem >= start]
+      searchfrom = last[2]
+
+    candidates = self.getCandidates(utils.get_required_literals(regexp), 
+                                    searchfrom)
+    if candidates == None:
+      candidates = xrange(searchfrom, self._next)
+
+    for mem in candidates:
+      if regexp.search(getline(mem)):
+        matches.append(mem)
+
+    self._lastsearch = (key, start, self._next, matches)
+    return matches
+
+  def getStats(self):
+    """
+    @return: (lines covered, distinct trigrams, line numbers stored)
+    @rtype:  tuple of (int, int, int)
+    """
+    stored = 0
+    for mem in self._grams.values():
+      stored += len(mem)
+    return (self._next - self._first, len(self._grams), stored)
+
+
 class Session:
   """
   A session is a nice container of all the stuff that encompasses a 
@@ -130,8 +893,7 @@ class Session:
     self._port = 0
     self._colorbuffer = ''
 
-    self._databuffer = []
-    self._databuffersize = 10000
+    self._databuffer = DataBuffer(10000)
 
     # register with the shutdown hook 
     self._engine.hookRegister("shutdown_hook", self.shutdown)
@@ -159,6 +921,14 @@ class Session:
           "straight to the mud without massaging it.")
     c.add("verbatim", tc, self)
 
+    tc = config.BoolConfig("scrollbackarchive", 0, 1,
+          "Whether or not to keep every line of mud data for this session "
+          "in an archive file in the scrollback directory of your datadir.  "
+          "#grep can then search back further than the lines we keep in "
+          "memory.  Turn it on in the common session to have it on for "
+          "new sessions.")
+    c.add("scrollbackarchive", tc, self)
+
   def getName(self):
     """
     Returns the name of the session.
@@ -201,6 +971,8 @@ class Session:
       if self._socket:
         self._socket.shutdown()
 
+      self._databuffer.flush()
+
       self._host = None
       self._port = 0
       self._socket = None
@@ -218,6 +990,16 @@ class Session:
     data.append("Session name: %s" % self._name)
     data.append("   socket: %s" % repr(self._socket))
 
+    archive = self._databuffer.getArchive()
+    if archive != None:
+      data.append("   scrollback archive: %s (%d lines)" % 
+                  (archive.getFilename(), len(archive)))
+
+    grepindex = self._databuffer.getGrepIndex()
+    if grepindex != None:
+      data.append("   grep index: %d lines, %d trigrams, %d entries" % 
+                  grepindex.getStats())
+
     return data
 
   def clear(self):
@@ -229,7 +1011,7 @@ class Session:
     for mem in self._engine._managers.values():
       mem.clear(self)
 
-    self._databuffer = []
+    self._databuffer.clear()
 
 
   ### ------------------------------------------------
@@ -295,10 +1077,11 @@ class Session:
   ### ------------------------------------------------
   def getDataBuffer(self):
     """
-    Returns the DataBuffer instance for this session.
+    Returns the DataBuffer instance for this session.  It acts like
+    a list of lines.
 
-    @returns: list of strings
-    @rtype: list of strings
+    @returns: the data buffer
+    @rtype: DataBuffer
     """
     return self._databuffer
 
@@ -310,23 +1093,39 @@ class Session:
     @param text: the text to add to the buffer
     @type  text: string
     """
-    text = ansi.filter_ansi(utils.filter_cm(text))
-    lines = text.splitlines(1)
+    self._databuffer.addText(ansi.filter_ansi(utils.filter_cm(text)))
 
-    for mem in lines:
-      if len(self._databuffer) == 0 or self._databuffer[-1].endswith("\n"):
-        self._databuffer.append(mem)
-      else:
-        self._databuffer[-1] += mem
+  def setScrollbackArchive(self, on):
+    """
+    Starts or stops archiving this session's scrollback to
+    datadir/scrollback/<session name>.  The common session doesn't
+    get an archive.
+
+    @param on: whether (1) or not (0) to archive
+    @type  on: boolean
+    """
+    if not on:
+      self._databuffer.detachArchive()
+      return
 
-    if len(self._databuffer) > self._databuffersize:
-      self._databuffer[:-self._databuffersize] = []
+    if self._name == "common" or self._databuffer.getArchive() != None:
+      return
+
+    dirname = self._engine.getConfigManager().get("datadir") + "scrollback"
+    filename = os.path.join(dirname, re.sub(r"[^\w.-]", "_", self._name))
+    try:
+      if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+      self._databuffer.attachArchive(ScrollbackArchive(filename))
+    except (IOError, OSError, EnvironmentError), e:
+      exported.write_error("scrollback archive %s cannot be opened: %s" %
+                           (filename, e), self)
 
   def clearDataBuffer(self):
     """ 
     Clears the databuffer.
     """
-    self._databuffer = []
+    self._databuffer.clear()
   
   def resizeDataBuffer(self, newsize=10000):
     """ 
@@ -335,7 +1134,7 @@ class Session:
     @param newsize: the new buffer max size
     @type  newsize: int
     """
-    self._databuffersize = newsize
+    self._databuffer.resize(newsize)
 
 
   ### ------------------------------------------------
@@ -445,12 +1244,17 @@ class Session:
   ### Mud input functions
   ### ------------------------------------------------
 
-  def handleMudData(self, input):
+  def handleMudData(self, input, filter=1):
     """
     Handles input coming from the mud.
 
     @param input: the data coming from the mud
     @type  input: string
+
+    @param filter: whether (1) or not (0) to pass the data through the
+        mud_filter_hook.  the engine skips the filters when the event
+        queue is flooded.
+    @type  filter: boolean
     """
     # this sort of handles ansi color codes that get broken 
     # mid-transmission when mud data is chunked and sent across
@@ -467,13 +1271,18 @@ class Session:
     # we add the new input to the databuffer
     self.addToDataBuffer(input)
 
+    if not filter:
+      exported.write_mud_data(input, self)
+      return
+
     # we split the input into a series of lines and operate on
     # those
     inputlines = input.splitlines(1)
 
     for i in range(0, len(inputlines)):
       mem = inputlines[i]
-      # call the pre-filter hook
+      # call the pre-filter hook.  each line gets its own argmap so 
+      # nothing a hook function adds carries over to the next line.
       spamargs = {"session": self, "data": mem, "dataadj": mem}
 
       spamargs = exported.filter_mapper_hook_spam("mud_filter_hook", spamargs)
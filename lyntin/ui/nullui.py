@@ -0,0 +1,122 @@
+#######################################################################
+# This file is part of Lyntin.
+# copyright (c) Free Software Foundation 2001-2007
+#
+# Lyntin is distributed under the GNU General Public License license.  See the
+# file LICENSE for distribution details.
+#######################################################################
+"""
+Holds the null ui class.
+"""
+import threading, types
+from lyntin import exported
+from lyntin.ui import base, message
+
+
+HELP_TEXT = """
+The nullui throws away everything Lyntin would show the user and
+doesn't take any input.  It counts the messages and bytes it throws
+away by message type so you can see them with #diagnostics.
+
+It's for running Lyntin headless--benchmarks, replaying transcripts,
+bots driven entirely by command files.  Start it with:
+
+   --ui null
+
+and use --readfile to give it something to do.  It runs until a
+command file does #end or it gets a Ctrl-C.
+"""
+
+myui = None
+
+def get_ui_instance():
+  global myui
+  if myui == None:
+    myui = Nullui()
+  return myui
+
+class Nullui(base.BaseUI):
+  """
+  This ui discards all output.  It keeps counts of what it discarded.
+  """
+  def __init__(self):
+    """ Initialize the nullui."""
+    base.BaseUI.__init__(self)
+    exported.hook_register("to_user_hook", self.write)
+    exported.hook_register("diagnostics_hook", self.getDiagnostics)
+
+    self._done = threading.Event()
+    self.reset()
+
+  def reset(self):
+    """
+    Zeroes the message, byte and flush counts.
+    """
+    self._messages = {}
+    self._bytes = {}
+    for mem in message.MESSAGETYPES.keys():
+      self._messages[mem] = 0
+      self._bytes[mem] = 0
+    self._flushes = 0
+
+  def getCounts(self):
+    """
+    Returns what we've thrown away since we started or since the
+    last reset.
+
+    @return: (messages, bytes, flushes) where messages and bytes are
+        dicts of message type -> count
+    @rtype:  tuple of (dict, dict, int)
+    """
+    return (self._messages.copy(), self._bytes.copy(), self._flushes)
+
+  def getDiagnostics(self, args):
+    """
+    Reports the discarded output for #diagnostics.
+    """
+    data = ["nullui:"]
+    msgtypes = self._messages.keys()
+    msgtypes.sort()
+    for mem in msgtypes:
+      data.append("   %s %d messages, %d bytes" %
+                  (mem.ljust(12), self._messages[mem], self._bytes[mem]))
+    data.append("   %d flushes" % self._flushes)
+    return data
+
+  def runui(self):
+    global HELP_TEXT
+    exported.add_help("nullui", HELP_TEXT)
+
+    # there's no input, so we just sit here until we're shut down.
+    # we wake up every so often so a Ctrl-C can get through.
+    while not self._done.isSet():
+      self._done.wait(1.0)
+
+  def wantMainThread(self):
+    return 1
+
+  def shutdown(self, args):
+    """ Wakes up runui so it can return."""
+    self.shutdownflag = 1
+    self._done.set()
+
+  def write(self, args):
+    """
+    Counts the message and throws it away.
+    """
+    msg = args["message"]
+
+    if type(msg) == types.StringType:
+      msg = message.Message(msg, message.LTDATA)
+
+    self._messages[msg.type] = self._messages.get(msg.type, 0) + 1
+    self._bytes[msg.type] = self._bytes.get(msg.type, 0) + len(msg.data)
+
+  def flush(self):
+    self._flushes += 1
+
+# Local variables:
+# mode:python
+# py-indent-offset:2
+# tab-width:2
+# End:
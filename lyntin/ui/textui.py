@@ -254,6 +254,8 @@ class Textui(base.BaseUI):
     if line == '' or self.showTextForSession(ses) == 0:
       return
 
+    ansicolor = exported.get_config_snapshot().ansicolor
+
     # we prepend the session name to the text if this is not the 
     # current session sending text.
     pretext = ""
@@ -267,7 +269,7 @@ class Textui(base.BaseUI):
         pretext = "lyntin: " + pretext
 
       line = pretext + utils.chomp(line).replace("\n", "\n" + pretext)
-      if exported.get_config("ansicolor") == 1:
+      if ansicolor == 1:
         line = DEFAULT_ANSI + line
       sys.stdout.write(line + "\n")
       return
@@ -276,14 +278,15 @@ class Textui(base.BaseUI):
       # we don't print user data in the textui
       return
 
-    if exported.get_config("ansicolor") == 0:
+    if ansicolor == 0:
       if pretext:
         if line.endswith("\n"):
           line = (pretext + line[:-1].replace("\n", "\n" + pretext) + "\n")
         else:
           line = pretext + line.replace("\n", "\n" + pretext)
       sys.stdout.write(line)
-      sys.stdout.flush()
+      if not exported.myengine.inBatch():
+        sys.stdout.flush()
       return
 
     # each session has a saved current color for mud data.  we grab
@@ -318,7 +321,8 @@ class Textui(base.BaseUI):
           lines[i] = DEFAULT_ANSI + acolor + mem
 
       sys.stdout.write("".join(lines) + DEFAULT_ANSI)
-      sys.stdout.flush()
+      if not exported.myengine.inBatch():
+        sys.stdout.flush()
 
     self._currcolors[ses] = color
     self._unfinishedcolor[ses] = leftover
@@ -23,14 +23,15 @@ This has a series of utility functions that aren't related to classes
 in the application, but are useful in a variety of places.  They're 
 not dependent on application things, so it's easier to test them.
 """
-import string, re, time, types, os
+import string, re, time, types, os, threading, collections, bisect
+import sre_parse, sre_constants
 import ansi, constants
 
 # for finding non-escaped semi-colons in user input
 SPLIT = ";"
 SPLIT_REGEXP = re.compile(r'(?<!\\);')
 
-TIMESPAN_REGEXP = re.compile(r"^(?P<days>\d+d)?(?P<hours>\d+h)?(?P<minutes>\d+m)?(?P<seconds>\d+s?)?$")
+TIMESPAN_REGEXP = re.compile(r"^(?P<days>\d+d)?(?P<hours>\d+h)?(?P<minutes>\d+m)?(?P<seconds>(?:\d+(?:\.\d*)?|\.\d+)s?)?$")
 TIME_REGEXP1=re.compile(r"^(?P<hour>[1-9]|1[0-2])(?P<ampm>a|p)$")
 TIME_REGEXP2=re.compile(r"^(?P<hour>[1-9]|1[0-2]):(?P<minute>[0-5][0-9])(:(?P<second>[0-5]\d))?(?P<ampm>a|p)?$")
 TIME_REGEXP3=re.compile(r"^(?P<hour>0|1[3-9]|2[0-3]):(?P<minute>[0-5][0-9])(:(?P<second>[0-5]\d))?$")
@@ -52,6 +53,16 @@ class PriorityQueue:
     # whether or not our orderedlist is dirty
     self._dirty = 0
 
+    # func -> [calls, total time, max time] when we're profiling the
+    # functions in the queue, None when we're not (see setProfiling)
+    self._profile = None
+
+    # the orderedlist with each function wrapped in a _ProfiledCall
+    self._profiledlist = []
+
+    # kind -> dispatcher function (see getDispatcher)
+    self._dispatchers = {}
+
   def __generateList(self):
     """
     Goes through the prioritymap and generates an orderedlist.  This
@@ -66,6 +77,14 @@ class PriorityQueue:
     for priority in priorities:
       for mem in self._prioritymap[priority]:
         self._orderedlist.append(mem)
+
+    if self._profile != None:
+      self._profiledlist = []
+      for mem in self._orderedlist:
+        if not self._profile.has_key(mem):
+          self._profile[mem] = [0, 0.0, 0.0]
+        self._profiledlist.append(_ProfiledCall(mem, self._profile[mem]))
+    self._dispatchers = {}
     self._dirty = 0        
 
   def add(self, func, priority=constants.LAST):
@@ -118,8 +137,34 @@ class PriorityQueue:
     """
     if self._dirty == 1:
       self.__generateList()
+    if self._profile != None:
+      return self._profiledlist
     return self._orderedlist
 
+  def getDispatcher(self, kind, builder):
+    """
+    Returns a function that calls all the functions in the queue in
+    order.  The dispatcher gets built by calling builder(kind, list)
+    and we hold on to it until the queue changes.
+
+    @param kind: the kind of dispatcher--this is passed to the builder
+    @type  kind: string
+
+    @param builder: builds the dispatcher from the kind and the list
+        of functions
+    @type  builder: function
+
+    @return: whatever the builder returned
+    @rtype:  function
+    """
+    if self._dirty == 1:
+      self.__generateList()
+
+    dispatchers = self._dispatchers
+    if not dispatchers.has_key(kind):
+      dispatchers[kind] = builder(kind, self.getList())
+    return dispatchers[kind]
+
   def count(self):
     """
     Returns how many functions are in the list.
@@ -129,6 +174,513 @@ class PriorityQueue:
     """
     return len(self.getList())
 
+  def setProfiling(self, profile):
+    """
+    Turns profiling of the functions in the queue on or off.  While
+    it's on, getList hands out wrapped versions of the functions that
+    keep track of how many times each one gets called and how long
+    it takes.  Turning it off throws the numbers away.
+
+    @param profile: 1 to turn profiling on, 0 to turn it off
+    @type  profile: boolean
+    """
+    if profile:
+      if self._profile == None:
+        self._profile = {}
+    else:
+      self._profile = None
+      self._profiledlist = []
+    self._dirty = 1
+
+  def getProfile(self):
+    """
+    Returns the profiling data for the functions in the queue.
+
+    @return: list of (function, number of calls, total time, max time) 
+        tuples sorted by total time with the most expensive first.
+        times are in seconds.  it's empty if profiling is off.
+    @rtype:  list of tuples
+    """
+    if self._profile == None:
+      return []
+
+    data = []
+    for func, (calls, total, maxtime) in self._profile.items():
+      data.append((func, calls, total, maxtime))
+    data.sort(lambda x, y: cmp(y[2], x[2]))
+    return data
+
+class _ProfiledCall:
+  """
+  Wraps a function in a PriorityQueue that's being profiled and
+  adds up the calls to it.
+  """
+  def __init__(self, func, stats):
+    """
+    @param func: the function to call
+    @type  func: function
+
+    @param stats: the [calls, total time, max time] list to add to
+    @type  stats: list
+    """
+    self._func = func
+    self._stats = stats
+
+  def __call__(self, *args, **nargs):
+    start = time.time()
+    try:
+      return self._func(*args, **nargs)
+    finally:
+      elapsed = time.time() - start
+      stats = self._stats
+      stats[0] += 1
+      stats[1] += elapsed
+      if elapsed > stats[2]:
+        stats[2] = elapsed
+
+class LaneQueue:
+  """
+  A thread-safe queue made up of several FIFO lanes.  It's used for
+  the engine's event queue so that user input doesn't wait behind
+  a flood of mud data.
+
+  get picks the lane to pull from using smooth weighted round-robin:
+  a lane with weight 8 gets 8 items for every 1 a lane with weight 1
+  gets when both of them have items waiting.  A lane with weight 0
+  only gets items when the others are empty.
+
+  To keep lanes from starving, if the item at the head of a lane has
+  been waiting longer than maxwait seconds, the lane with the oldest
+  such item goes next regardless of weights.  We never do that twice
+  in a row though--otherwise a flood in one lane would turn us back
+  into one big FIFO.
+  """
+  def __init__(self, lanes, maxwait=0.5):
+    """
+    @param lanes: the lanes as (name, weight) tuples.  on ties, lanes
+        earlier in the list go first.
+    @type  lanes: list of (string, int) tuples
+
+    @param maxwait: how long (in seconds) an item can wait at the head
+        of a lane before we take it regardless of weights
+    @type  maxwait: float
+    """
+    lock = threading.Lock()
+    self._cond = threading.Condition(lock)
+
+    # for putters waiting for a lane to drain (see waitForRoom)
+    self._roomcond = threading.Condition(lock)
+    self._roomwaiters = 0
+
+    self._lanes = []
+    self._lanemap = {}
+    for name, weight in lanes:
+      # name, weight, current weight, items, served, total wait, max wait
+      lane = [name, weight, 0, collections.deque(), 0, 0.0, 0.0]
+      self._lanes.append(lane)
+      self._lanemap[name] = lane
+
+    self._maxwait = maxwait
+    self._size = 0
+
+    # whether the last lane we picked was picked because it was overdue
+    self._lastoverdue = 0
+
+    # set by interrupt to wake up getBatch
+    self._interrupted = 0
+
+  def setWeight(self, name, weight):
+    """
+    Sets the weight of a lane.
+
+    @param name: the name of the lane
+    @type  name: string
+
+    @param weight: the new weight (0 or greater)
+    @type  weight: int
+    """
+    self._cond.acquire()
+    try:
+      self._lanemap[name][1] = max(0, weight)
+    finally:
+      self._cond.release()
+
+  def setMaxWait(self, maxwait):
+    """
+    Sets how long an item can wait at the head of its lane before we
+    take it regardless of weights.
+
+    @param maxwait: the time in seconds
+    @type  maxwait: float
+    """
+    self._maxwait = maxwait
+
+  def put(self, item, lane):
+    """
+    Adds an item to the end of a lane.
+
+    @param item: the item to add
+    @type  item: anything
+
+    @param lane: the name of the lane
+    @type  lane: string
+
+    @raise KeyError: if there's no lane by that name
+    """
+    self._cond.acquire()
+    try:
+      self._lanemap[lane][3].append((time.time(), item))
+      self._size += 1
+      self._cond.notify()
+    finally:
+      self._cond.release()
+
+  def putMerged(self, item, lane, merge):
+    """
+    Adds an item to the end of a lane unless it can be merged into 
+    the item that's at the end of the lane already.
+
+    @param item: the item to add
+    @type  item: anything
+
+    @param lane: the name of the lane
+    @type  lane: string
+
+    @param merge: function that takes the item at the end of the lane
+        and the new item, and returns 1 if it merged the new item into
+        the old one or 0 if it didn't.  it gets called while we hold
+        the queue lock so no one can take the old item out from under
+        it.
+    @type  merge: function
+
+    @return: 1 if the item got merged, 0 if it got added
+    @rtype:  boolean
+
+    @raise KeyError: if there's no lane by that name
+    """
+    self._cond.acquire()
+    try:
+      items = self._lanemap[lane][3]
+      if items and merge(items[-1][1], item):
+        return 1
+
+      items.append((time.time(), item))
+      self._size += 1
+      self._cond.notify()
+      return 0
+    finally:
+      self._cond.release()
+
+  def waitForRoom(self, lane, limit, timeout):
+    """
+    Blocks until a lane has fewer than limit items in it or until
+    timeout seconds have gone by.
+
+    @param lane: the name of the lane
+    @type  lane: string
+
+    @param limit: the number of items
+    @type  limit: int
+
+    @param timeout: the most seconds to wait
+    @type  timeout: float
+
+    @return: 1 if there's room, 0 if we timed out
+    @rtype:  boolean
+    """
+    self._cond.acquire()
+    try:
+      end = time.time() + timeout
+      items = self._lanemap[lane][3]
+      while len(items) >= limit:
+        remaining = end - time.time()
+        if remaining <= 0:
+          return 0
+        self._roomwaiters += 1
+        try:
+          self._roomcond.wait(remaining)
+        finally:
+          self._roomwaiters -= 1
+      return 1
+    finally:
+      self._cond.release()
+
+  def get(self):
+    """
+    Removes and returns the next item, blocking until there is one.
+
+    @return: the next item
+    @rtype:  anything
+    """
+    return self.getBatch(1)[0]
+
+  def getBatch(self, maxitems):
+    """
+    Removes and returns up to maxitems items in the order get would
+    return them.  This blocks until there's at least one item, but
+    doesn't wait around for more.
+
+    @param maxitems: the most items to return
+    @type  maxitems: int
+
+    @return: the items--it's empty if interrupt woke us up
+    @rtype:  list
+    """
+    self._cond.acquire()
+    try:
+      while self._size == 0:
+        if self._interrupted:
+          self._interrupted = 0
+          return []
+        self._cond.wait()
+
+      now = time.time()
+      items = []
+      while self._size > 0 and len(items) < maxitems:
+        items.append(self._take(self._pickLane(now), now))
+
+      if self._roomwaiters:
+        self._roomcond.notifyAll()
+      return items
+    finally:
+      self._cond.release()
+
+  def interrupt(self):
+    """
+    Wakes up a getBatch that's waiting on the empty queue.  It returns
+    an empty list.  If nothing's waiting, the next getBatch that finds
+    the queue empty returns right away.
+    """
+    self._cond.acquire()
+    try:
+      self._interrupted = 1
+      self._cond.notifyAll()
+    finally:
+      self._cond.release()
+
+  def getLane(self, name, maxitems):
+    """
+    Removes and returns up to maxitems items from one lane without
+    blocking.  The engine uses this to let user input that shows up
+    while it's handling a batch go ahead of the rest of the batch.
+
+    @param name: the name of the lane
+    @type  name: string
+
+    @param maxitems: the most items to return
+    @type  maxitems: int
+
+    @return: the items--it might be empty
+    @rtype:  list
+    """
+    self._cond.acquire()
+    try:
+      now = time.time()
+      lane = self._lanemap[name]
+      items = []
+      while lane[3] and len(items) < maxitems:
+        items.append(self._take(lane, now))
+
+      if items and self._roomwaiters:
+        self._roomcond.notifyAll()
+      return items
+    finally:
+      self._cond.release()
+
+  def _take(self, lane, now):
+    """
+    Removes the item at the head of a lane and adds up its wait.
+    Only call this when holding the lock.
+    """
+    queued, item = lane[3].popleft()
+    self._size -= 1
+
+    wait = now - queued
+    lane[4] += 1
+    lane[5] += wait
+    if wait > lane[6]:
+      lane[6] = wait
+    return item
+
+  def _pickLane(self, now):
+    """
+    Figures out which lane to take the next item from.  Only call
+    this when holding the lock and when there's at least one item.
+    """
+    # starvation protection--oldest overdue item goes first
+    overdue = None
+    lanes = self._lanes
+    if self._lastoverdue:
+      lanes = []
+    for lane in lanes:
+      if lane[3] and now - lane[3][0][0] > self._maxwait:
+        if overdue == None or lane[3][0][0] < overdue[3][0][0]:
+          overdue = lane
+
+    # smooth weighted round-robin over the lanes that have items
+    total = 0
+    best = None
+    for lane in self._lanes:
+      if not lane[3]:
+        continue
+      lane[2] += lane[1]
+      total += lane[1]
+      if best == None or lane[2] > best[2]:
+        best = lane
+
+    if overdue != None:
+      best = overdue
+      self._lastoverdue = 1
+    else:
+      self._lastoverdue = 0
+    best[2] -= total
+    return best
+
+  def qsize(self):
+    """
+    Returns the total number of items in all the lanes.
+
+    @return: the number of items
+    @rtype:  int
+    """
+    return self._size
+
+  def depth(self, lane):
+    """
+    Returns the number of items in a lane.
+
+    @param lane: the name of the lane
+    @type  lane: string
+
+    @return: the number of items
+    @rtype:  int
+    """
+    return len(self._lanemap[lane][3])
+
+  def getStats(self):
+    """
+    Returns statistics for each lane.  Wait times are how long items
+    sat in the queue before get handed them out.
+
+    @return: list of (name, weight, depth, items served, average wait,
+        max wait, how long the item at the head has been waiting)
+        tuples in lane order.  times are in seconds.
+    @rtype:  list of tuples
+    """
+    self._cond.acquire()
+    try:
+      now = time.time()
+      data = []
+      for name, weight, current, items, served, totalwait, maxwait in self._lanes:
+        if served:
+          avgwait = totalwait / served
+        else:
+          avgwait = 0.0
+        if items:
+          headwait = now - items[0][0]
+        else:
+          headwait = 0.0
+        data.append((name, weight, len(items), served, avgwait, maxwait, headwait))
+      return data
+    finally:
+      self._cond.release()
+
+class Histogram:
+  """
+  Counts values in fixed buckets.  Each bucket holds the values up to
+  and including its bound that didn't fit in the previous bucket.
+  There's one extra bucket at the end for values bigger than the
+  last bound.
+
+  It's used for timing things, so it also keeps track of the number
+  of values, their total, and the biggest one.
+  """
+  def __init__(self, bounds):
+    """
+    @param bounds: the upper bounds of the buckets in increasing order
+    @type  bounds: list of numbers
+    """
+    self._bounds = list(bounds)
+    self._counts = [0] * (len(self._bounds) + 1)
+    self._count = 0
+    self._total = 0.0
+    self._max = 0.0
+
+  def add(self, value):
+    """
+    Adds a value.
+
+    @param value: the value to add
+    @type  value: number
+    """
+    self._counts[bisect.bisect_left(self._bounds, value)] += 1
+    self._count += 1
+    self._total += value
+    if value > self._max:
+      self._max = value
+
+  def getCount(self):
+    """
+    @return: the number of values we've seen
+    @rtype:  int
+    """
+    return self._count
+
+  def getAverage(self):
+    """
+    @return: the average of the values we've seen or 0.0 if we
+        haven't seen any
+    @rtype:  float
+    """
+    if self._count == 0:
+      return 0.0
+    return self._total / self._count
+
+  def getMax(self):
+    """
+    @return: the biggest value we've seen
+    @rtype:  number
+    """
+    return self._max
+
+  def getPercentile(self, percent):
+    """
+    Returns the bound of the bucket the given percentile falls in.
+    Values past the last bound use the biggest value we've seen.
+
+    @param percent: the percentile (0-100)
+    @type  percent: number
+
+    @return: the approximate percentile
+    @rtype:  number
+    """
+    target = self._count * percent / 100.0
+    seen = 0
+    for i in range(len(self._bounds)):
+      seen += self._counts[i]
+      if seen >= target and seen > 0:
+        return min(self._bounds[i], self._max)
+    return self._max
+
+  def getData(self):
+    """
+    Returns the histogram as a dict of basic types so it can be
+    written out as JSON and such.
+
+    @return: dict with "count", "total", "max", and "buckets" which
+        is a list of [bound, count] pairs.  the bound of the last
+        bucket is None.
+    @rtype:  dict
+    """
+    buckets = []
+    for i in range(len(self._counts)):
+      if i < len(self._bounds):
+        buckets.append([self._bounds[i], self._counts[i]])
+      else:
+        buckets.append([None, self._counts[i]])
+    return { "count": self._count, "total": self._total, "max": self._max,
+             "buckets": buckets }
+
 def filter_cm(text):
   """
   Filters out ^M.  Useful for logging.
@@ -325,6 +877,55 @@ def compile_regexp(text, anchors=0, stars=0):
 
   return re.compile("".join(pieces), flags_bitmask)
 
+def get_required_literals(regexp):
+  """
+  Finds runs of literal text that anything the regular expression
+  matches has to contain.  "says:.*gold" gives ["says:", "gold"] and
+  "(foo|bar)baz" gives ["baz"].  This lets searches throw out text 
+  that can't match before running the regular expression on it.
+
+  It's conservative: parts of the regular expression it doesn't 
+  understand just don't contribute anything.  Case-insensitive
+  regular expressions don't have any required literals.
+
+  @param regexp: the compiled regular expression
+  @type  regexp: Re
+
+  @return: the literal runs
+  @rtype:  list of unicode strings
+  """
+  if regexp.flags & re.IGNORECASE:
+    return []
+
+  try:
+    parsed = sre_parse.parse(regexp.pattern, regexp.flags)
+  except Exception:
+    return []
+
+  literals = []
+  _collect_literals(parsed, literals)
+  return literals
+
+def _collect_literals(parsed, literals):
+  run = []
+  for op, av in parsed:
+    if op == sre_constants.LITERAL:
+      run.append(unichr(av))
+      continue
+
+    if run:
+      literals.append(u"".join(run))
+      run = []
+
+    if op == sre_constants.SUBPATTERN:
+      _collect_literals(av[-1], literals)
+    elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+      if av[0] >= 1:
+        _collect_literals(av[2], literals)
+
+  if run:
+    literals.append(u"".join(run))
+
 
 def expand_text(filter, fulllist):
   """
@@ -695,13 +1296,14 @@ def columnize(textlist, screenwidth=72, indent=0):
 
 def parse_timespan(timespan):
   """
-  Parses a timsspan into a number of seconds.  
+  Parses a timsspan into a number of seconds.  The seconds can have
+  a fraction (e.g. "0.25" or "1m2.5s").
 
   @param timespan: the timespan string to parse
   @type  timespan: string
 
   @returns: the number of seconds in the timespan
-  @rtype: int
+  @rtype: int (or float if there was a fraction)
 
   @raises ValueError: if the timespan is unparseable
   """
@@ -741,7 +1343,10 @@ def parse_timespan(timespan):
     seconds="0"
   elif seconds.endswith("s"):
     seconds=seconds[:-1]
-  seconds=int(seconds)
+  if seconds.find(".") != -1:
+    seconds=float(seconds)
+  else:
+    seconds=int(seconds)
       
   return days * 24 * 60 * 60 + hours * 60 * 60 + minutes * 60 + seconds
 
@@ -1144,6 +1749,143 @@ def expand_placement_vars(input, expansion):
   return expansion
 
 
+# for pulling the literals out of expressions.  string literals come
+# first so we don't go looking for numbers inside of strings.
+EXPR_TOKEN_REGEXP = re.compile(r"""[uUbBrR]*('''|\"\"\"|'|")(?:\\.|(?!\1).)*?\1"""
+                               r"""|[A-Za-z_]\w*|\d[\w.]*(?:(?<=[eE])[+-]\d+)?""", re.S)
+EXPR_STRING_REGEXP = re.compile(r"""^(?:'[^'\\\n]*'|"[^"\\\n]*")$""")
+EXPR_INT_REGEXP = re.compile(r"^(?:0|[1-9]\d*)$")
+EXPR_FLOAT_REGEXP = re.compile(r"^(?:0|[1-9]\d*)(?:\.\d*)?(?:[eE][+-]?\d+)?$")
+
+# the names an expression can use that we didn't put there
+EXPR_NAMES = { "True": True, "False": False, "None": None }
+EXPR_KEYWORDS = ["and", "or", "not", "in", "is", "if", "else"] + EXPR_NAMES.keys()
+
+# the ast nodes we allow in expressions we cache
+EXPR_NODES = ["Expression", "BoolOp", "And", "Or", "BinOp", "Add", "Sub",
+              "Mult", "Div", "FloorDiv", "Mod", "Pow", "LShift", "RShift",
+              "BitOr", "BitXor", "BitAnd", "UnaryOp", "Not", "USub", "UAdd",
+              "Invert", "Compare", "Eq", "NotEq", "Lt", "LtE", "Gt", "GtE",
+              "In", "NotIn", "Is", "IsNot", "IfExp", "Num", "Str", "Name",
+              "Load", "Tuple", "List"]
+
+EXPR_CACHE_SIZE = 256
+_expr_cache = {}
+_expr_cache_order = []
+# session workers can evaluate expressions at the same time
+_expr_cache_lock = threading.Lock()
+
+def _hoist_literals(text):
+  """
+  Replaces the simple number and string literals in an expression with
+  names so that expressions that only differ by their literal values
+  share a template.
+
+  @param text: the python expression
+  @type  text: string
+
+  @return: (the template, the name -> value dict) or None if the
+      expression uses names of its own
+  @rtype:  (string, dict) or None
+  """
+  values = {}
+  uncacheable = []
+
+  def hoist(match, values=values, uncacheable=uncacheable):
+    token = match.group(0)
+    if EXPR_STRING_REGEXP.match(token):
+      # eval hands back utf-8 encoded strings for unicode source
+      value = token[1:-1]
+      if type(value) == types.UnicodeType:
+        value = value.encode("utf-8")
+    elif EXPR_INT_REGEXP.match(token):
+      value = int(token)
+    elif EXPR_FLOAT_REGEXP.match(token):
+      value = float(token)
+    else:
+      if (token[0].isalpha() or token[0] == "_") and \
+          token not in EXPR_KEYWORDS:
+        uncacheable.append(token)
+      return token
+
+    name = "_l%d" % len(values)
+    values[name] = value
+    return " %s " % name
+
+  template = EXPR_TOKEN_REGEXP.sub(hoist, text)
+  if uncacheable:
+    return None
+  return template, values
+
+def _compile_expression(template):
+  """
+  Compiles an expression template if it only does arithmetic, logic,
+  and comparisons.
+
+  @param template: the template from _hoist_literals
+  @type  template: string
+
+  @return: the code object or None if the template isn't valid or
+      does something we don't allow
+  @rtype:  code or None
+  """
+  import ast
+  try:
+    tree = ast.parse(template.strip(), "<expression>", "eval")
+  except SyntaxError:
+    return None
+
+  for node in ast.walk(tree):
+    if node.__class__.__name__ not in EXPR_NODES:
+      return None
+
+  return compile(tree, "<expression>", "eval", 0, 1)
+
+def eval_expression(text, globals=None):
+  """
+  Evaluates a python expression.  Expressions that stick to literals,
+  arithmetic, logic, and comparisons (which is what #if and #math get
+  after variable expansion, e.g. "95 < 100") get compiled once per
+  shape--the literals are bound as names so "95 < 100" and "42 < 100"
+  use the same code object.  Everything else goes through eval.
+
+  @param text: the python expression
+  @type  text: string
+
+  @param globals: the globals to eval expressions we don't cache in
+  @type  globals: dict
+
+  @return: the value of the expression
+
+  @raise SyntaxError: if the expression isn't valid python
+  @raise Exception: whatever the expression raises
+  """
+  hoisted = _hoist_literals(text)
+  if hoisted != None:
+    template, values = hoisted
+    if _expr_cache.has_key(template):
+      code = _expr_cache[template]
+    else:
+      code = _compile_expression(template)
+      _expr_cache_lock.acquire()
+      try:
+        if not _expr_cache.has_key(template):
+          if len(_expr_cache_order) >= EXPR_CACHE_SIZE:
+            _expr_cache.pop(_expr_cache_order.pop(0), None)
+          _expr_cache_order.append(template)
+        _expr_cache[template] = code
+      finally:
+        _expr_cache_lock.release()
+
+    if code != None:
+      values.update(EXPR_NAMES)
+      return eval(code, {"__builtins__": {}}, values)
+
+  if globals == None:
+    return eval(text)
+  return eval(text, globals)
+
+
 # Local variables:
 # mode:python
 # py-indent-offset:2
@@ -12,7 +12,7 @@ This new test-server is a patchwork of stuff from the existing test server
 and code I wrote for the Varium mud server way back when.  It is actually
 a functional mini-mud now.
 """
-import string, testserver, toolsutils
+import string, socket, errno, testserver, toolsutils
 from toolsutils import color
 
 
@@ -22,6 +22,8 @@ class Connection:
     self._sock = newsock
     self._sock.setblocking(0)      # non-blocking
     self._buffer = []
+    self._outbuf = []
+    self._pending = 0
     self._addr = newaddr
     self._name = "spirit"
     self._desc = "A regular user."
@@ -41,7 +43,9 @@ class Connection:
     Shuts down the socket for the Connection ob.
     """
     if not self._sock: return
-    self._sock.shutdown(2)
+    # the other end might already be gone
+    try: self._sock.shutdown(2)
+    except socket.error: pass
     self._sock.close()
     self._sock = None
     self._world.disconnect(self)
@@ -51,7 +55,48 @@ class Connection:
     if not data: return
 
     data = string.replace(data, "\n", "\r\n")
-    self._sock.send(data)
+    self.writeRaw(data)
+
+  def writeRaw(self, data):
+    """writeRaw(self, data) -> None
+
+    Writes data without fixing up the line endings.  Whatever the
+    socket won't take right now gets buffered and goes out when
+    flushOutput gets called.
+    """
+    if not self._sock: return
+    if not data: return
+
+    self._outbuf.append(data)
+    self._pending += len(data)
+    self.flushOutput()
+
+  def flushOutput(self):
+    """flushOutput(self) -> None
+
+    Sends as much buffered output as the socket will take.
+    """
+    while self._sock and self._outbuf:
+      data = self._outbuf[0]
+      try:
+        sent = self._sock.send(data)
+      except socket.error, e:
+        if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+          return
+        raise
+
+      self._pending -= sent
+      if sent < len(data):
+        self._outbuf[0] = data[sent:]
+        return
+      del self._outbuf[0]
+
+  def pending(self):
+    """pending(self) -> int
+
+    Returns the number of bytes of buffered output.
+    """
+    return self._pending
 
   def sockid(self):
     return self._sock
@@ -0,0 +1,103 @@
+#######################################################################
+# This file is part of Lyntin.
+# copyright (c) Free Software Foundation 2001-2007
+#
+# Lyntin is distributed under the GNU General Public License license.  See the
+# file LICENSE for distribution details.
+#######################################################################
+"""
+Times how long the CommandManager takes to dispatch Lyntin commands
+with 200 commands registered.  It compares the CommandManager's trie
+lookup with the sorted linear scan that filter used to do so we can
+see what we're buying.
+
+usage:
+
+   python dispatchbench.py [iterations]
+"""
+# we kind of assume this is being run in ./lyntin40/tools/
+import sys, re, time
+sys.path.insert(0, "../")
+
+from lyntin import engine, exported
+
+NUMCOMMANDS = 200
+
+def noop_cmd(ses, args, input):
+  pass
+
+def build_engine():
+  """
+  Builds an engine with no ui and registers NUMCOMMANDS commands
+  with it.
+  """
+  e = engine.Engine()
+  engine.Engine.instance = e
+  exported.myengine = e
+  e._setupConfiguration()
+
+  for i in range(NUMCOMMANDS):
+    exported.add_command("cmd%03d" % i, noop_cmd, "arg=")
+  for mem in ["alias", "action", "highlight", "showme", "variable"]:
+    exported.add_command(mem, noop_cmd, "arg=")
+  exported.add_command("^cr", noop_cmd, "")
+  exported.add_command("^end", noop_cmd, "")
+  return e
+
+def linear_lookup(cm, word):
+  """
+  The way CommandManager.filter used to find commands.
+  """
+  commands = cm.getCommands()
+  commands.sort()
+  for mem in commands:
+    if mem.startswith("^"):
+      if re.compile(mem).search(word):
+        return mem
+    elif mem.startswith(word):
+      return mem
+  return None
+
+def timeit(func, words, iterations):
+  start = time.time()
+  for i in range(iterations):
+    for mem in words:
+      func(mem)
+  return time.time() - start
+
+def main(iterations):
+  e = build_engine()
+  cm = e.getManager("command")
+  words = ["al", "sh", "var", "cmd000", "cmd199", "cmd1", "cr", "endx", "nosuch"]
+
+  for mem in words:
+    if linear_lookup(cm, mem) != cm.findCommand(mem):
+      print "mismatch on %s: %s != %s" % (mem, linear_lookup(cm, mem),
+                                          cm.findCommand(mem))
+
+  lookups = iterations * len(words)
+  linear = timeit(lambda w: linear_lookup(cm, w), words, iterations)
+  trie = timeit(cm.findCommand, words, iterations)
+
+  ses = e.getSession("common")
+  def dispatch(w):
+    cm.filter({"session": ses, "internal": 1, "dataadj": "#" + w + " x"})
+  exported.hook_register("to_user_hook", lambda args: None)
+  full = timeit(dispatch, words[:-1], iterations)
+
+  print "%d commands registered, %d lookups" % (len(cm.getCommands()), lookups)
+  print "   linear scan: %8.2f usec/lookup" % (linear * 1000000 / lookups)
+  print "   trie:        %8.2f usec/lookup" % (trie * 1000000 / lookups)
+  print "   filter:      %8.2f usec/command" % (full * 1000000 / (iterations * (len(words) - 1)))
+
+if __name__ == '__main__':
+  iterations = 1000
+  if len(sys.argv) > 1:
+    iterations = int(sys.argv[1])
+  main(iterations)
+
+# Local variables:
+# mode:python
+# py-indent-offset:2
+# tab-width:2
+# End:
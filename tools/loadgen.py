@@ -0,0 +1,413 @@
+#######################################################################
+# This file is part of Lyntin.
+# copyright (c) Free Software Foundation 2001-2007
+#
+# Lyntin is distributed under the GNU General Public License license.  See the
+# file LICENSE for distribution details.
+#######################################################################
+"""
+Generates mud traffic for the test server's load mode.  Each client
+connection gets its own LoadGenerator which makes up lines of text
+at a given rate along with the nastier things real muds send us:
+ANSI color, prompts with and without GA/EOR, bursts of telnet option
+negotiation and MSDP, multibyte characters, and escape sequences
+and characters split across packets.
+
+The settings come from the test server's options (all strings):
+
+   lps         - lines per second
+   ansi        - fraction of words that get colored (0.0-1.0)
+   linelen     - line length in characters: "min-max" or "len"
+   prompts     - "ga", "eor", "bare" (no terminator), or "none"
+   promptevery - send a prompt every this many lines
+   telnet      - telnet option/MSDP bursts per second
+   multibyte   - fraction of words that have non-ascii characters
+   split       - chance (0.0-1.0) that a tick's output gets cut in
+                 the middle of an escape sequence, a telnet code, or
+                 a multibyte character
+   encoding    - encoding for the multibyte characters
+
+A load script lets the traffic change over time.  Each line is a
+duration in seconds followed by option=value settings that override
+the options for that long:
+
+   # quiet, then a 2 second flood, then prompts with no GA
+   5   lps=10
+   2   lps=5000 ansi=0.8 split=0.5
+   10  lps=50 prompts=bare
+
+When the script runs out, it starts over.
+"""
+import random
+
+IAC  = chr(255)
+DONT = chr(254)
+DO   = chr(253)
+WONT = chr(252)
+WILL = chr(251)
+SB   = chr(250)
+GA   = chr(249)
+EOR  = chr(239)
+SE   = chr(240)
+ESC  = chr(27)
+
+MSDP = chr(69)
+MSDP_VAR = chr(1)
+MSDP_VAL = chr(2)
+
+# options we're happy to have the client agree to or refuse--no
+# echo or compression.  MSDP, MSSP and GMCP.
+TELNET_OPTIONS = [chr(69), chr(70), chr(201)]
+
+MSDP_VARIABLES = ["HEALTH", "HEALTH_MAX", "MANA", "MOVEMENT", "ROOM_NAME",
+                  "OPPONENT_HEALTH", "EXPERIENCE", "AFFECTS"]
+
+WORDS = ["the", "orc", "swings", "at", "you", "and", "misses", "a", "small",
+         "tavern", "Neil", "scrubs", "some", "glasses", "north", "south",
+         "gold", "coins", "lie", "here", "dragon", "breathes", "fire",
+         "adventurer", "says", "hello", "there", "mighty", "fine", "morning"]
+
+MULTIBYTE_WORDS = [u"caf\xe9", u"na\xefve", u"\xc6r\xf8", u"stra\xdfe",
+                   u"\u20ac100", u"\u6771\u4eac", u"\u043c\u0435\u0447",
+                   u"\u2192"]
+
+OPTION_TYPES = {"lps": float, "ansi": float, "telnet": float,
+                "multibyte": float, "split": float, "promptevery": int}
+
+DEFAULTS = {"lps": "100", "ansi": "0.3", "linelen": "20-100",
+            "prompts": "ga", "promptevery": "20", "telnet": "0",
+            "multibyte": "0.0", "split": "0.0", "encoding": "utf-8"}
+
+PROMPTS = ["ga", "eor", "bare", "none"]
+
+def check_options(options):
+  """
+  Makes sure the load options are valid.
+
+  @param options: option name -> value (strings)
+  @type  options: dict
+
+  @return: an error message or None if everything's fine
+  @rtype:  string
+  """
+  for name, value in options.items():
+    if OPTION_TYPES.has_key(name):
+      try:
+        value = OPTION_TYPES[name](value)
+      except ValueError:
+        return "%s needs to be a number." % name
+      if value < 0:
+        return "%s can't be negative." % name
+
+    elif name == "linelen":
+      try:
+        parse_range(value)
+      except ValueError:
+        return "linelen needs to be a number or a range like 20-100."
+
+    elif name == "prompts":
+      if value not in PROMPTS:
+        return "prompts needs to be one of %s." % ", ".join(PROMPTS)
+
+    elif name == "encoding":
+      try:
+        u"x".encode(value)
+      except LookupError:
+        return "unknown encoding %s." % value
+
+  return None
+
+def parse_range(text):
+  """
+  Parses "min-max" or "len" into a (min, max) tuple.
+  """
+  if "-" in text:
+    low, high = text.split("-", 1)
+    low, high = int(low), int(high)
+  else:
+    low = high = int(text)
+  if low < 1 or high < low:
+    raise ValueError(text)
+  return (low, high)
+
+def read_loadscript(filename):
+  """
+  Reads a load script.
+
+  @param filename: the file to read
+  @type  filename: string
+
+  @return: list of (duration, options) tuples
+  @rtype:  list
+
+  @raises ValueError: if there's something wrong with the script
+  """
+  phases = []
+  f = open(filename, "r")
+  lineno = 0
+  for line in f.readlines():
+    lineno += 1
+    line = line.split("#", 1)[0].strip()
+    if not line:
+      continue
+
+    parts = line.split()
+    try:
+      duration = float(parts[0])
+    except ValueError:
+      raise ValueError("line %d: '%s' isn't a duration." % (lineno, parts[0]))
+
+    options = {}
+    for mem in parts[1:]:
+      if "=" not in mem:
+        raise ValueError("line %d: '%s' isn't option=value." % (lineno, mem))
+      name, value = mem.split("=", 1)
+      if not DEFAULTS.has_key(name):
+        raise ValueError("line %d: unknown option %s." % (lineno, name))
+      options[name] = value
+
+    error = check_options(options)
+    if error:
+      raise ValueError("line %d: %s" % (lineno, error))
+    phases.append((duration, options))
+  f.close()
+
+  if phases and sum([mem[0] for mem in phases]) <= 0:
+    raise ValueError("the durations add up to nothing.")
+  return phases
+
+
+class LoadGenerator:
+  """
+  Makes up traffic for one connection.  Call generate every tick
+  with the current time and send what it returns.
+  """
+  def __init__(self, options, phases=None, seed=None):
+    """
+    @param options: the base options--anything not in there uses the
+        default
+    @type  options: dict
+
+    @param phases: the parsed load script or None
+    @type  phases: list of (duration, options) tuples
+
+    @param seed: seed for the random number generator so runs can
+        be repeated
+    @type  seed: int
+    """
+    self._base = DEFAULTS.copy()
+    for mem in DEFAULTS.keys():
+      if options.has_key(mem):
+        self._base[mem] = options[mem]
+
+    self._phases = phases or []
+    self._phase = -1
+    self._random = random.Random(seed)
+
+    self._start = None
+    self._last = None
+    self._lineowed = 0.0
+    self._telnetowed = 0.0
+    self._sinceprompt = 0
+    self._held = ""
+
+    self.lines = 0
+    self.bytes = 0
+    self.prompts = 0
+    self.bursts = 0
+    self.splits = 0
+    self.stalls = 0
+
+    self._setOptions({})
+
+  def _setOptions(self, overrides):
+    options = self._base.copy()
+    options.update(overrides)
+
+    self._lps = float(options["lps"])
+    self._ansi = float(options["ansi"])
+    self._linelen = parse_range(options["linelen"])
+    self._prompts = options["prompts"]
+    self._promptevery = max(1, int(options["promptevery"]))
+    self._telnet = float(options["telnet"])
+    self._multibyte = float(options["multibyte"])
+    self._split = float(options["split"])
+    self._encoding = options["encoding"]
+
+  def _updatePhase(self, now):
+    """
+    Switches to whichever phase of the load script we're in.
+    """
+    if not self._phases:
+      return
+
+    total = 0.0
+    for duration, options in self._phases:
+      total += duration
+    elapsed = (now - self._start) % total
+
+    for i in range(len(self._phases)):
+      duration, options = self._phases[i]
+      if elapsed < duration:
+        break
+      elapsed -= duration
+
+    if i != self._phase:
+      self._phase = i
+      self._setOptions(options)
+
+  def stall(self, now):
+    """
+    Tells the generator the client isn't keeping up, so it shouldn't
+    make up traffic for the time that's gone by.
+    """
+    self._last = now
+    self.stalls += 1
+
+  def generate(self, now):
+    """
+    Makes up the traffic for the time that's gone by since the last
+    call.
+
+    @param now: the current time
+    @type  now: float
+
+    @return: the data to send--it might be empty
+    @rtype:  string
+    """
+    if self._start == None:
+      self._start = self._last = now
+    self._updatePhase(now)
+
+    elapsed = now - self._last
+    self._last = now
+
+    self._lineowed += self._lps * elapsed
+    self._telnetowed += self._telnet * elapsed
+    lines = int(self._lineowed)
+    bursts = int(self._telnetowed)
+    self._lineowed -= lines
+    self._telnetowed -= bursts
+
+    out = [self._held]
+    self._held = ""
+
+    # scatter the telnet bursts between the lines
+    burstat = [self._random.randint(0, lines) for i in range(bursts)]
+    burstat.sort()
+
+    for i in range(lines + 1):
+      while burstat and burstat[0] == i:
+        del burstat[0]
+        out.append(self._burst())
+
+      if i == lines:
+        break
+
+      out.append(self._line())
+      self._sinceprompt += 1
+      if self._prompts != "none" and self._sinceprompt >= self._promptevery:
+        self._sinceprompt = 0
+        out.append(self._prompt())
+
+    data = "".join(out)
+
+    if data and self._random.random() < self._split:
+      cut = self._cutPoint(data)
+      if cut:
+        self._held = data[cut:]
+        data = data[:cut]
+        self.splits += 1
+
+    self.bytes += len(data)
+    return data
+
+  def _word(self):
+    if self._random.random() < self._multibyte:
+      word = self._random.choice(MULTIBYTE_WORDS)
+      word = word.encode(self._encoding, "replace")
+    else:
+      word = self._random.choice(WORDS)
+
+    if self._random.random() < self._ansi:
+      word = "%s[%d;%dm%s%s[0m" % (ESC, self._random.randint(0, 1),
+                                   self._random.randint(31, 37), word, ESC)
+    return word
+
+  def _line(self):
+    """
+    Returns a line of text with roughly the configured length.  The
+    length doesn't count ANSI codes.
+    """
+    length = self._random.randint(self._linelen[0], self._linelen[1])
+    words = []
+    size = 0
+    while size < length:
+      word = self._word()
+      words.append(word)
+      size += len(word) + 1
+
+    self.lines += 1
+    return " ".join(words) + "\r\n"
+
+  def _prompt(self):
+    self.prompts += 1
+    prompt = "<%dhp %dm %dmv> " % (self._random.randint(1, 500),
+                                  self._random.randint(1, 500),
+                                  self._random.randint(1, 500))
+    if self._prompts == "ga":
+      return prompt + IAC + GA
+    if self._prompts == "eor":
+      return prompt + IAC + EOR
+    return prompt
+
+  def _burst(self):
+    """
+    Returns a burst of telnet option negotiation and MSDP updates.
+    """
+    self.bursts += 1
+    out = []
+    for i in range(self._random.randint(3, 12)):
+      if self._random.random() < 0.3:
+        out.append(IAC + self._random.choice([WILL, WONT, DO, DONT]) +
+                   self._random.choice(TELNET_OPTIONS))
+      else:
+        out.append(IAC + SB + MSDP + MSDP_VAR +
+                   self._random.choice(MSDP_VARIABLES) + MSDP_VAL +
+                   str(self._random.randint(0, 10000)) + IAC + SE)
+    return "".join(out)
+
+  def _cutPoint(self, data):
+    """
+    Picks a place to split the data that's going to hurt: inside an
+    escape sequence, a telnet code, or a multibyte character.  If
+    there isn't one, we pick anywhere.
+    """
+    candidates = []
+    for i in range(1, len(data)):
+      prev = data[i-1]
+      if prev == ESC or prev == IAC:
+        candidates.append(i)
+      elif ord(prev) >= 0xc0 and ord(data[i]) & 0xc0 == 0x80:
+        # the first byte of a utf-8 multibyte character
+        candidates.append(i)
+
+    if candidates:
+      return self._random.choice(candidates)
+    if len(data) > 1:
+      return self._random.randint(1, len(data) - 1)
+    return 0
+
+  def getStats(self):
+    """
+    Returns a one line summary of what we've sent.
+    """
+    return ("%d lines, %d prompts, %d telnet bursts, %d splits, "
+            "%d bytes, %d stalls" % (self.lines, self.prompts, self.bursts,
+            self.splits, self.bytes, self.stalls))
+
+# Local variables:
+# mode:python
+# py-indent-offset:2
+# tab-width:2
+# End:
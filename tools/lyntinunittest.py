@@ -12,7 +12,7 @@ pieces inside of Lyntin--mostly stuff that's standalone in the
 lyntin.utils module.
 """
 # we kind of assume this is being run in ./lyntin40/tools/
-import sys, unittest
+import sys, os, unittest
 sys.path.insert(0, "../")
 
 import lyntin.utils
@@ -122,7 +122,9 @@ class TestParseTimespan(unittest.TestCase):
     ("1s", 1),
     ("1h2m3s", 3723),
     ("17", 17),
-    ("5h", 3600 * 5)
+    ("5h", 3600 * 5),
+    ("0.25", 0.25),
+    ("1m2.5s", 62.5)
   )
 
   def testParseTimespam(self):
@@ -168,6 +170,1099 @@ class TestExpandVars(unittest.TestCase):
       c, s = self.t[i]
       self.assertEquals(expand_vars(c, self.varmap), s, "test %d" % i)
 
+class TestArgParserCache(unittest.TestCase):
+  def testCacheHits(self):
+    """tests lyntin.argparser.ArgumentParser parse result caching"""
+    from lyntin.argparser import ArgumentParser
+    ap = ArgumentParser("a* b**", "cache=2")
+    d = ap.parse("x y k=v")
+    d["a"].append("z")
+    d["b"]["z"] = "z"
+    self.assertEquals(ap.parse("x y k=v"), {"a": ["x", "y"], "b": {"k": "v"}})
+    self.assertEquals(ap.getCacheStats(), (1, 1, 1))
+
+    ap.parse("1")
+    ap.parse("2")
+    self.assertEquals(ap.getCacheStats(), (1, 3, 2))
+
+  def testCacheResolver(self):
+    """tests that cached parse results notice new defaults"""
+    from lyntin.argparser import ArgumentParser
+    ap = ArgumentParser("input=", "cache=2")
+    defaults = {"input": "bob"}
+    self.assertEquals(ap.parse("", defaults.get), {"input": "bob"})
+    defaults["input"] = "joe"
+    self.assertEquals(ap.parse("", defaults.get), {"input": "joe"})
+    self.assertEquals(ap.parse("", defaults.get), {"input": "joe"})
+    self.assertEquals(ap.getCacheStats(), (1, 2, 1))
+
+  def testCacheNoResolver(self):
+    """tests cached parse results with and without a resolver"""
+    from lyntin.argparser import ArgumentParser
+    ap = ArgumentParser("input=", "cache=2")
+    defaults = {"input": "bob"}
+    self.assertEquals(ap.parse("", defaults.get), {"input": "bob"})
+    self.assertEquals(ap.parse(""), {"input": ""})
+    self.assertEquals(ap.parse("", defaults.get), {"input": "bob"})
+    self.assertEquals(ap.parse(""), {"input": ""})
+
+  def testNotCacheable(self):
+    """tests that we don't cache time arguments"""
+    from lyntin.argparser import ArgumentParser
+    self.assertEquals(ArgumentParser("t:time", "cache=2").getCacheStats(), None)
+    self.assertEquals(ArgumentParser("a b").getCacheStats(), None)
+
+class TestEvalExpression(unittest.TestCase):
+  t = (
+    "95 < 100",
+    "42 < 100 and 3 > 2",
+    "'Joe' == 'Joe'",
+    "7 / 2",
+    "2 ** -1",
+    "1e5 + 1",
+    "010",
+    "'a1b' + r'c2'",
+    "'''a'''",
+    "len('abc')",
+    "3 if 0 else 4",
+    "1 < 2 < 3"
+  )
+
+  def testEvalExpression(self):
+    """tests lyntin.utils.eval_expression"""
+    from lyntin.utils import eval_expression
+    for i in range(0, len(self.t)):
+      c = self.t[i]
+      self.assertEquals(eval_expression(c), eval(c), "test %d" % i)
+      self.assertEquals(type(eval_expression(c)), type(eval(c)), "test %d" % i)
+
+  def testSharedTemplate(self):
+    """tests that literals get pulled out of expression templates"""
+    from lyntin.utils import _hoist_literals
+    self.assertEquals(_hoist_literals("95 < 100")[0],
+                      _hoist_literals("42 < 100")[0])
+    self.assertEquals(_hoist_literals("len('abc')"), None)
+
+class TestLaneQueue(unittest.TestCase):
+  def testWeights(self):
+    """tests lyntin.utils.LaneQueue weighting"""
+    from lyntin.utils import LaneQueue
+    q = LaneQueue([("input", 2), ("mud", 1)], maxwait=60)
+    for i in range(4):
+      q.put("m%d" % i, "mud")
+    for i in range(4):
+      q.put("i%d" % i, "input")
+    self.assertEquals(q.qsize(), 8)
+    self.assertEquals([q.get() for i in range(8)],
+                      ["i0", "m0", "i1", "i2", "m1", "i3", "m2", "m3"])
+
+  def testStarvation(self):
+    """tests that overdue lanes get served"""
+    from lyntin.utils import LaneQueue
+    q = LaneQueue([("input", 1), ("mud", 0)], maxwait=0)
+    q.put("m0", "mud")
+    q.put("m1", "mud")
+    import time
+    time.sleep(0.01)
+    q.put("i0", "input")
+    q.put("i1", "input")
+    self.assertEquals([q.get() for i in range(4)], ["m0", "i0", "m1", "i1"])
+
+  def testFloodHelpers(self):
+    """tests LaneQueue putMerged and waitForRoom"""
+    from lyntin.utils import LaneQueue
+    q = LaneQueue([("input", 1), ("mud", 1)])
+    def merge(old, new):
+      if old[0] == new[0]:
+        old.append(new[1])
+        return 1
+      return 0
+    self.assertEquals(q.putMerged(["a", 1], "mud", merge), 0)
+    self.assertEquals(q.putMerged(["a", 2], "mud", merge), 1)
+    self.assertEquals(q.putMerged(["b", 3], "mud", merge), 0)
+    self.assertEquals(q.depth("mud"), 2)
+    self.assertEquals(q.depth("input"), 0)
+    self.assertEquals(q.waitForRoom("mud", 2, 0.01), 0)
+    self.assertEquals(q.get(), ["a", 1, 2])
+    self.assertEquals(q.waitForRoom("mud", 2, 0.01), 1)
+
+  def testGetBatch(self):
+    """tests LaneQueue getBatch and getLane order"""
+    from lyntin.utils import LaneQueue
+    q = LaneQueue([("input", 2), ("timer", 1), ("mud", 1)], maxwait=60)
+    for i in range(3):
+      q.put("m%d" % i, "mud")
+      q.put("t%d" % i, "timer")
+      q.put("i%d" % i, "input")
+    self.assertEquals(q.getBatch(4), ["i0", "t0", "m0", "i1"])
+    self.assertEquals(q.getLane("mud", 5), ["m1", "m2"])
+    self.assertEquals(q.getLane("mud", 5), [])
+    self.assertEquals(q.getBatch(10), ["i2", "t1", "t2"])
+    self.assertEquals(q.qsize(), 0)
+
+class _BatchEvent:
+  def __init__(self, name, lane, out, queue=None):
+    self.name = name
+    self.lane = lane
+    self._out = out
+    self._queue = queue
+
+  def execute(self):
+    self._out.append(self.name)
+    if self._queue != None:
+      self._queue.put(_BatchEvent("i0", "input", self._out), "input")
+
+class TestRunBatch(unittest.TestCase):
+  def testInputPreempts(self):
+    """tests that input queued during a batch goes ahead of the rest"""
+    from lyntin import engine, utils
+    e = engine.Engine()
+    q = utils.LaneQueue([("input", 8), ("timer", 2), ("mud", 1)])
+    out = []
+    batch = [_BatchEvent("m0", "mud", out, q), _BatchEvent("m1", "mud", out),
+             _BatchEvent("m2", "mud", out)]
+    self.assertEquals(e._runBatch(batch, q), 1)
+    self.assertEquals(out, ["m0", "i0", "m1", "m2"])
+    self.assertEquals(q.qsize(), 0)
+
+  def testMergeOutput(self):
+    """tests lyntin.event.OutputEvent.merge"""
+    from lyntin.event import OutputEvent, MudEvent
+    from lyntin.ui import message
+    e = OutputEvent("a")
+    self.assertEquals(e.merge(OutputEvent("b")), 1)
+    self.assertEquals(e._message, "ab")
+    self.assertEquals(e.merge(MudEvent(None, "c")), 0)
+
+    e = OutputEvent(message.Message("a", message.MUDDATA))
+    self.assertEquals(e.merge(OutputEvent(message.Message("b", message.MUDDATA))), 1)
+    self.assertEquals(e._message.data, "ab")
+    self.assertEquals(e.merge(OutputEvent(message.Message("c", message.ERROR))), 0)
+    self.assertEquals(e.merge(OutputEvent(message.Message("c", message.MUDDATA, 
+                                                          bold=1))), 0)
+    self.assertEquals(e._message.data, "ab")
+
+class _WorkerSession:
+  def getName(self):
+    return "a"
+
+class _WorkerEvent:
+  lane = "mud"
+
+  def __init__(self, ses, name, out, gate=None):
+    self._ses = ses
+    self.name = name
+    self._out = out
+    self._gate = gate
+
+  def getSession(self):
+    return self._ses
+
+  def execute(self):
+    import threading
+    if self._gate != None:
+      self._gate.wait(5)
+    self._out.append((self.name, threading.currentThread().getName()))
+
+class TestSessionWorker(unittest.TestCase):
+  def testStopOrdering(self):
+    """tests that a stopping worker handles its events in order first"""
+    import threading
+    from lyntin import engine, exported
+    oldengine = exported.myengine
+    try:
+      e = engine.Engine()
+      exported.myengine = e
+      e._setupConfiguration()
+      ses = _WorkerSession()
+      out = []
+      gate = threading.Event()
+
+      e._startWorker(ses)
+      worker = e._workers[ses]
+      e._enqueue(_WorkerEvent(ses, "m0", out, gate))
+      e._enqueue(_WorkerEvent(ses, "m1", out))
+      e._stopWorker(ses)
+      e._enqueue(_WorkerEvent(ses, "m2", out))
+
+      # it's still handling m0, so it can't have gone anywhere
+      self.assert_(e._workers.get(ses) is worker)
+      self.assertEquals(e._event_queue.qsize(), 0)
+
+      gate.set()
+      worker._thread.join(5)
+      self.failIf(worker._thread.isAlive())
+      self.assertEquals(out, [("m0", "worker: a"), ("m1", "worker: a"), 
+                              ("m2", "worker: a")])
+      self.failIf(e._workers.has_key(ses))
+
+      e._enqueue(_WorkerEvent(ses, "m3", out))
+      self.assertEquals(e._event_queue.qsize(), 1)
+    finally:
+      exported.myengine = oldengine
+
+class TestFloodControl(unittest.TestCase):
+  def testDisplay(self):
+    """tests that the display floodpolicy bounds the queue"""
+    from lyntin import engine, exported, event
+    oldengine = exported.myengine
+    try:
+      e = engine.Engine()
+      exported.myengine = e
+      e._setupConfiguration()
+      e._queuelimit = 2
+      e._floodpolicy = "display"
+      ses = _WorkerSession()
+      for i in range(10):
+        e._enqueue(event.MudEvent(ses, "line %d\n" % i))
+      self.assertEquals(e._event_queue.depth("mud"), 3)
+
+      events = e._event_queue.getBatch(3)
+      self.assertEquals([mem._filter for mem in events], [1, 1, 0])
+      self.assertEquals(events[2]._input, 
+                        "".join(["line %d\n" % i for i in range(2, 10)]))
+      self.assertEquals(e._flooded.has_key(ses), 1)
+
+      e._enqueue(event.MudEvent(ses, "line 10\n"))
+      self.assertEquals(e._flooded.has_key(ses), 0)
+    finally:
+      exported.myengine = oldengine
+
+class TestPriorityQueueProfiling(unittest.TestCase):
+  def testProfiling(self):
+    """tests lyntin.utils.PriorityQueue profiling"""
+    from lyntin.utils import PriorityQueue
+    def f(x):
+      return x + 1
+    pq = PriorityQueue()
+    pq.add(f)
+    self.assertEquals(pq.getList(), [f])
+    self.assertEquals(pq.getProfile(), [])
+
+    pq.setProfiling(1)
+    for i in range(3):
+      self.assertEquals([mem(1) for mem in pq.getList()], [2])
+    self.assertEquals([mem[:2] for mem in pq.getProfile()], [(f, 3)])
+
+    pq.setProfiling(0)
+    self.assertEquals(pq.getList(), [f])
+    self.assertEquals(pq.getProfile(), [])
+
+class TestHookDispatcher(unittest.TestCase):
+  def testDispatchers(self):
+    """tests lyntin.exported._build_dispatcher"""
+    from lyntin.exported import _build_dispatcher, _NO_ANSWER
+    from lyntin.utils import PriorityQueue
+    calls = []
+    def a(args):
+      calls.append("a")
+      return args["dataadj"] + "a"
+    def b(args):
+      calls.append("b")
+      return None
+
+    pq = PriorityQueue()
+    self.assertEquals(pq.getDispatcher("filter", _build_dispatcher), None)
+    pq.add(a, 1)
+    pq.add(a, 2)
+    self.assertEquals(pq.getDispatcher("filter", _build_dispatcher)(
+                      {"dataadj": "x"}), {"dataadj": "xaa"})
+    self.assertEquals(pq.getDispatcher("query", _build_dispatcher)(
+                      {"dataadj": "x"}), "xa")
+
+    pq.add(b, 0)
+    del calls[:]
+    self.assertEquals(pq.getDispatcher("filter", _build_dispatcher)(
+                      {"dataadj": "x"}), None)
+    self.assertEquals(pq.getDispatcher("broadcast", _build_dispatcher)(
+                      {"dataadj": "x"}), {"dataadj": "x"})
+    self.assertEquals(calls, ["b", "b", "a", "a"])
+
+    pq.remove(a)
+    pq.remove(a)
+    self.assertEquals(pq.getDispatcher("query", _build_dispatcher)(
+                      {"dataadj": "x"}), _NO_ANSWER)
+
+class TestHistogram(unittest.TestCase):
+  def testBuckets(self):
+    """tests lyntin.utils.Histogram"""
+    from lyntin.utils import Histogram
+    h = Histogram([1, 10, 100])
+    for mem in [0.5, 1, 2, 5, 50, 500]:
+      h.add(mem)
+    self.assertEquals(h.getCount(), 6)
+    self.assertEquals(h.getMax(), 500)
+    self.assertEquals(h.getAverage(), 558.5 / 6)
+    self.assertEquals([c for b, c in h.getData()["buckets"]], [2, 2, 1, 1])
+    self.assertEquals(h.getPercentile(50), 10)
+    self.assertEquals(h.getPercentile(100), 500)
+
+class TestDataBuffer(unittest.TestCase):
+  def testListSemantics(self):
+    """tests lyntin.session.DataBuffer against a plain list"""
+    from lyntin.session import DataBuffer
+    for size in [1, 5, DataBuffer.BLOCKLINES, 150]:
+      db = DataBuffer(size)
+      expected = []
+      for i in range(400):
+        text = [u"line %d\n" % i, u"part ", u"caf\xe9\nmore\n"][i % 3]
+        db.addText(text)
+        for mem in text.splitlines(1):
+          if expected and not expected[-1].endswith("\n"):
+            expected[-1] += mem
+          else:
+            expected.append(mem)
+        expected = expected[-size:]
+
+      self.assertEquals(len(db), len(expected))
+      self.assertEquals(list(db), expected)
+      self.assertEquals([db[i] for i in range(len(db))], expected)
+      self.assertEquals(db[-1], expected[-1])
+      self.assertEquals(db[1:4], expected[1:4])
+      self.assertRaises(IndexError, lambda: db[len(expected)])
+
+      db.resize(2)
+      self.assertEquals(list(db), expected[-2:])
+      db.clear()
+      self.assertEquals(len(db), 0)
+
+  def testEncodings(self):
+    """tests lyntin.session.DataBuffer with utf-8 and text that isn't"""
+    from lyntin.session import DataBuffer
+    db = DataBuffer(200)
+    db.addText("caf\xc3\xa9\n")
+    db.addText("caf\xe9\n")
+    db.addText(u"caf\xe9\n")
+    expected = [u"caf\xe9\n", u"caf\ufffd\n", u"caf\xe9\n"]
+    self.assertEquals(list(db), expected)
+    for i in range(DataBuffer.BLOCKLINES):
+      db.addText("line %d\n" % i)
+    self.assertEquals(len(db._blocks), 1)
+    self.assertEquals(db[:3], expected)
+
+  def testArchive(self):
+    """tests lyntin.session.DataBuffer with a ScrollbackArchive"""
+    import tempfile, shutil, os
+    from lyntin.session import DataBuffer, ScrollbackArchive
+    dirname = tempfile.mkdtemp()
+    try:
+      filename = os.path.join(dirname, "a")
+      db = DataBuffer(10)
+      db.addText(u"before\n")
+      db.attachArchive(ScrollbackArchive(filename))
+      expected = [u"before\n"]
+      for i in range(200):
+        db.addText(u"line %d caf\xe9\n" % i)
+        expected.append(u"line %d caf\xe9\n" % i)
+      db.addText(u"partial")
+      expected.append(u"partial")
+
+      self.assertEquals(len(db), len(expected))
+      self.assertEquals(list(db), expected)
+      self.assertEquals(db[5], expected[5])
+      self.assertEquals(db[-1], u"partial")
+      db.detachArchive()
+      self.assertEquals(len(db), 10)
+
+      # a write that didn't finish gets cut off when we open it again
+      f = open(filename, "ab")
+      f.write("half a li")
+      f.close()
+      archive = ScrollbackArchive(filename)
+      self.assertEquals(len(archive), 201)
+      self.assertEquals(archive.getLine(200), u"line 199 caf\xe9\n")
+      archive.append(u"more\n")
+      self.assertEquals(archive.getLine(201), u"more\n")
+      archive.close()
+      self.assertEquals(os.path.getsize(filename + ".idx"), 202 * 8)
+    finally:
+      shutil.rmtree(dirname)
+
+  def testSearch(self):
+    """tests lyntin.session.DataBuffer.search against a linear search"""
+    import re, random
+    from lyntin.session import DataBuffer
+    words = ["the", "orc", "says:", "gold", "coins", u"caf\xe9", "42"]
+    r = random.Random(1)
+    db = DataBuffer(100)
+    patterns = [re.compile(mem) for mem in 
+                ["says: gold", "(orc|the) says:", "^gold", "(?i)ORC", 
+                 "\\d+", u"caf\xe9 the", "nothing"]]
+    for i in range(10):
+      for j in range(r.randint(1, 60)):
+        db.addText(" ".join([r.choice(words) for k in range(5)]) + "\n")
+      db.addText("the orc")
+      lines = list(db)
+      for mem in patterns:
+        for start in (0, len(db) - 10):
+          expected = [(k, lines[k]) for k in range(start, len(lines))
+                      if mem.search(lines[k])]
+          self.assertEquals(list(db.search(mem, start)), expected)
+
+class _HistoryConfig:
+  def get(self, name):
+    return 1
+
+class _HistoryEngine:
+  def getManager(self, name):
+    return _HistoryConfig()
+
+  def hookRegister(self, hookname, func):
+    pass
+
+class TestHistoryManager(unittest.TestCase):
+  def testPrefixIndex(self):
+    """tests lyntin.history.HistoryManager ! lookups"""
+    from lyntin.history import HistoryManager
+    hm = HistoryManager(_HistoryEngine())
+    hm.setSize(3)
+    for mem in ["say hi", "north", "say bye", "south"]:
+      hm.recordHistory(mem)
+    self.assertEquals(hm.getHistory(10), ["south", "say bye", "north"])
+    self.assertEquals(hm.getHistoryItem("!say"), "say bye")
+    self.assertEquals(hm.getHistoryItem("!1"), "say bye")
+    self.assertEquals(hm.getHistoryItem("!0 s=n"), "nouth")
+    self.assertEquals(hm.getHistoryItem("!west"), None)
+    self.assertEquals(hm.complete({"text": "s", "position": 1}),
+                      [("south", 5), ("say bye", 7)])
+
+    hm.recordHistory("east")
+    hm.recordHistory("west")
+    self.assertEquals(hm.getCompletions("say"), [])
+
+  def testHistoryFile(self):
+    """tests lyntin.history.HistoryManager loading the history file"""
+    import tempfile, shutil, os
+    from lyntin.history import HistoryManager
+    dirname = tempfile.mkdtemp()
+    try:
+      filename = os.path.join(dirname, "history")
+      f = open(filename, "w")
+      for i in range(5000):
+        f.write("command %d\n" % i)
+      f.close()
+
+      hm = HistoryManager(_HistoryEngine())
+      hm.setSize(10)
+      hm.setHistoryFile(filename)
+      hm.recordHistory("north")
+      self.assertEquals(hm.getHistory(3), ["north", "command 4999", 
+                                           "command 4998"])
+      hm.setHistoryFile(None)
+
+      hm = HistoryManager(_HistoryEngine())
+      hm.setSize(2)
+      hm.setHistoryFile(filename)
+      self.assertEquals(hm.getHistory(3), ["north", "command 4999"])
+      hm.setHistoryFile(None)
+
+      # a line that isn't utf-8
+      f = open(filename, "w")
+      f.write("north\ncaf\xe9 latin1\nsouth\n")
+      f.close()
+      hm = HistoryManager(_HistoryEngine())
+      hm.setSize(10)
+      hm.setHistoryFile(filename)
+      self.assertEquals(hm.getHistory(3), [u"south", u"caf\ufffd latin1", 
+                                           u"north"])
+      self.assertEquals(hm.getHistoryItem("!so"), u"south")
+      self.assertEquals(hm.getHistoryItem("!caf"), u"caf\ufffd latin1")
+      hm.setHistoryFile(None)
+    finally:
+      shutil.rmtree(dirname)
+
+class _SlowFile:
+  def __init__(self):
+    self.data = []
+    self.closed = 0
+
+  def write(self, text):
+    import time
+    time.sleep(0.02)
+    self.data.append(text)
+
+  def flush(self):
+    pass
+
+  def close(self):
+    self.closed = 1
+
+class TestLogWriter(unittest.TestCase):
+  def _run(self, behind, queuesize=5):
+    import threading
+    from lyntin.modules.logger import LogWriter, WRITER_DEFAULTS
+    settings = WRITER_DEFAULTS.copy()
+    settings.update({"logqueuesize": queuesize, "logflushtime": 0, 
+                     "logbehind": behind})
+    f = _SlowFile()
+    writer = LogWriter(f, settings)
+    threading.Thread(target=writer.run).start()
+    for i in range(50):
+      writer.write(u"%d\n" % i)
+    writer.close()
+    self.assertEquals(f.closed, 1)
+    return u"".join(f.data)
+
+  def testBlock(self):
+    """tests that a blocking LogWriter writes everything in order"""
+    self.assertEquals(self._run("block"), 
+                      u"".join([u"%d\n" % i for i in range(50)]))
+
+  def testDrop(self):
+    """tests that a dropping LogWriter notes what it dropped"""
+    written = 0
+    dropped = 0
+    for mem in self._run("drop").splitlines():
+      if mem.startswith("---"):
+        dropped += int(mem.split()[1])
+      else:
+        written += 1
+    self.assert_(dropped > 0)
+    self.assertEquals(written + dropped, 50)
+
+  def testNoQueue(self):
+    """tests that a logqueuesize less than 1 works like 1"""
+    for queuesize in [0, -3]:
+      self.assertEquals(self._run("block", queuesize), 
+                        u"".join([u"%d\n" % i for i in range(50)]))
+      lines = self._run("drop", queuesize).splitlines()
+      self.assert_(u"0" in lines)
+
+class TestRotatingLog(unittest.TestCase):
+  def testRotation(self):
+    """tests lyntin.modules.logger.RotatingLog rotation and retention"""
+    import tempfile, shutil, os, gzip
+    from lyntin.modules.logger import RotatingLog, parse_size
+    self.assertEquals(parse_size("2k"), 2048)
+    self.assertRaises(ValueError, parse_size, "2q")
+
+    dirname = tempfile.mkdtemp()
+    try:
+      log = RotatingLog(os.path.join(dirname, "mud.log"), rotatesize=10, 
+                        compress="stream", keep=2)
+      for i in range(5):
+        log.write(u"line %d...\n" % i)
+        log.flush()
+      log.close()
+
+      segments = log.getSegments()
+      self.assertEquals(len(segments), 2)
+      self.assertEquals(gzip.open(segments[0]).read(), "line 2...\n")
+      self.assertEquals(gzip.open(segments[1]).read(), "line 3...\n")
+      self.assertEquals(gzip.open(log.name).read(), "line 4...\n")
+    finally:
+      shutil.rmtree(dirname)
+
+class _ChunkFile:
+  def __init__(self):
+    self.writes = []
+
+  def write(self, text):
+    self.writes.append(text)
+
+class TestDumpLines(unittest.TestCase):
+  def testDumpLines(self):
+    """tests lyntin.modules.logger.dump_lines writes in chunks"""
+    from lyntin.modules import logger
+    from lyntin.session import DataBuffer
+    oldlines = logger.DUMP_LINES
+    try:
+      logger.DUMP_LINES = 4
+      db = DataBuffer(100)
+      for i in range(10):
+        db.addText(u"line %d\n" % i)
+      db.addText(u"partial")
+
+      f = _ChunkFile()
+      self.assertEquals(logger.dump_lines(db, f), 10)
+      self.assertEquals([len(mem.splitlines()) for mem in f.writes], [4, 4, 3])
+      self.assertEquals(u"".join(f.writes), u"".join(db))
+
+      f = _ChunkFile()
+      self.assertEquals(logger.dump_lines(DataBuffer(10), f), 0)
+      self.assertEquals(f.writes, [])
+    finally:
+      logger.DUMP_LINES = oldlines
+
+class TestJsonlLog(unittest.TestCase):
+  def testReadRecords(self):
+    """tests lyntin.modules.logger.JsonlLog and read_records"""
+    import tempfile, shutil, os
+    from lyntin.modules import logger
+    from lyntin.modules.logger import JsonlLog, format_record, read_records
+
+    dirname = tempfile.mkdtemp()
+    oldseconds = logger.INDEX_SECONDS
+    try:
+      logger.INDEX_SECONDS = 10
+      filename = os.path.join(dirname, "mud.jsonl")
+      log = JsonlLog(filename)
+      for i in range(100):
+        log.write(format_record(1000.0 + i, "a", "mud", u"line %d\n" % i, 
+                                u"line %d\n" % i))
+      log.close()
+
+      self.assertEquals(len(open(filename + ".idx").readlines()), 10)
+      records = list(read_records(filename, 1050.0, 1052.0))
+      self.assertEquals([mem["text"] for mem in records], 
+                        [u"line 50\n", u"line 51\n", u"line 52\n"])
+      self.assertEquals(records[0]["ses"], u"a")
+    finally:
+      logger.INDEX_SECONDS = oldseconds
+      shutil.rmtree(dirname)
+
+  def testParseSearchTime(self):
+    """tests lyntin.modules.logger.parse_search_time"""
+    import time
+    from lyntin.modules.logger import parse_search_time
+    now = time.mktime((2007, 7, 24, 12, 0, 0, 0, 0, -1))
+    self.assertEquals(parse_search_time("10m", now), now - 600)
+    self.assertEquals(parse_search_time("11:30", now), now - 1800)
+    self.assertEquals(parse_search_time("13:00", now), now - 82800)
+    self.assertEquals(parse_search_time("2007-07-23/12:00", now), now - 86400)
+    self.assertRaises(ValueError, parse_search_time, "soon", now)
+
+class _ConfigEngine:
+  def __init__(self):
+    from lyntin import utils
+    self._hook = utils.PriorityQueue()
+
+  def hookRegister(self, hookname, func):
+    pass
+
+  def getHook(self, hookname):
+    return self._hook
+
+class TestConfigSnapshot(unittest.TestCase):
+  def testSnapshot(self):
+    """tests lyntin.config.ConfigManager.getSnapshot"""
+    from lyntin import config, exported
+    oldengine = exported.myengine
+    try:
+      exported.myengine = e = _ConfigEngine()
+      cm = config.ConfigManager(e)
+      cm.add("ansicolor", config.BoolConfig("ansicolor", 1, 1, ""))
+      snapshot = cm.getSnapshot()
+      self.assertEquals(snapshot.ansicolor, 1)
+      self.assert_(cm.getSnapshot() is snapshot)
+
+      # a change has to show up in the snapshot the hook functions see
+      seen = []
+      e._hook.add(lambda args: seen.append(cm.getSnapshot().ansicolor))
+      cm.change("ansicolor", "off")
+      self.assertEquals(seen, [0])
+      self.assertEquals(cm.getSnapshot().ansicolor, 0)
+      self.assertEquals(snapshot.ansicolor, 1)
+
+      cm.remove("ansicolor")
+      self.failIf(hasattr(cm.getSnapshot(), "ansicolor"))
+    finally:
+      exported.myengine = oldengine
+
+class _SchedSession:
+  _name = "a"
+
+class TestScheduler(unittest.TestCase):
+  def setUp(self):
+    from lyntin.modules import scheduler
+    self.scheduler = scheduler
+    self.s = scheduler.Scheduler()
+    self.out = []
+
+  def _add(self, name, tick, ses=None, repeat=0, tag="none", cmd=None):
+    """adds a quiet event that's due tick seconds ago"""
+    import time
+    if ses == None:
+      ses = _SchedSession()
+    if cmd == None:
+      cmd = self.out.append
+    sevent = self.scheduler.SchedEvent(tick, ses, cmd, repeat=repeat, 
+                                       quiet=1, tag=tag)
+    sevent._args = [name]
+    self.s.addEvent(time.time() - tick, sevent, real=1)
+    return sevent
+
+  def testFiringOrder(self):
+    """tests that due events fire by deadline and then in the order added"""
+    self._add("b", 10)
+    self._add("a", 20)
+    self._add("c", 10)
+    self.s.runDue()
+    self.assertEquals(self.out, ["a", "b", "c"])
+    self.assertEquals(self.s._heap, [])
+    self.assertEquals(self.s._byid, {})
+
+  def testRepeat(self):
+    """tests that repeating events go back in the schedule"""
+    import time
+    sevent = self._add("r", 1, repeat=1)
+    self.s.runDue()
+    self.s.runDue()
+    self.assertEquals(self.out, ["r"])
+    self.assert_(self.s.getEventById(sevent._id) is sevent)
+    self.assert_(sevent._next_time > time.time())
+
+  def testRemove(self):
+    """tests removing events by id, tag, session and '*'"""
+    a = _SchedSession()
+    b = _SchedSession()
+    e0 = self._add("0", -60, ses=a, tag="x")
+    e1 = self._add("1", -60, ses=a, tag="x")
+    e2 = self._add("2", -60, ses=a)
+    e3 = self._add("3", -60, ses=b)
+    e4 = self._add("4", -60, ses=b)
+
+    self.assertEquals(self.s.removeById(e2._id), [repr(e2)])
+    self.assertEquals(self.s.removeById("x"), [repr(e0), repr(e1)])
+    self.failIf(self.s._bysession.has_key(a))
+    self.assertEquals(self.s.removeSession(a), [])
+    self.assertEquals(self.s.removeSession(b), [repr(e3), repr(e4)])
+    self.assertEquals(self.s._byid, {})
+    self.assertEquals(self.s._dead, 5)
+
+    e5 = self._add("5", -60, ses=b)
+    self.assertEquals(self.s.removeById("*"), [repr(e5)])
+    self.assertEquals(self.s._dead, 6)
+
+  def testUnscheduleWhileFiring(self):
+    """tests events unscheduling themselves and others while they fire"""
+    def kill(name):
+      self.out.append(name)
+      self.s.removeById(name)
+
+    r = self._add("r", 10, repeat=1, cmd=kill)
+    r._args = [r._id]
+    e = self._add("e", 5)
+    k = self._add("k", 8, cmd=kill)
+    k._args = [e._id]
+    self.s.runDue()
+    self.assertEquals(self.out, [r._id, e._id])
+    self.assertEquals(self.s._byid, {})
+    self.assertEquals(self.s._heap, [])
+    self.assertEquals(self.s._dead, 0)
+
+  def testDeadCount(self):
+    """tests that compacting while events fire keeps the tombstone count"""
+    def killall(name):
+      self.out.append(name)
+      self.s.removeById("*")
+
+    for i in range(20):
+      self._add("f%d" % i, -60)
+    self._add("k", 10, cmd=killall)
+    for i in range(5):
+      self._add("d%d" % i, 5)
+    self.s.runDue()
+
+    # killall got rid of the future events and compacted the heap, so
+    # the due events it killed after they were popped aren't tombstones
+    self.assertEquals(self.out, ["k"])
+    self.assertEquals(self.s._heap, [])
+    self.assertEquals(self.s._dead, 0)
+
+    self._add("n", 1)
+    self.s.runDue()
+    self.assertEquals(self.out, ["k", "n"])
+    self.assertEquals(self.s._dead, 0)
+
+class TestGetRequiredLiterals(unittest.TestCase):
+  t = (
+    ("says: gold", [u"says: gold"]),
+    ("says:.*gold", [u"says:", u"gold"]),
+    ("(foo|bar)baz", [u"baz"]),
+    ("x*yz", [u"yz"]),
+    ("(?i)abc", []),
+  )
+
+  def testGetRequiredLiterals(self):
+    """tests lyntin.utils.get_required_literals"""
+    import re
+    from lyntin.utils import get_required_literals
+    for i in range(0, len(self.t)):
+      c, s = self.t[i]
+      self.assertEquals(get_required_literals(re.compile(c)), s, "test %d" % i)
+
+class TestFindCommand(unittest.TestCase):
+  names = ["alias", "action", "al", "antigag", "session", "showme", 
+           "^(\\d+)$", "^s(\\w)$"]
+
+  def _oldFind(self, names, word):
+    """how the command line used to get matched: walk the sorted names"""
+    import re
+    names = list(names)
+    names.sort()
+    for mem in names:
+      if mem.startswith("^"):
+        if re.compile(mem).search(word):
+          return mem
+      elif mem.startswith(word):
+        return mem
+    return None
+
+  def testFindCommand(self):
+    """tests lyntin.commandmanager.CommandManager.findCommand"""
+    from lyntin import engine, exported
+    oldengine = exported.myengine
+    try:
+      e = engine.Engine()
+      exported.myengine = e
+      e._setupConfiguration()
+      cm = e.getManager("command")
+      func = lambda ses, args, input: None
+      for mem in self.names:
+        cm.addCommand(mem, func)
+
+      # an exact match, a unique abbreviation, ambiguous ones and the
+      # ^ commands
+      self.assertEquals(cm.findCommand("al"), "al")
+      self.assertEquals(cm.findCommand("ali"), "alias")
+      self.assertEquals(cm.findCommand("ant"), "antigag")
+      self.assertEquals(cm.findCommand("a"), "action")
+      self.assertEquals(cm.findCommand("s"), "session")
+      self.assertEquals(cm.findCommand("42"), "^(\\d+)$")
+      self.assertEquals(cm.findCommand("sx"), "^s(\\w)$")
+      self.assertEquals(cm.findCommand("se"), "^s(\\w)$")
+      self.assertEquals(cm.findCommand("nosuch"), None)
+
+      names = cm.getCommands()
+      words = ["", "a", "ac", "act", "action", "actions", "al", "ali",
+               "alias", "an", "s", "se", "ses", "sh", "showme", "sx", "42",
+               "4x", "x", "#", "^(\\d+)$"]
+      for mem in words:
+        self.assertEquals(cm.findCommand(mem), self._oldFind(names, mem), 
+                          mem)
+
+      # a removed command can't be found, even by its abbreviations
+      cm.removeCommand("al")
+      cm.removeCommand("action")
+      self.assertEquals(cm.findCommand("al"), "alias")
+      self.assertEquals(cm.findCommand("a"), "alias")
+      self.assertEquals(cm.findCommand("act"), None)
+      names = cm.getCommands()
+      for mem in words:
+        self.assertEquals(cm.findCommand(mem), self._oldFind(names, mem), 
+                          mem)
+    finally:
+      exported.myengine = oldengine
+
+class TestAdvanced(unittest.TestCase):
+  def setUp(self):
+    from lyntin.modules import advanced
+    self.advanced = advanced
+    self.oldsize = advanced.CODE_CACHE_SIZE
+    self.oldcache = advanced._code_cache.copy()
+    self.oldorder = advanced._code_cache_order[:]
+    advanced._code_cache.clear()
+    del advanced._code_cache_order[:]
+
+  def tearDown(self):
+    advanced = self.advanced
+    advanced.CODE_CACHE_SIZE = self.oldsize
+    advanced._code_cache.clear()
+    advanced._code_cache.update(self.oldcache)
+    advanced._code_cache_order[:] = self.oldorder
+
+  def testCodeCache(self):
+    """tests lyntin.modules.advanced._compile_source"""
+    advanced = self.advanced
+    advanced.CODE_CACHE_SIZE = 3
+    hits = advanced._code_cache_hits
+    misses = advanced._code_cache_misses
+
+    a = advanced._compile_source("x = 1")
+    self.assert_(advanced._compile_source("x = 1") is a)
+    self.assertEquals(advanced._code_cache_hits - hits, 1)
+    self.assertEquals(advanced._code_cache_misses - misses, 1)
+
+    # incomplete code doesn't get cached
+    self.assertEquals(advanced._compile_source("if 1:"), None)
+    self.failIf(advanced._code_cache.has_key("if 1:"))
+    self.assertRaises(SyntaxError, advanced._compile_source, "x = = 1")
+
+    # the least recently used one goes
+    b = advanced._compile_source("x = 2")
+    advanced._compile_source("x = 3")
+    advanced._compile_source("x = 1")
+    advanced._compile_source("x = 4")
+    self.assertEquals(advanced._code_cache_order, ["x = 3", "x = 1", "x = 4"])
+    self.assert_(advanced._compile_source("x = 1") is a)
+    self.failIf(advanced._compile_source("x = 2") is b)
+
+    d = {}
+    exec advanced._compile_source("y = 6 * 7") in d
+    self.assertEquals(d["y"], 42)
+
+  def testCallUserFunction(self):
+    """tests that #@@ splits its arguments like commands do"""
+    import new
+    from lyntin import engine, exported
+    advanced = self.advanced
+    calls = []
+    def record(*args):
+      calls.append(args)
+
+    usermodule = new.module("lyntinuser")
+    usermodule.record = record
+    oldmodule = sys.modules.get("lyntinuser")
+    oldusermodule = advanced.usermodule
+    oldengine = exported.myengine
+    try:
+      sys.modules["lyntinuser"] = usermodule
+      advanced.usermodule = None
+      e = engine.Engine()
+      exported.myengine = e
+      e._setupConfiguration()
+
+      advanced._call_user_function(None, "record")
+      advanced._call_user_function(None, "record one {two words} three")
+      advanced._call_user_function(None, "nosuch one")
+      self.assertEquals(calls, [(), ("one", "two words", "three")])
+    finally:
+      if oldmodule == None:
+        del sys.modules["lyntinuser"]
+      else:
+        sys.modules["lyntinuser"] = oldmodule
+      advanced.usermodule = oldusermodule
+      exported.myengine = oldengine
+
+_moduleengine = []
+
+def _module_engine():
+  """
+  Returns an Engine with all the modules loaded.  It only gets built
+  once--the modules keep their managers in module globals.  Its 
+  datadir is a temporary directory.
+  """
+  import tempfile, shutil, atexit
+  from lyntin import engine, exported, config
+  import lyntin.modules
+  if not _moduleengine:
+    dirname = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, dirname, 1)
+    config.options["datadir"] = dirname + os.sep
+    oldengine = exported.myengine
+    try:
+      e = engine.Engine()
+      exported.myengine = e
+      e._setupConfiguration()
+      lyntin.modules.load_modules()
+    finally:
+      exported.myengine = oldengine
+    _moduleengine.append(e)
+  return _moduleengine[0]
+
+class TestReadCache(unittest.TestCase):
+  script = ["#alias k {kill %1}",
+            "#action {^%0 arrives.} {look}",
+            "#variable hp 100",
+            "#variable msg {hp is $hp}"]
+  sessions = 0
+
+  def setUp(self):
+    from lyntin import exported
+    self.oldengine = exported.myengine
+    self.oldcommand = exported.lyntin_command
+    self.engine = _module_engine()
+    exported.myengine = self.engine
+
+    # what _read_compiled hands to the user input pipeline (and what
+    # the pipeline hands back to itself)
+    self.slow = []
+    def lyntin_command(text, internal=0, session=None):
+      self.slow.append(text)
+      self.oldcommand(text, internal, session)
+    exported.lyntin_command = lyntin_command
+
+    self.filename = self.engine.getConfigManager().get("datadir") + "script"
+    self._write(self.script)
+
+  def tearDown(self):
+    from lyntin import exported
+    exported.myengine = self.oldengine
+    exported.lyntin_command = self.oldcommand
+
+  def _write(self, lines):
+    f = open(self.filename, "w")
+    f.write("\n".join(lines) + "\n")
+    f.close()
+
+  def _read(self):
+    """reads the script into a new session and returns what it set"""
+    from lyntin import exported
+    from lyntin.modules.tintincmds import _read_compiled
+    TestReadCache.sessions += 1
+    ses = self.engine.createSession("read%d" % TestReadCache.sessions)
+    del self.slow[:]
+    commands = [mem.strip() for mem in open(self.filename).readlines()]
+    _read_compiled(ses, self.filename, "".join(commands), commands)
+
+    state = []
+    for mem in ["alias", "action"]:
+      for item in exported.get_manager(mem).getInfoMappings(mem, ses):
+        item = item.items()
+        item.sort()
+        state.append((mem, item))
+    state.append(("hp", ses.getVariable("hp")))
+    state.append(("msg", ses.getVariable("msg")))
+    return state
+
+  def _cachefiles(self):
+    import os
+    dirname = self.engine.getConfigManager().get("datadir") + "readcache"
+    return [os.path.join(dirname, mem) for mem in os.listdir(dirname)]
+
+  def testHitAndMiss(self):
+    """tests that #read gives the same results from its cache"""
+    from lyntin import exported
+    cm = exported.get_manager("command")
+    compiled = []
+    oldcompile = cm.compileCommand
+    def compileCommand(ses, text):
+      compiled.append(text)
+      return oldcompile(ses, text)
+    cm.compileCommand = compileCommand
+    try:
+      first = self._read()
+      self.assertEquals(compiled, self.script)
+      self.assertEquals(self.slow[0], "#variable msg {hp is $hp}")
+      self.assertEquals(len(self._cachefiles()), 1)
+
+      del compiled[:]
+      self.assertEquals(self._read(), first)
+      self.assertEquals(compiled, [])
+      self.assertEquals(self.slow[0], "#variable msg {hp is $hp}")
+      self.assert_(("msg", "hp is 100") in first)
+    finally:
+      del cm.compileCommand
+
+  def testStale(self):
+    """tests that #read notices when its cache is out of date"""
+    import os, marshal
+    first = self._read()
+
+    # the same file with a different mtime
+    cachefile = self._cachefiles()[0]
+    mtime = int(os.path.getmtime(self.filename))
+    os.utime(self.filename, (mtime + 10, mtime + 10))
+    self.assertEquals(self._read(), first)
+    self.assertEquals(marshal.load(open(cachefile, "rb"))["mtime"], 
+                      mtime + 10)
+
+    # a different file with the same mtime
+    self._write(self.script[:2] + ["#variable hp 50"] + self.script[3:])
+    os.utime(self.filename, (mtime + 10, mtime + 10))
+    second = self._read()
+    self.assert_(("msg", "hp is 50") in second)
+    self.assertEquals(self._read(), second)
+
+    # a cache file that isn't a cache file
+    f = open(cachefile, "wb")
+    f.write("garbage")
+    f.close()
+    self.assertEquals(self._read(), second)
+    self.assertEquals(len(marshal.load(open(cachefile, "rb"))["entries"]), 4)
+
+
 """
 # FIXME - these always fail because we don't get the precision right.
 # not sure what to do about that.
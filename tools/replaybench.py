@@ -0,0 +1,307 @@
+#######################################################################
+# This file is part of Lyntin.
+# copyright (c) Free Software Foundation 2001-2007
+#
+# Lyntin is distributed under the GNU General Public License license.  See the
+# file LICENSE for distribution details.
+#######################################################################
+"""
+Replays a raw mud transcript through the whole incoming data path
+as fast as it can and reports how fast that went.  It's for catching
+performance regressions--run it on the same transcript and profile
+before and after a change.
+
+The transcript is the raw bytes the mud sent us (telnet codes and
+all).  It gets fed through the SocketCommunicator in recv sized
+chunks, the resulting events get handled by the engine the way
+runengine would (mud_filter_hook, actions, highlights, and so on)
+and the output goes to the null ui which counts it and throws it
+away.  If you give it a profile, it gets #read into the replay
+session first so its actions, aliases and such are in play.
+
+The transcript can also be a JSON lines log (#log format=jsonl) 
+ending in .jsonl.  We replay the mud data and prompts from it, 
+encoded with the serverencoding and with a GA after each prompt, and
+skip what the user typed.
+
+It reports:
+
+  - lines per second
+  - time spent in the net stage (telnet codes, line splitting,
+    decoding) and the engine stage (everything else)
+  - execute time by event class (from the eventtiming config item)
+  - time by hook (from #hookprof)
+  - peak memory (Unix only)
+
+Event timing and hook profiling are both on for the whole run, so
+the numbers are a little slower than a bare run, but they're slower
+the same way every time.
+
+usage:
+
+   python replaybench.py [--chunk bytes] [--encoding enc] [--json file] 
+                         transcript [profile]
+
+--encoding sets the serverencoding the way the command line option
+does.  it defaults to the locale's encoding like Lyntin does.
+
+--json writes the results out to a file as JSON so a CI job can
+keep them around and compare them.
+"""
+# we kind of assume this is being run in ./lyntin40/tools/
+import sys, time, getopt, locale, json, StringIO
+sys.path.insert(0, "../")
+
+from lyntin import engine, exported, config, net
+from lyntin.ui import nullui
+
+CHUNKSIZE = 1024
+
+IAC = chr(255)
+GA  = chr(249)
+
+class _NullSocket:
+  """
+  Stands in for the socket so telnet negotiation replies and such
+  have somewhere to go.
+  """
+  def __init__(self):
+    self.sent = 0
+
+  def send(self, data):
+    self.sent += len(data)
+    return len(data)
+
+  def shutdown(self, how):
+    pass
+
+  def close(self):
+    pass
+
+def build_engine():
+  """
+  Builds an engine with the null ui and all the Lyntin modules
+  loaded.  The engine thread doesn't get started--we handle the
+  events ourselves.
+  """
+  if not config.options['serverencoding']:
+    config.options['serverencoding'] = locale.getpreferredencoding()
+
+  e = engine.Engine()
+  engine.Engine.instance = e
+  exported.myengine = e
+  e._setupConfiguration()
+  ui = nullui.get_ui_instance()
+  e.setUI(ui)
+
+  import lyntin.modules
+  lyntin.modules.load_modules()
+  return e, ui
+
+def drain(e):
+  """
+  Handles everything that's in the event queue.
+  """
+  q = e._event_queue
+  batchsize = max(1, e.getConfigManager().get("eventbatchsize"))
+  while q.qsize() > 0:
+    e._runBatch(q.getBatch(batchsize))
+
+def peak_memory():
+  """
+  Returns the peak resident memory in KB or None if we can't tell.
+  """
+  try:
+    import resource
+  except ImportError:
+    return None
+  maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # Linux reports KB and Mac OS X reports bytes
+  if sys.platform == "darwin":
+    maxrss = maxrss / 1024
+  return maxrss
+
+def open_transcript(transcript):
+  """
+  Opens the transcript.  For a JSON lines log, we rebuild what the
+  mud sent from the records.
+
+  @return: a file-like object of the raw bytes
+  @rtype:  file
+  """
+  if not transcript.endswith(".jsonl"):
+    return open(transcript, "rb")
+
+  encoding = config.options["serverencoding"]
+  data = []
+  f = open(transcript, "rb")
+  for line in f:
+    try:
+      record = json.loads(line)
+    except ValueError:
+      continue
+    if record.get("dir") not in ("mud", "prompt"):
+      continue
+    # a literal 255 has to be doubled or it reads as a telnet code
+    raw = record["raw"].encode(encoding, "replace").replace(IAC, IAC + IAC)
+    if record["dir"] == "prompt":
+      raw += IAC + GA
+    data.append(raw)
+  f.close()
+  return StringIO.StringIO("".join(data))
+
+def replay(e, ses, transcript, chunksize):
+  """
+  Feeds the transcript through the SocketCommunicator and handles
+  the resulting events.
+
+  @return: (net time, engine time, bytes) with the times in seconds
+  @rtype:  tuple of (float, float, int)
+  """
+  sc = net.SocketCommunicator(e, ses, "replay", 0)
+  sc._sock = _NullSocket()
+  ses.setSocketCommunicator(sc)
+
+  f = open_transcript(transcript)
+  nettime = 0.0
+  enginetime = 0.0
+  total = 0
+  data = ""
+  while 1:
+    newdata = f.read(chunksize)
+    start = time.time()
+    if newdata:
+      data = sc.handleRead(data, newdata)
+    elif data:
+      # this is what run does when the mud drops us
+      sc.handleData(data)
+    end = time.time()
+    drain(e)
+    nettime += end - start
+    enginetime += time.time() - end
+
+    if not newdata:
+      break
+    total += len(newdata)
+  f.close()
+
+  sc._sock = None
+  ses.setSocketCommunicator(None)
+  return nettime, enginetime, total
+
+def main(transcript, profile, chunksize, jsonfile):
+  e, ui = build_engine()
+  ses = e.createSession("replay")
+  e.changeSession("replay")
+
+  if profile:
+    exported.lyntin_command("%sread %s" %
+        (e.getConfigManager().get("commandchar"), profile.replace("\\", "\\\\")),
+        internal=1, session=ses)
+    drain(e)
+
+  ui.reset()
+  e.getConfigManager().change("eventtiming", 1)
+  e.setHookProfiling(1)
+
+  start = time.time()
+  nettime, enginetime, total = replay(e, ses, transcript, chunksize)
+  elapsed = time.time() - start
+
+  messages, bytes, flushes = ui.getCounts()
+  timings = e.getEventTimings()
+  hooks = e.getHookProfile()
+  memory = peak_memory()
+
+  mudevents = timings.get("MudEvent", {"execute": {"count": 0}})
+  lines = mudevents["execute"]["count"]
+
+  print "replayed %d lines (%d bytes) in %.3fs: %.0f lines/sec" % \
+        (lines, total, elapsed, lines / max(elapsed, 0.000001))
+  print "stages:"
+  print "   net      %8.3fs" % nettime
+  print "   engine   %8.3fs" % enginetime
+
+  print "events (execute):"
+  names = timings.keys()
+  names.sort()
+  for mem in names:
+    data = timings[mem]["execute"]
+    print "   %-24s %8d events %8.3fs total %8.3fms max" % \
+          (mem, data["count"], data["total"], data["max"] * 1000)
+
+  print "hooks:"
+  hooktotals = {}
+  for name, funcs in hooks.items():
+    calls = 0
+    hooktotal = 0.0
+    for func, funccalls, functotal, maxtime in funcs:
+      calls += funccalls
+      hooktotal += functotal
+    hooktotals[name] = (calls, hooktotal)
+  names = hooktotals.keys()
+  names.sort()
+  for mem in names:
+    print "   %-24s %8d calls  %8.3fs total" % \
+          (mem, hooktotals[mem][0], hooktotals[mem][1])
+
+  print "ui:"
+  for mem in messages.keys():
+    if messages[mem]:
+      print "   %-24s %8d messages %8d bytes" % (mem, messages[mem], bytes[mem])
+  print "   %-24s %8d" % ("flushes", flushes)
+
+  if memory != None:
+    print "peak memory: %d KB" % memory
+
+  if jsonfile:
+    import json
+    results = {"created": time.time(),
+               "transcript": transcript,
+               "profile": profile,
+               "lines": lines,
+               "bytes": total,
+               "elapsed": elapsed,
+               "linespersec": lines / max(elapsed, 0.000001),
+               "stages": {"net": nettime, "engine": enginetime},
+               "events": timings,
+               "hooks": hooktotals,
+               "peakmemory": memory}
+    f = open(jsonfile, "w")
+    json.dump(results, f, indent=1, sort_keys=True)
+    f.close()
+    print "results written to %s" % jsonfile
+
+if __name__ == '__main__':
+  try:
+    optlist, args = getopt.getopt(sys.argv[1:], "", ["chunk=", "encoding=", 
+                                                  "json="])
+  except getopt.GetoptError, e:
+    print e
+    print __doc__
+    sys.exit(1)
+
+  if len(args) < 1 or len(args) > 2:
+    print __doc__
+    sys.exit(1)
+
+  chunksize = CHUNKSIZE
+  jsonfile = None
+  for opt, val in optlist:
+    if opt == "--chunk":
+      chunksize = int(val)
+    elif opt == "--encoding":
+      config.options["serverencoding"] = val
+    elif opt == "--json":
+      jsonfile = val
+
+  profile = None
+  if len(args) > 1:
+    profile = args[1]
+  main(args[0], profile, chunksize, jsonfile)
+
+# Local variables:
+# mode:python
+# py-indent-offset:2
+# tab-width:2
+# End:
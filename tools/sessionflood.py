@@ -0,0 +1,111 @@
+#######################################################################
+# This file is part of Lyntin.
+# copyright (c) Free Software Foundation 2001-2007
+#
+# Lyntin is distributed under the GNU General Public License license.  See the
+# file LICENSE for distribution details.
+#######################################################################
+"""
+Shows how much a session getting flooded with mud data holds up
+another session, with and without the sessionworkers config item.
+
+Session "flood" gets a pile of mud lines dumped on it all at once.
+Each line takes a millisecond to handle (like a slow trigger or a
+log write).  Meanwhile session "quiet" gets a line every 50ms and
+we time how long each of those waits before it gets handled.
+
+usage:
+
+   python sessionflood.py [floodlines]
+"""
+# we kind of assume this is being run in ./lyntin40/tools/
+import sys, time, thread
+sys.path.insert(0, "../")
+
+from lyntin import engine, exported, event
+
+LINECOST = 0.001
+PROBES = 20
+PROBEINTERVAL = 0.05
+
+def build_engine():
+  """
+  Builds an engine with no ui and starts the engine thread.
+  """
+  e = engine.Engine()
+  engine.Engine.instance = e
+  exported.myengine = e
+  e._setupConfiguration()
+  exported.hook_register("to_user_hook", lambda args: None)
+  thread.start_new_thread(e.runengine, ())
+  return e
+
+def run(e, floodlines, workers):
+  """
+  Floods one session and probes the other.
+
+  @return: list of probe latencies in seconds
+  @rtype:  list of floats
+  """
+  e.getConfigManager().change("sessionworkers", workers)
+  flood = e.createSession("flood")
+  quiet = e.createSession("quiet")
+
+  latencies = []
+  done = []
+  def mud_filter(args, flood=flood, latencies=latencies, done=done):
+    data = args["dataadj"]
+    if args["session"] is flood:
+      time.sleep(LINECOST)
+      if data == "last\n":
+        done.append(1)
+    elif data.startswith("probe "):
+      latencies.append(time.time() - float(data[6:]))
+    return data
+
+  exported.hook_register("mud_filter_hook", mud_filter)
+
+  for i in range(floodlines):
+    event.MudEvent(flood, "flood line %d\n" % i).enqueue()
+  event.MudEvent(flood, "last\n").enqueue()
+
+  for i in range(PROBES):
+    event.MudEvent(quiet, "probe %r\n" % time.time()).enqueue()
+    time.sleep(PROBEINTERVAL)
+
+  while len(latencies) < PROBES or not done:
+    time.sleep(0.01)
+
+  exported.hook_unregister("mud_filter_hook", mud_filter)
+  e.unregisterSession(flood)
+  e.unregisterSession(quiet)
+
+  # give the session workers a chance to finish up
+  for mem in e._threads:
+    if mem.getName().startswith("worker:"):
+      mem.join(1)
+  return latencies
+
+def main(floodlines):
+  e = build_engine()
+
+  print "%d flood lines at %.1fms each, %d probes every %dms" % \
+        (floodlines, LINECOST * 1000, PROBES, PROBEINTERVAL * 1000)
+  for workers in (0, 1):
+    latencies = run(e, floodlines, workers)
+    latencies.sort()
+    print "   sessionworkers %d: probe latency avg %8.1fms, max %8.1fms" % \
+          (workers, sum(latencies) * 1000 / len(latencies),
+           latencies[-1] * 1000)
+
+if __name__ == '__main__':
+  floodlines = 2000
+  if len(sys.argv) > 1:
+    floodlines = int(sys.argv[1])
+  main(floodlines)
+
+# Local variables:
+# mode:python
+# py-indent-offset:2
+# tab-width:2
+# End:
@@ -11,13 +11,30 @@
 This new test-server is a patchwork of stuff from the existing test server
 and code I wrote for the Varium mud server way back when.  It is actually
 a functional mini-mud now.
+
+With --load yes it's also a load generator: every client that
+connects gets a steady stream of made up mud traffic (see loadgen.py
+for what it can throw at you).  It takes as many connections as you
+want to throw at it, so it's handy for benchmarking a client with
+lots of sessions on localhost.  It prints a summary of what it sent
+every few seconds.
 """
-import socket, sys, Queue, select, string
-import connection, toolsutils
+import socket, sys, Queue, select, string, time
+import connection, toolsutils, loadgen
 from toolsutils import wrap_text
 
 my_world = None
 
+# how often (in seconds) we make up traffic in load mode
+LOADTICK = 0.01
+
+# in load mode we stop making up traffic for a connection when it 
+# has this many bytes waiting to go out
+MAXPENDING = 65536
+
+# how often (in seconds) we print load stats
+STATSINTERVAL = 5
+
 class Event:
   def __init__(self):
     pass
@@ -108,6 +125,7 @@ class World:
     self._ms.startup()
 
     do_heartbeat = self._options["heartbeat"]
+    do_load = self._options["load"] == "yes"
     beat = 0
 
     # this is our main loop thingy!
@@ -118,7 +136,11 @@ class World:
           beat = 0
           self.heartbeat()
 
-      self._ms.networkLoop()
+      if do_load:
+        self._ms.networkLoop(LOADTICK)
+        self._ms.generateLoad()
+      else:
+        self._ms.networkLoop()
 
       if not self._event_queue.empty():
         event = self._event_queue.get(0)
@@ -165,7 +187,7 @@ class World:
       names = map(lambda x:x._name, self._ms._conns)
       for mem in self._npcs:
         names.append(mem._name)
-      out += testutils.wrap_text(string.join(names, ', '), 70, 0, 0)
+      out += toolsutils.wrap_text(string.join(names, ', '), 70, 0, 0)
       out += "\n"
 
       return out
@@ -193,12 +215,30 @@ class MasterServer:
     self._options = options
     self._world = world
 
+    # load mode stuff
+    self._generators = {}
+    self._phases = None
+    self._seed = None
+    self._laststats = None
+    self._lastbytes = 0
+    self._lastlines = 0
+    self._totalbytes = 0
+    self._totallines = 0
+
   def startup(self):
     host = self._options["host"]
     port = int(self._options["port"])
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     s.bind((host, port))
-    s.listen(1)
+    s.listen(socket.SOMAXCONN)
+
+    if self._options["load"] == "yes":
+      if self._options["loadscript"]:
+        self._phases = loadgen.read_loadscript(self._options["loadscript"])
+      if self._options["seed"]:
+        self._seed = int(self._options["seed"])
+      self._laststats = time.time()
 
     print "Test server starting up: %s:%d" % (host, port)
     self._master = connection.Connection(self._world, s, "MASTER")
@@ -208,11 +248,22 @@ class MasterServer:
     self._conns = []
     self._conns.append(self._master)
 
-  def networkLoop(self):
+  def networkLoop(self, timeout=.1):
     fi = []
 
     fns = map(lambda x:x.sockid(), self._conns)
-    fi = select.select(fns, [], [], .1)[0]
+    fo = map(lambda x:x.sockid(), filter(lambda x:x.pending(), self._conns))
+    fi, fo = select.select(fns, fo, [], timeout)[:2]
+
+    for conn in self._conns[:]:
+      if conn.sockid() in fo:
+        try: conn.flushOutput()
+        except Exception, e:
+          print "exception: %s" % e
+          if conn in self._conns:
+            self._conns.remove(conn)
+          conn.killConn()
+
     allconns = filter(lambda x,y=fi:x.sockid() in y, self._conns)
 
     for conn in allconns:
@@ -221,6 +272,15 @@ class MasterServer:
         newconn = connection.Connection(self._world, newsock, newaddr)
         newconn.write("Welcome to Neil's Pub!  Type \"help\" if you're lost.\n")
 
+        if self._options["load"] == "yes":
+          # we want our packets to go out the way we cut them
+          newsock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+          seed = self._seed
+          if seed != None:
+            seed += len(self._generators)
+          self._generators[newconn] = loadgen.LoadGenerator(self._options, 
+                                                            self._phases, seed)
+
         self._conns.append(newconn)
 
       else:
@@ -239,6 +299,47 @@ class MasterServer:
             self._conns.remove(conn)
           conn.killConn()
 
+  def generateLoad(self):
+    """
+    Makes up traffic for each connection and sends it.
+    """
+    now = time.time()
+    for conn, gen in self._generators.items():
+      if conn not in self._conns:
+        self._removeGenerator(conn)
+        continue
+
+      if conn.pending() > MAXPENDING:
+        gen.stall(now)
+        continue
+
+      lines = gen.lines
+      data = gen.generate(now)
+      self._totallines += gen.lines - lines
+      self._totalbytes += len(data)
+      try:
+        conn.writeRaw(data)
+      except Exception, e:
+        print "exception: %s" % e
+        if conn in self._conns:
+          self._conns.remove(conn)
+        conn.killConn()
+
+    if now - self._laststats >= STATSINTERVAL:
+      elapsed = now - self._laststats
+      print "load: %d connections, %.0f lines/sec, %.1f KB/sec" % \
+            (len(self._generators), 
+             (self._totallines - self._lastlines) / elapsed,
+             (self._totalbytes - self._lastbytes) / elapsed / 1024)
+      self._laststats = now
+      self._lastlines = self._totallines
+      self._lastbytes = self._totalbytes
+
+  def _removeGenerator(self, conn):
+    gen = self._generators[conn]
+    del self._generators[conn]
+    print "load for %s: %s" % (str(conn), gen.getStats())
+
   def closedown(self):
     try: self._master.sockid().close()
     except Exception, e: print "closing down master socket: '%s'" % e
@@ -258,6 +359,20 @@ def print_syntax(message=""):
   print "    -p|--port <port>     - sets the port to bind to"
   print "    --heartbeat <yes|no> - sets whether or not to execute heartbeats"
   print
+  print "  load generator mode (see loadgen.py for details):"
+  print "    --load <yes|no>      - sends made up traffic to every connection"
+  print "    --loadscript <file>  - changes the traffic over time"
+  print "    --seed <number>      - seeds the traffic so runs can be repeated"
+  print "    --lps <number>       - lines per second (%s)" % loadgen.DEFAULTS["lps"]
+  print "    --ansi <0.0-1.0>     - fraction of words in color (%s)" % loadgen.DEFAULTS["ansi"]
+  print "    --linelen <min-max>  - line length (%s)" % loadgen.DEFAULTS["linelen"]
+  print "    --prompts <ga|eor|bare|none> - prompt terminator (%s)" % loadgen.DEFAULTS["prompts"]
+  print "    --promptevery <n>    - lines between prompts (%s)" % loadgen.DEFAULTS["promptevery"]
+  print "    --telnet <number>    - telnet/MSDP bursts per second (%s)" % loadgen.DEFAULTS["telnet"]
+  print "    --multibyte <0.0-1.0> - fraction of words with non-ascii (%s)" % loadgen.DEFAULTS["multibyte"]
+  print "    --split <0.0-1.0>    - chance of splitting codes across packets (%s)" % loadgen.DEFAULTS["split"]
+  print "    --encoding <enc>     - encoding for non-ascii (%s)" % loadgen.DEFAULTS["encoding"]
+  print
   if message:
     print message
 
@@ -285,7 +400,9 @@ if __name__ == '__main__':
 
     i = i + 1
 
-  options = {"host": "localhost", "port": "3000", "heartbeat":"yes"}
+  options = {"host": "localhost", "port": "3000", "heartbeat":"yes",
+             "load": "no", "loadscript": "", "seed": ""}
+  options.update(loadgen.DEFAULTS)
   print "Handling arguments."
   for mem in optlist:
     if mem[0] == "--host" or mem[0] == "-h":
@@ -313,6 +430,35 @@ if __name__ == '__main__':
         print_syntax("error: Valid heartbeat settings are 'yes' or 'no'.")
         sys.exit(1)
 
+    elif mem[0] == "--load":
+      if mem[1].lower() == "yes" or mem[1].lower() == "no":
+        options["load"] = mem[1].lower()
+      else:
+        print_syntax("error: Valid load settings are 'yes' or 'no'.")
+        sys.exit(1)
+
+    elif mem[0] == "--loadscript":
+      try:
+        loadgen.read_loadscript(mem[1])
+      except Exception, e:
+        print_syntax("error: Bad load script %s: %s" % (mem[1], e))
+        sys.exit(1)
+      options["loadscript"] = mem[1]
+
+    elif mem[0] == "--seed":
+      if mem[1].isdigit():
+        options["seed"] = mem[1]
+      else:
+        print_syntax("error: Seed needs to be a number.")
+        sys.exit(1)
+
+    elif mem[0][2:] in loadgen.DEFAULTS.keys():
+      error = loadgen.check_options({mem[0][2:]: mem[1]})
+      if error:
+        print_syntax("error: %s" % error)
+        sys.exit(1)
+      options[mem[0][2:]] = mem[1]
+
   print "Host: %s" % options["host"]
   print "Port: %s" % options["port"]
 
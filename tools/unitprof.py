@@ -1,11 +1,464 @@
-import profile
+#######################################################################
+# This file is part of Lyntin.
+# copyright (c) Free Software Foundation 2001-2007
+#
+# Lyntin is distributed under the GNU General Public License license.  See the
+# file LICENSE for distribution details.
+#######################################################################
+"""
+Microbenchmarks for the text processing that happens on every line
+of mud data and every line of user input.  lyntinunittest.py tells
+us whether these things work--this tells us whether they got slower.
 
-def runlots(func, *vargs, **kargs):
-  for mem in range(1000):
-    func(vargs, kargs)
+Each benchmark runs its function over a corpus of made up but
+realistic mud output (combat spam, channels, room descriptions,
+prompts, lots of color) or user input (aliases, speedwalks, #if,
+variables) several times and keeps the best and the median time per
+call.
+
+Times depend on the machine, so we also time a plain Python loop
+(the calibration) and compare benchmarks against the baseline in
+calibration units.  That mostly takes the machine out of it, but a
+baseline is still best made on the machine that checks against it.
+
+usage:
+
+   python unitprof.py [options] [benchmark ...]
+
+   --repeat <n>         - runs each benchmark at least n times (default 5)
+                          and for at least half a second
+   --json <file>        - writes the results to file as JSON
+   --baseline <file>    - compares against this baseline (defaults to
+                          unitprof-baseline.json if it's there)
+   --save-baseline <file> - writes the results out as a new baseline
+   --threshold <ratio>  - slower than the baseline by more than this
+                          is a regression (default 1.25)
+   --list               - lists the benchmarks
+
+It exits with 1 if anything regressed so it can be used in CI.
+"""
+# we kind of assume this is being run in ./lyntin40/tools/
+import sys, os, re, time, random, getopt
+sys.path.insert(0, "../")
+
+from lyntin import engine, exported, config, utils, ansi
+
+FORMAT_VERSION = 1
+REPEAT = 5
+MINTIME = 0.5
+THRESHOLD = 1.25
+SEED = 4242
+CORPUSLINES = 2000
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "unitprof-baseline.json")
+
+MOBS = ["the orc", "a large black dragon", "the cityguard", "Neil",
+        "a rabid squirrel", "the hobgoblin chieftain"]
+VERBS = ["hits", "massacres", "misses", "obliterates", "scratches",
+         "DECIMATES"]
+NAMES = ["Joe", "Willhelm", "glasssnake", "Sara", "Bob"]
+CHATS = ["anyone want to group?", "where do I find the key?", "lol",
+         "selling a longsword, 200 gold", "brb", "that orc is tough"]
+DESCS = ["The market square bustles with merchants and thieves alike.",
+         "A cold wind blows down from the mountains to the north.",
+         "Torches flicker on the walls, casting long shadows."]
+
+MUD_TEMPLATES = [
+  "\33[1;31m%(Mob)s\33[0m %(verb)s you!\r\n",
+  "You %(verb)s %(mob)s.\r\n",
+  "%(name)s tells you '%(chat)s'\r\n",
+  "\33[1;36m[Gossip]\33[0m %(name)s: %(chat)s\r\n",
+  "\33[0;33mThe Market Square\33[0m\r\n",
+  "  %(desc)s\r\n",
+  "\33[1;32m[Exits: north east south west]\33[0m\r\n",
+  "%(count)d gold coins lie here.\r\n",
+  "%(Mob)s is in excellent condition.\r\n",
+  "\33[0;35m<%(hp)dhp %(mp)dm %(mv)dmv>\33[0m \r\n",
+]
+
+INPUT_TEMPLATES = [
+  "kill %(target)s",
+  "kill %(target)s;get all corpse;sacrifice corpse",
+  "#alias {k*} {kill $0;emote attacks $0!}",
+  "#if {$hp < 100} {quaff heal} {say I am fine}",
+  "say I have $hp hp and $mana mana;tell $leader ready",
+  "#action {%%0 tells you '%%1'} {reply got it}",
+  "3n2e;open door;w",
+  "#var {target} {%(target)s};kill $target",
+  "gt {${target}s are everywhere};gt ${leader}!",
+  "cast 'fireball' $target;cast 'fireball' $target;cast 'fireball' $target",
+]
+
+TRIGGERS = ["%0 tells you '%1'", "^You are hungry.", "r[^(\\w+) hits you]",
+            "%0 says %1", "^You receive %0 experience", "[Gossip] %0: %1",
+            "is in excellent condition", "^Exits: %0", "r[(\\d+) gold coins]",
+            "massacres you"]
+
+def make_mud_corpus(lines=CORPUSLINES, seed=SEED):
+  """
+  Returns a list of mud output lines.
+  """
+  r = random.Random(seed)
+  corpus = []
+  for i in range(lines):
+    mob = r.choice(MOBS)
+    corpus.append(r.choice(MUD_TEMPLATES) %
+                  {"mob": mob, "Mob": mob[0].upper() + mob[1:],
+                   "verb": r.choice(VERBS), "name": r.choice(NAMES),
+                   "chat": r.choice(CHATS), "desc": r.choice(DESCS),
+                   "count": r.randint(1, 500), "hp": r.randint(1, 500),
+                   "mp": r.randint(1, 500), "mv": r.randint(1, 500)})
+  return corpus
+
+def make_input_corpus(lines=CORPUSLINES / 4, seed=SEED):
+  """
+  Returns a list of user input lines.
+  """
+  r = random.Random(seed)
+  corpus = []
+  for i in range(lines):
+    corpus.append(r.choice(INPUT_TEMPLATES) %
+                  {"target": r.choice(MOBS).split()[-1]})
+  return corpus
+
+def build_engine():
+  """
+  Builds an engine with the null ui and all the Lyntin modules loaded.
+  """
+  from lyntin.ui import nullui
+
+  if not config.options['serverencoding']:
+    config.options['serverencoding'] = "utf-8"
+  e = engine.Engine()
+  engine.Engine.instance = e
+  exported.myengine = e
+  e._setupConfiguration()
+  e.setUI(nullui.get_ui_instance())
+
+  import lyntin.modules
+  lyntin.modules.load_modules()
+  return e
+
+def drain(e):
+  """
+  Throws away whatever the benchmarks put in the event queue.
+  """
+  q = e._event_queue
+  while q.qsize() > 0:
+    q.getBatch(1000)
+
+
+### ------------------------------------------------
+### benchmarks
+###
+### each bench_ function takes the engine and returns (func, count)
+### where func does count calls of the thing we're timing.
+### ------------------------------------------------
+
+def bench_split_commands(e):
+  corpus = make_input_corpus()
+  split = utils.split_commands
+  def run():
+    for mem in corpus:
+      split(";", mem)
+  return run, len(corpus)
+
+def bench_expand_vars(e):
+  corpus = make_input_corpus()
+  varmap = {"hp": "412", "mana": "97", "leader": "Willhelm",
+            "target": "orc", "0": "dragon"}
+  expand = utils.expand_vars
+  def run():
+    for mem in corpus:
+      expand(mem, varmap)
+  return run, len(corpus)
+
+def bench_compile_regexp(e):
+  corpus = TRIGGERS * 20
+  compile = utils.compile_regexp
+  def run():
+    for mem in corpus:
+      compile(mem, 1)
+  return run, len(corpus)
+
+def bench_split_ansi_from_text(e):
+  corpus = make_mud_corpus()
+  split = ansi.split_ansi_from_text
+  def run():
+    for mem in corpus:
+      split(mem)
+  return run, len(corpus)
+
+def bench_figure_color(e):
+  corpus = [ansi.split_ansi_from_text(mem) for mem in make_mud_corpus()]
+  figure = ansi.figure_color
+  def run():
+    color, leftover = list(ansi.DEFAULT_COLOR), ""
+    for mem in corpus:
+      color, leftover = figure(list(mem), color, leftover)
+  return run, len(corpus)
+
+def bench_checkActions(e):
+  from lyntin.modules import action
+  ses = e.getSession("common")
+  ad = action.ActionData(ses)
+  for mem in TRIGGERS:
+    ad.addAction(mem, "#nop")
+  corpus = make_mud_corpus()
+  def run():
+    for mem in corpus:
+      ad.checkActions(mem)
+    drain(e)
+  return run, len(corpus)
+
+def bench_gag_expand(e):
+  from lyntin.modules import gag
+  gd = gag.GagData()
+  for mem in ["brb", "lol", "^%0 is in excellent condition.",
+              "rabid squirrel", "[Gossip] Bob"]:
+    gd.addGag(mem)
+  corpus = make_mud_corpus()
+  def run():
+    for mem in corpus:
+      gd.expand(mem)
+  return run, len(corpus)
+
+def bench_highlight_expand(e):
+  from lyntin.modules import highlight
+  hd = highlight.HighlightData()
+  for style, text in [("red", "dragon"), ("bold blue", "Willhelm"),
+                      ("green", "gold coins"), ("yellow", "tells you"),
+                      ("reverse", "DECIMATES"), ("cyan", "*guard")]:
+    hd.addHighlight(style, text)
+  corpus = make_mud_corpus()
+  def run():
+    for mem in corpus:
+      hd.expand(mem)
+  return run, len(corpus)
+
+def bench_substitute_expand(e):
+  from lyntin.modules import substitute
+  sd = substitute.SubstituteData()
+  for item, sub in [("massacres", "MASSACRES"), ("the orc", "an orc"),
+                    ("gold coins", "gp"), ("%0 tells you '%1'", "[tell] %0: %1"),
+                    ("excellent condition", "100%")]:
+    sd.addSubstitute(item, sub)
+  corpus = make_mud_corpus()
+  def run():
+    for mem in corpus:
+      sd.expand(mem)
+  return run, len(corpus)
+
+def bench_addToDataBuffer(e):
+  ses = e.getSession("bench")
+  if ses == None:
+    ses = e.createSession("bench")
+  corpus = make_mud_corpus()
+  def run():
+    for mem in corpus:
+      ses.addToDataBuffer(mem)
+  return run, len(corpus)
+
+BENCHMARKS = [
+  ("utils.split_commands", bench_split_commands),
+  ("utils.expand_vars", bench_expand_vars),
+  ("utils.compile_regexp", bench_compile_regexp),
+  ("ansi.split_ansi_from_text", bench_split_ansi_from_text),
+  ("ansi.figure_color", bench_figure_color),
+  ("ActionData.checkActions", bench_checkActions),
+  ("GagData.expand", bench_gag_expand),
+  ("HighlightData.expand", bench_highlight_expand),
+  ("SubstituteData.expand", bench_substitute_expand),
+  ("Session.addToDataBuffer", bench_addToDataBuffer),
+]
+
+def calibrate(repeat):
+  """
+  Times a plain Python loop so we can compare machines.
+
+  @return: the best time for the loop in seconds
+  @rtype:  float
+  """
+  def run():
+    total = 0
+    for i in xrange(20000):
+      total += i % 7
+    return total
+  return timeit(run, repeat)[0]
+
+def timeit(func, repeat):
+  """
+  Runs func at least repeat times and for at least MINTIME seconds.
+  The best time is the one to look at--it's the one with the least
+  interference from whatever else the machine is doing.
+
+  @return: (best, median) in seconds
+  @rtype:  tuple of (float, float)
+  """
+  # once to warm up caches
+  func()
+  times = []
+  total = 0.0
+  while len(times) < repeat or total < MINTIME:
+    start = time.time()
+    func()
+    times.append(time.time() - start)
+    total += times[-1]
+  times.sort()
+  return times[0], times[len(times) / 2]
+
+def run_benchmarks(names, repeat):
+  """
+  Runs the benchmarks.
+
+  @return: the results which is what gets written out as JSON
+  @rtype:  dict
+  """
+  e = build_engine()
+  results = {"version": FORMAT_VERSION,
+             "python": sys.version.split()[0],
+             "platform": sys.platform,
+             "repeat": repeat,
+             "calibration": calibrate(repeat),
+             "benchmarks": {}}
+  for name, bench in BENCHMARKS:
+    if names and name not in names:
+      continue
+    # start each benchmark with the same regular expression cache so
+    # the results don't depend on which benchmarks ran before it
+    re.purge()
+    func, count = bench(e)
+    best, median = timeit(func, repeat)
+    results["benchmarks"][name] = {"calls": count,
+                                   "best": best / count,
+                                   "median": median / count}
+
+  # calibrate again in case the machine got busy or idle while we
+  # were going
+  results["calibration"] = min(results["calibration"], calibrate(repeat))
+  return results
+
+def compare(results, baseline, threshold):
+  """
+  Compares results against the baseline in calibration units.
+
+  @return: dict of benchmark name -> ratio (new / old) for the
+      benchmarks that are in both
+  @rtype:  dict
+  """
+  ratios = {}
+  scale = baseline["calibration"] / results["calibration"]
+  for name, data in results["benchmarks"].items():
+    old = baseline["benchmarks"].get(name)
+    if old and old["best"] > 0:
+      ratios[name] = data["best"] * scale / old["best"]
+  return ratios
+
+def write_json(results, filename):
+  import json
+  f = open(filename, "w")
+  json.dump(results, f, indent=1, sort_keys=True)
+  f.write("\n")
+  f.close()
+
+def main(names, repeat, jsonfile, baselinefile, savefile, threshold):
+  results = run_benchmarks(names, repeat)
+
+  baseline = None
+  if baselinefile:
+    import json
+    f = open(baselinefile, "r")
+    baseline = json.load(f)
+    f.close()
+    if baseline.get("version") != FORMAT_VERSION:
+      print "baseline %s is format version %s--ignoring it." % \
+            (baselinefile, baseline.get("version"))
+      baseline = None
+
+  ratios = {}
+  if baseline:
+    ratios = compare(results, baseline, threshold)
+
+  print "calibration: %.2fms" % (results["calibration"] * 1000)
+  print "%-28s %10s %10s %8s" % ("benchmark", "best us", "median us",
+                                 "vs base")
+  regressions = []
+  for name, bench in BENCHMARKS:
+    if not results["benchmarks"].has_key(name):
+      continue
+    data = results["benchmarks"][name]
+    line = "%-28s %10.2f %10.2f" % (name, data["best"] * 1000000,
+                                    data["median"] * 1000000)
+    if ratios.has_key(name):
+      line += " %7.2fx" % ratios[name]
+      if ratios[name] > threshold:
+        line += "  REGRESSION"
+        regressions.append(name)
+    print line
+
+  if jsonfile:
+    results["ratios"] = ratios
+    write_json(results, jsonfile)
+    print "results written to %s" % jsonfile
+
+  if savefile:
+    results.pop("ratios", None)
+    write_json(results, savefile)
+    print "baseline written to %s" % savefile
+
+  if regressions:
+    print "%d regression(s) over %.2fx: %s" % (len(regressions), threshold,
+                                              ", ".join(regressions))
+    return 1
+  return 0
 
 if __name__ == '__main__':
-  import sys
+  try:
+    optlist, args = getopt.getopt(sys.argv[1:], "",
+        ["repeat=", "json=", "baseline=", "save-baseline=", "threshold=",
+         "list", "help"])
+  except getopt.GetoptError, e:
+    print e
+    print __doc__
+    sys.exit(2)
+
+  repeat = REPEAT
+  jsonfile = None
+  baselinefile = None
+  savefile = None
+  threshold = THRESHOLD
+  for opt, val in optlist:
+    if opt == "--repeat":
+      repeat = max(1, int(val))
+    elif opt == "--json":
+      jsonfile = val
+    elif opt == "--baseline":
+      baselinefile = val
+    elif opt == "--save-baseline":
+      savefile = val
+    elif opt == "--threshold":
+      threshold = float(val)
+    elif opt == "--list":
+      for name, bench in BENCHMARKS:
+        print name
+      sys.exit(0)
+    elif opt == "--help":
+      print __doc__
+      sys.exit(0)
+
+  known = [mem[0] for mem in BENCHMARKS]
+  for mem in args:
+    if mem not in known:
+      print "unknown benchmark %s.  try --list." % mem
+      sys.exit(2)
+
+  if baselinefile == None and savefile == None and os.path.exists(BASELINE):
+    baselinefile = BASELINE
 
-  sys.path.insert(0, "../")
+  sys.exit(main(args, repeat, jsonfile, baselinefile, savefile, threshold))
 
+# Local variables:
+# mode:python
+# py-indent-offset:2
+# tab-width:2
+# End: